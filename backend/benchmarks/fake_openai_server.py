@@ -0,0 +1,153 @@
+"""OpenAI-compatible fake server for load tests: chat completions (plain and streamed) and embeddings.
+
+    python -m backend.benchmarks.fake_openai_server --port 9100 --latency 0.4 --tokens-per-second 60
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from ..services.fake_openai import DEFAULT_FAKE_REPLY, embed_text, estimate_usage
+
+
+@dataclass
+class FakeServerConfig:
+    reply: str = DEFAULT_FAKE_REPLY
+    latency: float = 0.3
+    tokens_per_second: float = 50.0
+    chars_per_token: int = 4
+    error_rate: float = 0.0
+
+
+def _tokens(reply: str, chars_per_token: int) -> list[str]:
+    return [reply[start : start + chars_per_token] for start in range(0, len(reply), chars_per_token)]
+
+
+def create_app(config: FakeServerConfig) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    app.state.config = config
+    app.state.requests = 0
+
+    def _should_fail() -> bool:
+        # Deterministic spacing instead of random draws keeps runs comparable.
+        app.state.requests += 1
+        return config.error_rate > 0 and app.state.requests % round(1 / config.error_rate) == 0
+
+    @app.get("/health")
+    async def health() -> dict[str, Any]:
+        return {"status": "ok", "requests": app.state.requests}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request) -> Any:
+        body = await request.json()
+        if _should_fail():
+            await asyncio.sleep(config.latency)
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": "1"},
+            )
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4o-mini")
+        tokens = _tokens(config.reply, config.chars_per_token)
+        usage = estimate_usage(body.get("messages", []), config.reply)
+        delay = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.latency + delay * len(tokens))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": config.reply},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+
+        def chunk(delta: dict[str, Any], finish_reason: str | None = None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events() -> AsyncIterator[str]:
+            await asyncio.sleep(config.latency)
+            yield chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                if delay:
+                    await asyncio.sleep(delay)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage,
+                }
+                yield f"data: {json.dumps(payload)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request) -> dict[str, Any]:
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        return {
+            "object": "list",
+            "model": body.get("model", "text-embedding-3-small"),
+            "data": [
+                {"object": "embedding", "index": index, "embedding": embed_text(text)}
+                for index, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds until the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="0 sends all tokens at once")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--reply", default=DEFAULT_FAKE_REPLY)
+    args = parser.parse_args()
+
+    config = FakeServerConfig(
+        reply=args.reply,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""Load test a uvicorn process backed by the fake OpenAI server (latency percentiles, throughput, DB statements/turn).
+
+    python -m backend.benchmarks.load_test conversation --users 50 --messages 5
+    python -m backend.benchmarks.load_test conversation --stream --save backend/benchmarks/baselines/sqlite.json
+    python -m backend.benchmarks.load_test websocket --sessions 20 --clients 10 --messages 3
+    python -m backend.benchmarks.load_test conversation --database-url postgresql+asyncpg://user:pw@localhost/bench
+    python -m backend.benchmarks.load_test conversation --baseline backend/benchmarks/baselines/sqlite.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import httpx
+
+from .turn_roundtrips import percentile
+
+API_KEY = "benchmark"
+REPO_ROOT = Path(__file__).resolve().parents[2]
+# Free-text questions so neither the intent router nor the response cache short-circuits OpenAI.
+QUESTION = "Ich habe seit einigen Tagen leichte Beschwerden und eine Frage dazu (Anfrage {user}-{turn})."
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def measure(self, operation: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await call()
+        except Exception:  # noqa: BLE001
+            self.errors[operation] += 1
+            return None
+        self.samples[operation].append((time.perf_counter() - started) * 1000)
+        return result
+
+    def record(self, operation: str, milliseconds: float) -> None:
+        self.samples[operation].append(milliseconds)
+
+    def requests(self) -> int:
+        return sum(len(samples) for samples in self.samples.values())
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        operations = sorted(set(self.samples) | set(self.errors))
+        return {
+            operation: {
+                "count": len(self.samples[operation]),
+                "errors": self.errors[operation],
+                "p50_ms": round(percentile(self.samples[operation], 50), 2) if self.samples[operation] else 0.0,
+                "p95_ms": round(percentile(self.samples[operation], 95), 2) if self.samples[operation] else 0.0,
+                "p99_ms": round(percentile(self.samples[operation], 99), 2) if self.samples[operation] else 0.0,
+            }
+            for operation in operations
+        }
+
+
+async def _db_statements(client: httpx.AsyncClient) -> float:
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    return sum(
+        float(line.rsplit(" ", 1)[1])
+        for line in response.text.splitlines()
+        if line.startswith("db_query_duration_seconds_count")
+    )
+
+
+async def _create_session(client: httpx.AsyncClient) -> str:
+    response = await client.post("/api/chat/session")
+    response.raise_for_status()
+    return response.json()["session_id"]
+
+
+async def _send_message(client: httpx.AsyncClient, session_id: str, content: str) -> None:
+    response = await client.post("/api/chat/message", json={"session_id": session_id, "content": content})
+    response.raise_for_status()
+
+
+async def _stream_message(client: httpx.AsyncClient, recorder: Recorder, session_id: str, content: str) -> None:
+    started = time.perf_counter()
+    first_delta = True
+    async with client.stream(
+        "POST", "/api/chat/message/stream", json={"session_id": session_id, "content": content}
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_delta and line.startswith("event: assistant_delta"):
+                recorder.record("first_delta", (time.perf_counter() - started) * 1000)
+                first_delta = False
+
+
+async def _get_history(client: httpx.AsyncClient, session_id: str) -> None:
+    response = await client.get(f"/api/chat/history/{session_id}")
+    response.raise_for_status()
+
+
+async def conversation_scenario(client: httpx.AsyncClient, args: argparse.Namespace) -> dict[str, Any]:
+    recorder = Recorder()
+    started = time.perf_counter()
+
+    sessions = await asyncio.gather(
+        *(recorder.measure("create_session", lambda: _create_session(client)) for _ in range(args.users))
+    )
+    sessions = [session_id for session_id in sessions if session_id is not None]
+
+    async def user(index: int, session_id: str) -> None:
+        for turn in range(args.messages):
+            content = QUESTION.format(user=index, turn=turn)
+            if args.stream:
+                await recorder.measure(
+                    "message_stream", lambda: _stream_message(client, recorder, session_id, content)
+                )
+            else:
+                await recorder.measure("message", lambda: _send_message(client, session_id, content))
+
+    statements_before = await _db_statements(client)
+    turns_started = time.perf_counter()
+    await asyncio.gather(*(user(index, session_id) for index, session_id in enumerate(sessions)))
+    turns_elapsed = time.perf_counter() - turns_started
+    statements = await _db_statements(client) - statements_before
+
+    await asyncio.gather(
+        *(
+            recorder.measure("history", lambda session_id=session_id: _get_history(client, session_id))
+            for session_id in sessions
+        )
+    )
+    elapsed = time.perf_counter() - started
+    turns = len(recorder.samples["message_stream" if args.stream else "message"])
+    return _report(recorder, elapsed, turns, turns_elapsed, statements)
+
+
+async def websocket_scenario(client: httpx.AsyncClient, args: argparse.Namespace) -> dict[str, Any]:
+    import websockets
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    sessions = [
+        session_id
+        for session_id in await asyncio.gather(
+            *(recorder.measure("create_session", lambda: _create_session(client)) for _ in range(args.sessions))
+        )
+        if session_id is not None
+    ]
+    ws_base = str(client.base_url).replace("http://", "ws://", 1)
+
+    async def connect(session_id: str) -> list[Any]:
+        url = f"{ws_base}/api/chat/ws/{session_id}?api_key={API_KEY}"
+        return [await websockets.connect(url) for _ in range(args.clients)]
+
+    async def session(index: int, sockets: list[Any]) -> None:
+        for turn in range(args.messages):
+            sent = time.perf_counter()
+            content = QUESTION.format(user=index, turn=turn)
+            await sockets[0].send(json.dumps({"content": content, "stream": True}))
+
+            async def until_reply(websocket: Any, sender: bool) -> None:
+                first_delta = sender
+                while True:
+                    frame = json.loads(await websocket.recv())
+                    if first_delta and frame.get("type") == "assistant_delta":
+                        recorder.record("ws_first_delta", (time.perf_counter() - sent) * 1000)
+                        first_delta = False
+                    if frame.get("type") in ("assistant_message", "error"):
+                        return
+
+            replies = (until_reply(websocket, position == 0) for position, websocket in enumerate(sockets))
+            await asyncio.wait_for(asyncio.gather(*replies), timeout=args.timeout)
+            # Fan-out latency: the slowest of the session's sockets to see the final frame.
+            recorder.record("ws_turn_fanout", (time.perf_counter() - sent) * 1000)
+
+    connections = await asyncio.gather(*(connect(session_id) for session_id in sessions))
+    try:
+        statements_before = await _db_statements(client)
+        turns_started = time.perf_counter()
+        results = await asyncio.gather(
+            *(session(index, sockets) for index, sockets in enumerate(connections)), return_exceptions=True
+        )
+        recorder.errors["ws_turn_fanout"] += sum(isinstance(result, BaseException) for result in results)
+        turns_elapsed = time.perf_counter() - turns_started
+        statements = await _db_statements(client) - statements_before
+    finally:
+        await asyncio.gather(
+            *(websocket.close() for sockets in connections for websocket in sockets), return_exceptions=True
+        )
+
+    elapsed = time.perf_counter() - started
+    return _report(recorder, elapsed, len(recorder.samples["ws_turn_fanout"]), turns_elapsed, statements)
+
+
+def _report(
+    recorder: Recorder, elapsed: float, turns: int, turns_elapsed: float, statements: float
+) -> dict[str, Any]:
+    return {
+        "operations": recorder.summary(),
+        "requests_per_second": round(recorder.requests() / elapsed, 2) if elapsed else 0.0,
+        "turns_per_second": round(turns / turns_elapsed, 2) if turns_elapsed else 0.0,
+        "db_statements_per_turn": round(statements / turns, 2) if turns else 0.0,
+    }
+
+
+SCENARIOS = {"conversation": conversation_scenario, "websocket": websocket_scenario}
+
+
+def _spawn(command: list[str], env: dict[str, str], quiet: bool) -> subprocess.Popen:
+    stdout = subprocess.DEVNULL if quiet else None
+    return subprocess.Popen(command, cwd=REPO_ROOT, env={**os.environ, **env}, stdout=stdout)
+
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+def _compare(result: dict[str, Any], baseline: dict[str, Any]) -> list[str]:
+    def delta(current: float, previous: float) -> str:
+        return f"{(current - previous) / previous * 100:+.1f}%" if previous else "n/a"
+
+    lines = []
+    for operation, stats in result["operations"].items():
+        previous = baseline["operations"].get(operation)
+        if previous:
+            change = delta(stats["p95_ms"], previous["p95_ms"])
+            lines.append(f"  {operation:<22} p95 {stats['p95_ms']:>9.2f} ms  ({change})")
+    for key in ("requests_per_second", "turns_per_second", "db_statements_per_turn"):
+        lines.append(f"  {key:<24} {result[key]:>9.2f}  ({delta(result[key], baseline.get(key, 0.0))})")
+    return lines
+
+
+def _print(result: dict[str, Any]) -> None:
+    print(f"{'operation':<18}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for operation, stats in result["operations"].items():
+        print(
+            f"{operation:<18}{stats['count']:>7}{stats['errors']:>8}"
+            f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+        )
+    print(
+        f"requests/s {result['requests_per_second']:.2f}, turns/s {result['turns_per_second']:.2f}, "
+        f"DB statements/turn {result['db_statements_per_turn']:.2f}"
+    )
+
+
+async def main(args: argparse.Namespace) -> int:
+    database_url = args.database_url or f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/load.db"
+    openai_port, app_port = _free_port(), _free_port()
+
+    fake_openai = _spawn(
+        [
+            sys.executable,
+            "-m",
+            "backend.benchmarks.fake_openai_server",
+            "--port",
+            str(openai_port),
+            "--latency",
+            str(args.openai_latency),
+            "--tokens-per-second",
+            str(args.tokens_per_second),
+            "--error-rate",
+            str(args.openai_error_rate),
+        ],
+        {},
+        quiet=True,
+    )
+    app = _spawn(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "backend.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(app_port),
+            "--log-level",
+            "warning",
+        ],
+        {
+            "DATABASE_URL": database_url,
+            "OPENAI_API_KEY": API_KEY,
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+            "OPENAI_FAKE": "false",
+            "API_KEY": API_KEY,
+            "ENFORCE_HTTPS": "false",
+            "RATE_LIMIT_ENABLED": "false",
+            "METRICS_ENABLED": "true",
+        },
+        quiet=not args.verbose,
+    )
+    try:
+        await _wait_ready(f"http://127.0.0.1:{openai_port}/health", fake_openai)
+        await _wait_ready(f"http://127.0.0.1:{app_port}/health", app)
+        limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{app_port}",
+            headers={"X-API-Key": API_KEY},
+            limits=limits,
+            timeout=args.timeout,
+        ) as client:
+            result = await SCENARIOS[args.scenario](client, args)
+    finally:
+        for process in (app, fake_openai):
+            process.terminate()
+        for process in (app, fake_openai):
+            process.wait(timeout=10)
+
+    result = {
+        "scenario": args.scenario,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "parameters": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("scenario", "save", "baseline", "database_url", "max_regression", "verbose")
+        },
+        "environment": {
+            "database": database_url.split(":", 1)[0],
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        **result,
+    }
+    _print(result)
+
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps(result, indent=2) + "\n", encoding="utf-8")
+        print(f"Saved results to {args.save}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        print(f"Compared with {args.baseline} ({baseline['created_at']}):")
+        print("\n".join(_compare(result, baseline)))
+        if args.max_regression is not None:
+            regressed = [
+                operation
+                for operation, stats in result["operations"].items()
+                if operation in baseline["operations"]
+                and stats["p95_ms"] > baseline["operations"][operation]["p95_ms"] * (1 + args.max_regression / 100)
+            ]
+            if regressed:
+                print(f"p95 regression above {args.max_regression:.0f}%: {', '.join(regressed)}")
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--users", type=int, default=20, help="concurrent users (conversation)")
+    parser.add_argument("--messages", type=int, default=5, help="messages per user or session")
+    parser.add_argument("--stream", action="store_true", help="use the SSE endpoint (conversation)")
+    parser.add_argument("--sessions", type=int, default=10, help="sessions (websocket)")
+    parser.add_argument("--clients", type=int, default=5, help="WebSocket clients per session (websocket)")
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="share of OpenAI calls answered with 429")
+    parser.add_argument("--connections", type=int, default=100, help="HTTP connection pool size")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--verbose", action="store_true", help="show the application log")
+    parser.add_argument("--save", default=None, help="write the results as JSON")
+    parser.add_argument("--baseline", default=None, help="compare against a saved results file")
+    parser.add_argument("--max-regression", type=float, default=None, help="fail if a p95 grows by more than N%%")
+    sys.exit(asyncio.run(main(parser.parse_args())))
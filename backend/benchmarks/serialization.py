@@ -0,0 +1,115 @@
+"""Compare JSON encode cost of history pages and WebSocket frames: pydantic/FastAPI vs. stdlib json vs. orjson.
+
+    python -m backend.benchmarks.serialization
+    python -m backend.benchmarks.serialization --sizes 10 1000 10000 --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("API_KEY", "benchmark")
+
+CONTENT = (
+    "Vielen Dank für Ihre Nachricht. Die Hausarztpraxis Orchideenkamp ist Montag bis Freitag "
+    "von 08:00 bis 13:00 Uhr erreichbar. Für ein Folgerezept nennen Sie bitte Name und Geburtsdatum."
+)
+
+
+def _payloads(session_id: uuid.UUID, count: int) -> list[dict[str, Any]]:
+    started = datetime.now(timezone.utc)
+    return [
+        {
+            "message_id": str(uuid.uuid4()),
+            "session_id": str(session_id),
+            "role": "user" if index % 2 == 0 else "assistant",
+            "content": CONTENT,
+            "timestamp": (started + timedelta(seconds=index)).isoformat(),
+        }
+        for index in range(count)
+    ]
+
+
+def _legacy_history(session_id: uuid.UUID, payloads: list[dict[str, Any]]) -> bytes:
+    # What get_history did before: one MessageResponse per row, then FastAPI's
+    # response_model validation, jsonable_encoder and JSONResponse.render.
+    from fastapi.encoders import jsonable_encoder
+
+    from ..models.schemas import HistoryResponse, MessageResponse
+
+    messages = [MessageResponse(**payload) for payload in payloads]
+    response = HistoryResponse.validate(HistoryResponse(session_id=session_id, messages=messages).dict())
+    return json.dumps(
+        jsonable_encoder(response), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _encoders() -> dict[str, Callable[[Any], bytes]]:
+    from ..serialization import _stdlib_dumps
+
+    encoders = {"json": _stdlib_dumps}
+    try:
+        import orjson
+    except ImportError:
+        print("orjson is not installed, skipping it.")
+    else:
+        encoders["orjson"] = orjson.dumps
+    return encoders
+
+
+def _measure(call: Callable[[], bytes], repeat: int) -> tuple[float, int]:
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = len(call())
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), size
+
+
+def main(sizes: list[int], repeat: int) -> None:
+    session_id = uuid.uuid4()
+    encoders = _encoders()
+
+    print(f"{'payload':<22}{'encoder':<18}{'median ms':>12}{'µs/message':>12}{'bytes':>12}")
+    for count in sizes:
+        payloads = _payloads(session_id, count)
+        page = {
+            "session_id": str(session_id),
+            "messages": payloads,
+            "has_more": False,
+            "before_cursor": None,
+            "after_cursor": None,
+        }
+        cases: list[tuple[str, Callable[[], bytes]]] = [
+            ("pydantic+fastapi", lambda: _legacy_history(session_id, payloads))
+        ]
+        cases += [(name, lambda encode=encode: encode(page)) for name, encode in encoders.items()]
+        for name, call in cases:
+            seconds, size = _measure(call, repeat)
+            label = f"history ({count})"
+            print(f"{label:<22}{name:<18}{seconds * 1000:>12.3f}{seconds * 1e6 / count:>12.2f}{size:>12}")
+
+    # One broadcast frame, encoded once and shared by every socket of the session.
+    frame = {"type": "assistant_message", "message": _payloads(session_id, 1)[0]}
+    frame_cases: list[tuple[str, Callable[[], bytes]]] = [
+        ("json.dumps(str)", lambda: json.dumps(frame, default=str).encode("utf-8"))
+    ]
+    frame_cases += [(name, lambda encode=encode: encode(frame)) for name, encode in encoders.items()]
+    for name, call in frame_cases:
+        seconds, size = _measure(call, repeat * 100)
+        print(f"{'ws frame':<22}{name:<18}{seconds * 1000:>12.4f}{seconds * 1e6:>12.2f}{size:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    main(args.sizes, args.repeat)
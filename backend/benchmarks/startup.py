@@ -0,0 +1,125 @@
+"""Measure cold start: import time of the application and time until /health answers.
+
+    python -m backend.benchmarks.startup
+    python -m backend.benchmarks.startup --repeat 10 --workers 4 --importtime
+    python -m backend.benchmarks.startup --database-url postgresql+asyncpg://user:pw@localhost/bench
+"""
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from .load_test import API_KEY, REPO_ROOT, _free_port, _wait_ready
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import backend.main; print(time.perf_counter() - started)"
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def _env(database_url: str, **extra: str) -> dict[str, str]:
+    return {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "OPENAI_API_KEY": API_KEY,
+        "OPENAI_FAKE": "true",
+        "API_KEY": API_KEY,
+        "ENFORCE_HTTPS": "false",
+        **extra,
+    }
+
+
+def measure_import(database_url: str, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET],
+            cwd=REPO_ROOT,
+            env=_env(database_url),
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        samples.append(float(output.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def heaviest_imports(database_url: str, top: int) -> list[tuple[str, float]]:
+    # Self time per top-level package, from `python -X importtime`.
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.main"],
+        cwd=REPO_ROOT,
+        env=_env(database_url),
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    per_package: dict[str, float] = defaultdict(float)
+    for line in output.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match:
+            per_package[match.group(4).split(".")[0]] += int(match.group(1)) / 1000
+    return sorted(per_package.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+async def measure_ready(database_url: str, workers: int, directory: str) -> float:
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "backend.server"],
+        cwd=REPO_ROOT,
+        env=_env(
+            database_url,
+            HOST="127.0.0.1",
+            PORT=str(port),
+            WEB_CONCURRENCY=str(workers),
+            # Several workers need a job queue they share.
+            GENERATION_QUEUE_BACKEND="sqlite",
+            GENERATION_QUEUE_PATH=os.path.join(directory, "jobs.db"),
+        ),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        await _wait_ready(f"http://127.0.0.1:{port}/health", process, timeout=60.0)
+        return time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def _summary(samples: list[float]) -> str:
+    milliseconds = [sample * 1000 for sample in samples]
+    return f"median {statistics.median(milliseconds):8.1f} ms   min {min(milliseconds):8.1f} ms   n={len(samples)}"
+
+
+async def main(args: argparse.Namespace) -> int:
+    directory = tempfile.mkdtemp()
+    database_url = args.database_url or f"sqlite+aiosqlite:///{directory}/startup.db"
+
+    print(f"import backend.main      {_summary(measure_import(database_url, args.repeat))}")
+    if args.importtime:
+        for package, milliseconds in heaviest_imports(database_url, args.top):
+            print(f"  {package:<22} {milliseconds:8.1f} ms")
+
+    # The first start runs the migrations on an empty database; later ones only
+    # check the revision.
+    first = await measure_ready(database_url, args.workers, directory)
+    print(f"ready, empty database    {_summary([first])}")
+    warm = [await measure_ready(database_url, args.workers, directory) for _ in range(args.repeat)]
+    print(f"ready, migrated database {_summary(warm)}  ({args.workers} worker(s))")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1, help="WEB_CONCURRENCY of the measured server")
+    parser.add_argument("--importtime", action="store_true", help="list the packages that take longest to import")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--database-url", default=None)
+    sys.exit(asyncio.run(main(parser.parse_args())))
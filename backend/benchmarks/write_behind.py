@@ -0,0 +1,195 @@
+"""Message durability modes: turns/s and commits per turn (sync vs. group vs. buffered), plus a kill -9 check.
+
+    python -m backend.benchmarks.write_behind --turns 2000 --concurrency 50
+    python -m backend.benchmarks.write_behind --database-url postgresql+asyncpg://user:pw@localhost/bench
+    python -m backend.benchmarks.write_behind --crash --durability group
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any
+
+from .turn_roundtrips import FAKE_REPLY, percentile
+
+MODES = ("sync", "group", "buffered")
+
+
+class InsertCounter:
+    def __init__(self) -> None:
+        self.count = 0
+
+    def install(self, sync_engine: Any) -> None:
+        from sqlalchemy import event
+
+        def _on_execute(conn: Any, cursor: Any, statement: str, *_: Any) -> None:
+            if statement.lstrip().upper().startswith("INSERT INTO MESSAGES"):
+                self.count += 1
+
+        event.listen(sync_engine, "before_cursor_execute", _on_execute)
+
+
+async def _setup(session_count: int) -> list[uuid.UUID]:
+    from sqlalchemy import insert
+
+    from ..models.database import ChatSession, get_engine
+    from ..models.migrations import ensure_schema
+
+    await ensure_schema(migrate=True)
+    sessions = [uuid.uuid4() for _ in range(session_count)]
+    async with get_engine().begin() as conn:
+        await conn.execute(insert(ChatSession), [{"id": session_id} for session_id in sessions])
+    return sessions
+
+
+def _writer(args: argparse.Namespace) -> Any:
+    from ..services.message_store import _insert_messages
+    from ..services.message_writer import GroupCommitWriter
+
+    return GroupCommitWriter(
+        _insert_messages, max_batch=args.batch_size, max_delay=args.flush_interval, max_buffered=args.buffer_max
+    )
+
+
+async def _turn(session_id: uuid.UUID, index: int, durability: Any) -> uuid.UUID:
+    from ..services.message_store import message_store
+
+    user_message = message_store.new_message(session_id, "user", f"Frage Nummer {index}")
+    assistant_message = message_store.new_message(session_id, "assistant", FAKE_REPLY)
+    await message_store.save(user_message, assistant_message, durability=durability)
+    return assistant_message.id
+
+
+async def _measure(mode: str, args: argparse.Namespace, counter: InsertCounter) -> dict[str, Any]:
+    from ..services.message_store import message_store
+    from ..services.message_writer import Durability
+
+    sessions = await _setup(args.sessions)
+    message_store.writer = _writer(args)
+    await message_store.start()
+    durability = Durability(mode)
+    latencies: list[float] = []
+    turns = iter(range(args.turns))
+    counter.count = 0
+
+    async def user() -> None:
+        for index in turns:
+            started = time.perf_counter()
+            await _turn(sessions[index % len(sessions)], index, durability)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(args.concurrency)))
+    acknowledged = time.perf_counter() - started
+    await message_store.drain()
+    committed = time.perf_counter() - started
+    return {
+        "mode": mode,
+        "turns_per_second": args.turns / acknowledged,
+        "committed_per_second": args.turns / committed,
+        "commits_per_turn": counter.count / args.turns,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+async def benchmark(args: argparse.Namespace) -> int:
+    from ..models.database import dispose_engine, get_engine
+
+    counter = InsertCounter()
+    counter.install(get_engine().sync_engine)
+    results = [await _measure(mode, args, counter) for mode in MODES]
+    await dispose_engine()
+
+    print(f"{'mode':<10}{'turns/s':>10}{'committed/s':>13}{'commits/turn':>14}{'p50 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(
+            f"{result['mode']:<10}{result['turns_per_second']:>10.1f}{result['committed_per_second']:>13.1f}"
+            f"{result['commits_per_turn']:>14.3f}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+        )
+    return 0
+
+
+async def child(args: argparse.Namespace) -> None:
+    # Writes turns until it is killed and reports each acknowledged turn on stdout.
+    from ..services.message_store import message_store
+    from ..services.message_writer import Durability
+
+    sessions = await _setup(args.sessions)
+    message_store.writer = _writer(args)
+    await message_store.start()
+    durability = Durability(args.durability)
+    counter = iter(range(sys.maxsize))
+
+    async def user() -> None:
+        for index in counter:
+            message_id = await _turn(sessions[index % len(sessions)], index, durability)
+            sys.stdout.write(f"{message_id}\n")
+            sys.stdout.flush()
+
+    print("ready", flush=True)
+    await asyncio.gather(*(user() for _ in range(args.concurrency)))
+
+
+async def crash(args: argparse.Namespace) -> int:
+    from sqlalchemy import select
+
+    from ..models.database import Message, dispose_engine, get_engine
+
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "backend.benchmarks.write_behind",
+        "--child",
+        *("--durability", args.durability, "--concurrency", str(args.concurrency)),
+        *("--batch-size", str(args.batch_size), "--flush-interval", str(args.flush_interval)),
+        *("--buffer-max", str(args.buffer_max)),
+        stdout=asyncio.subprocess.PIPE,
+        env=os.environ.copy(),
+    )
+    assert process.stdout is not None
+    await process.stdout.readline()
+    await asyncio.sleep(args.crash_after)
+    process.send_signal(signal.SIGKILL)
+    # Lines already in the pipe were acknowledged before the kill.
+    output = await process.stdout.read()
+    await process.wait()
+
+    acknowledged = {uuid.UUID(line) for line in output.decode().split()}
+    async with get_engine().connect() as conn:
+        stored = set((await conn.execute(select(Message.id).where(Message.role == "assistant"))).scalars())
+    await dispose_engine()
+    lost = acknowledged - stored
+    print(f"{args.durability}: {len(acknowledged)} turns acknowledged before kill -9, {len(lost)} lost")
+    # Only buffered writes may lose acknowledged turns (at most --buffer-max messages).
+    return 1 if lost and args.durability != "buffered" else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50, help="turns in flight at once")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--flush-interval", type=float, default=0.01)
+    parser.add_argument("--buffer-max", type=int, default=5000)
+    parser.add_argument("--crash", action="store_true", help="kill -9 a writer and count lost acknowledged turns")
+    parser.add_argument("--crash-after", type=float, default=2.0)
+    parser.add_argument("--durability", choices=MODES, default="group")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    if not args.child:
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench.db"
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("API_KEY", "benchmark")
+    if args.child:
+        asyncio.run(child(args))
+    else:
+        sys.exit(asyncio.run(crash(args) if args.crash else benchmark(args)))
@@ -1,15 +1,62 @@
+import ipaddress
 import logging
-from typing import Annotated
+from typing import Annotated, Awaitable, Callable
 
 from fastapi import Header, HTTPException, Request, status
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from starlette.requests import HTTPConnection
 
+from .services.practices import Practice, practice_registry
+from .services.rate_limit import Rate, rate_limiter
 from .settings import settings
 
 logger = logging.getLogger(__name__)
 
-limiter = Limiter(key_func=get_remote_address, default_limits=["20/minute"])
+_TRUSTED_PROXIES = [ipaddress.ip_network(proxy, strict=False) for proxy in settings.trusted_proxies]
+
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in _TRUSTED_PROXIES)
+
+
+def client_ip(connection: HTTPConnection) -> str:
+    host = connection.client.host if connection.client else "unknown"
+    if not _is_trusted_proxy(host):
+        return host
+    # X-Forwarded-For is only honoured from our own proxies. Walking it from the
+    # right, the first hop they did not add is the client; earlier entries can
+    # be forged by the client itself.
+    hops = [hop.strip() for hop in connection.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else host
+
+
+def _rate_limit_practice(connection: HTTPConnection) -> str:
+    # Practices behind the same address do not use up each other's budget.
+    # Keys that match no practice share one bucket per address, so guessing
+    # keys stays limited as well.
+    api_key = connection.headers.get("x-api-key")
+    staff_key = connection.headers.get("x-staff-key")
+    practice = practice_registry.for_api_key(api_key) if api_key is not None else None
+    if practice is None and staff_key is not None:
+        practice = practice_registry.for_staff_key(staff_key)
+    return practice.id if practice is not None else "-"
+
+
+def rate_limit(limit: str) -> Callable[[Request], Awaitable[None]]:
+    rate = Rate.parse(limit)
+
+    async def check(request: Request) -> None:
+        route = request.scope.get("route")
+        key = f"{_rate_limit_practice(request)}:{client_ip(request)}"
+        await rate_limiter.hit(getattr(route, "name", "unmatched"), key, rate)
+
+    return check
 
 
 async def enforce_https(request: Request) -> None:
@@ -27,7 +74,20 @@ async def enforce_https(request: Request) -> None:
         )
 
 
-async def verify_api_key(x_api_key: Annotated[str | None, Header(alias="X-API-Key")] = None) -> None:
-    if x_api_key is None or x_api_key != settings.api_key:
+async def current_practice(x_api_key: Annotated[str | None, Header(alias="X-API-Key")] = None) -> Practice:
+    # The API key identifies the practice (tenant) a request is made for.
+    practice = practice_registry.for_api_key(x_api_key) if x_api_key is not None else None
+    if practice is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key.")
+    return practice
+
 
+async def current_staff_practice(x_staff_key: Annotated[str | None, Header(alias="X-Staff-Key")] = None) -> Practice:
+    # Staff-only endpoints do not exist until STAFF_API_KEYS is set, and the
+    # practice keys of the chat widget never unlock them.
+    if not practice_registry.has_staff_keys:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    practice = practice_registry.for_staff_key(x_staff_key) if x_staff_key is not None else None
+    if practice is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid staff key.")
+    return practice
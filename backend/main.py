@@ -1,24 +1,45 @@
 import logging
 import sys
+import time
 from contextlib import asynccontextmanager
 from typing import AsyncIterator
 
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
 from starlette.responses import JSONResponse
 
-from .dependencies import limiter
-from .models.database import init_models
+from .metrics import registry
+from .models.database import dispose_engine, warm_pool
+from .models.migrations import ensure_schema
+from .routers.chat import notify_generation_failure, run_generation_job
 from .routers.chat import router as chat_router
+from .serialization import FastJSONResponse
+from .services.admission import (
+    CLIENT_CLOSED_REQUEST,
+    AdmissionMiddleware,
+    ClientDisconnected,
+    admission_controller,
+)
+from .services.jobs import generation_pool
+from .services.message_store import message_store
+from .services.openai_service import openai_service
+from .services.rate_limit import RateLimitExceeded, rate_limiter, retry_after_header
+from .services.retention import retention_scheduler
+from .services.summarizer import conversation_summarizer
+from .services.websocket_manager import ws_manager
 from .settings import settings
+from .tracing import TraceLogFilter, TracingMiddleware, tracer
 
 logging.basicConfig(
     level=logging.DEBUG if settings.debug else logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    format="%(asctime)s - %(name)s - %(levelname)s - %(trace)s%(message)s"
+    if tracer.enabled
+    else "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     stream=sys.stdout,
 )
+if tracer.enabled:
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceLogFilter())
 
 logger = logging.getLogger("medical-chatbot")
 
@@ -26,10 +47,33 @@ logger = logging.getLogger("medical-chatbot")
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncIterator[None]:
     logger.info("Initialising application...")
-    await init_models()
+    started = time.perf_counter()
+    await ensure_schema()
+    await warm_pool(settings.db_pool_warm_connections)
     logger.info("Database ready.")
+    openai_service.router.warm_up()
+    await message_store.start()
+    await ws_manager.start()
+    await generation_pool.start(run_generation_job, on_failure=notify_generation_failure)
+    await admission_controller.start()
+    if retention_scheduler is not None:
+        await retention_scheduler.start()
+    logger.info("Startup complete in %.0f ms.", (time.perf_counter() - started) * 1000)
     yield
     logger.info("Shutting down application...")
+    await admission_controller.stop()
+    if retention_scheduler is not None:
+        await retention_scheduler.stop()
+    await generation_pool.stop()
+    if conversation_summarizer is not None:
+        await conversation_summarizer.drain()
+    await ws_manager.stop()
+    # After everything that writes messages, so buffered turns are committed before the pool closes.
+    await message_store.drain()
+    await rate_limiter.close()
+    await openai_service.router.close()
+    await dispose_engine()
+    tracer.shutdown()
 
 
 app = FastAPI(
@@ -38,14 +82,34 @@ app = FastAPI(
     version="1.0.0",
     debug=settings.debug,
     lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
-app.state.limiter = limiter
-
 
 @app.exception_handler(RateLimitExceeded)
 async def rate_limit_handler(request: Request, exc: RateLimitExceeded) -> JSONResponse:
-    return JSONResponse({"detail": "Rate limit exceeded. Bitte versuchen Sie es später erneut."}, status_code=429)
+    return JSONResponse(
+        {"detail": "Rate limit exceeded. Bitte versuchen Sie es später erneut."},
+        status_code=429,
+        headers=retry_after_header(exc),
+    )
+
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected) -> Response:
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+
+if admission_controller.enabled:
+    # Added first, so it is the innermost middleware: rejections still get the
+    # CORS and security headers and show up in the latency metrics. Only chat
+    # turns queue for a slot; the async endpoint merely enqueues a job and the
+    # generation queue has its own limit.
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=admission_controller,
+        paths=("/api/chat/message", "/api/chat/message/stream"),
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -54,7 +118,6 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-app.add_middleware(SlowAPIMiddleware)
 
 
 @app.middleware("http")
@@ -78,25 +141,54 @@ async def add_security_headers(request: Request, call_next) -> Response:
     return response
 
 
+if registry.enabled:
+    HTTP_LATENCY = registry.histogram(
+        "http_request_duration_seconds", "HTTP request latency.", ("method", "route", "status")
+    )
+
+    @app.middleware("http")
+    async def record_request_latency(request: Request, call_next) -> Response:
+        started = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            # The route template keeps the label cardinality bounded (no session ids).
+            route = request.scope.get("route")
+            HTTP_LATENCY.observe(
+                time.perf_counter() - started,
+                method=request.method,
+                route=getattr(route, "path", "unmatched"),
+                status=str(status_code),
+            )
+
+
+if tracer.enabled:
+    # Added last, so it is the outermost middleware and its span covers the others.
+    app.add_middleware(TracingMiddleware)
+
+
 @app.get("/health", tags=["health"])
 async def health_check() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    if not registry.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 app.include_router(chat_router)
 
 
 def run() -> None:
-    import uvicorn
-
-    uvicorn.run(
-        "backend.main:app",
-        host="0.0.0.0",
-        port=settings.port,
-        reload=settings.debug,
-        ssl_keyfile=None,
-        ssl_certfile=None,
-    )
+    from .server import run as serve
+
+    serve()
 
 
 if __name__ == "__main__":
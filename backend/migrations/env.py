@@ -0,0 +1,59 @@
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import pool
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backend.models.database import Base, _resolve_async_database_url
+from backend.settings import settings
+
+config = context.config
+# Set by backend.models.migrations when the application migrates on start-up;
+# the application's logging configuration is left alone in that case.
+shared_connection = config.attributes.get("connection")
+if config.config_file_name is not None and shared_connection is None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+database_url = _resolve_async_database_url(settings.database_url)
+
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=database_url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection: Connection) -> None:
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        render_as_batch=connection.dialect.name == "sqlite",
+        # Revisions that build Postgres indexes CONCURRENTLY do so in an
+        # autocommit_block(), which needs each revision in its own transaction.
+        transaction_per_migration=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online() -> None:
+    connectable = create_async_engine(database_url, poolclass=pool.NullPool)
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await connectable.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif shared_connection is not None:
+    do_run_migrations(shared_connection)
+else:
+    asyncio.run(run_migrations_online())
@@ -0,0 +1,56 @@
+-- Optional, PostgreSQL 12+: range-partition messages by month.
+--
+-- Once messages is partitioned, the retention job (backend/services/retention.py)
+-- creates the partitions for the coming months itself and drops whole monthly
+-- partitions older than RETENTION_DAYS instead of deleting their rows.
+-- Run after `alembic upgrade head`, in a maintenance window: the table is copied
+-- and is locked while the script runs.
+--
+--     psql "$DATABASE_URL" -f backend/migrations/sql/partition_messages_by_month.sql
+
+BEGIN;
+
+ALTER TABLE messages RENAME TO messages_unpartitioned;
+ALTER INDEX messages_pkey RENAME TO messages_unpartitioned_pkey;
+ALTER INDEX ix_messages_session_id_timestamp RENAME TO ix_messages_unpartitioned_session_id_timestamp;
+ALTER INDEX IF EXISTS ix_messages_content_fts RENAME TO ix_messages_unpartitioned_content_fts;
+
+-- The partition key has to be part of the primary key.
+CREATE TABLE messages (
+    id UUID NOT NULL,
+    session_id UUID NOT NULL REFERENCES chat_sessions (id) ON DELETE CASCADE,
+    role VARCHAR(32) NOT NULL,
+    content TEXT NOT NULL,
+    "timestamp" TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (id, "timestamp")
+) PARTITION BY RANGE ("timestamp");
+
+CREATE INDEX ix_messages_session_id_timestamp ON messages (session_id, "timestamp");
+-- Full-text search (alembic revision 0006).
+CREATE INDEX ix_messages_content_fts ON messages USING gin (to_tsvector('german', content));
+
+-- One partition per month from the oldest message up to two months ahead,
+-- named messages_pYYYYMM as the retention job expects.
+DO $$
+DECLARE
+    partition_start TIMESTAMP := date_trunc(
+        'month', coalesce((SELECT min("timestamp") FROM messages_unpartitioned), now()) AT TIME ZONE 'UTC'
+    );
+BEGIN
+    WHILE partition_start <= date_trunc('month', now() AT TIME ZONE 'UTC') + INTERVAL '2 months' LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+            'messages_p' || to_char(partition_start, 'YYYYMM'),
+            partition_start AT TIME ZONE 'UTC',
+            (partition_start + INTERVAL '1 month') AT TIME ZONE 'UTC'
+        );
+        partition_start := partition_start + INTERVAL '1 month';
+    END LOOP;
+END $$;
+
+INSERT INTO messages (id, session_id, role, content, "timestamp")
+SELECT id, session_id, role, content, "timestamp" FROM messages_unpartitioned;
+
+DROP TABLE messages_unpartitioned;
+
+COMMIT;
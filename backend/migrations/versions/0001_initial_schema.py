@@ -0,0 +1,46 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Databases bootstrapped by Base.metadata.create_all already have these tables.
+    existing_tables = set(sa.inspect(op.get_bind()).get_table_names())
+    if "chat_sessions" not in existing_tables:
+        op.create_table(
+            "chat_sessions",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        )
+    if "messages" not in existing_tables:
+        op.create_table(
+            "messages",
+            sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+            sa.Column(
+                "session_id",
+                postgresql.UUID(as_uuid=True),
+                sa.ForeignKey("chat_sessions.id", ondelete="CASCADE"),
+                nullable=False,
+            ),
+            sa.Column("role", sa.String(32), nullable=False),
+            sa.Column("content", sa.Text(), nullable=False),
+            sa.Column("timestamp", sa.DateTime(timezone=True), nullable=False),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("messages")
+    op.drop_table("chat_sessions")
@@ -0,0 +1,36 @@
+"""index messages on (session_id, timestamp)
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY avoids locking the messages table on Postgres and cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_session_id_timestamp",
+            "messages",
+            ["session_id", "timestamp"],
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_messages_session_id_timestamp",
+            table_name="messages",
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
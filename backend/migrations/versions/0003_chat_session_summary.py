@@ -0,0 +1,30 @@
+"""add rolling conversation summary to chat_sessions
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Tables created by Base.metadata.create_all may already have the columns.
+    existing_columns = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("chat_sessions")}
+    if "summary" not in existing_columns:
+        op.add_column("chat_sessions", sa.Column("summary", sa.Text(), nullable=True))
+    if "summary_until" not in existing_columns:
+        op.add_column("chat_sessions", sa.Column("summary_until", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("chat_sessions") as batch_op:
+        batch_op.drop_column("summary_until")
+        batch_op.drop_column("summary")
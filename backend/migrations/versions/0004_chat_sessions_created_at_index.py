@@ -0,0 +1,35 @@
+"""index chat_sessions on created_at for the retention job
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chat_sessions_created_at",
+            "chat_sessions",
+            ["created_at"],
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_chat_sessions_created_at",
+            table_name="chat_sessions",
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
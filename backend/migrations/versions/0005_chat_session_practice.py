@@ -0,0 +1,27 @@
+"""add practice_id to chat_sessions for multi-practice deployments
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing sessions keep NULL and are treated as sessions of DEFAULT_PRACTICE.
+    existing_columns = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("chat_sessions")}
+    if "practice_id" not in existing_columns:
+        op.add_column("chat_sessions", sa.Column("practice_id", sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("chat_sessions") as batch_op:
+        batch_op.drop_column("practice_id")
@@ -0,0 +1,92 @@
+"""full-text index over messages.content for staff search
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match TEXT_SEARCH_CONFIG in backend/services/message_search.py, or the
+# planner cannot use the index.
+TSVECTOR = "to_tsvector('german', content)"
+
+
+def _is_partitioned() -> bool:
+    return bool(
+        op.get_bind().scalar(
+            sa.text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))")
+        )
+    )
+
+
+def _upgrade_postgresql() -> None:
+    # The GIN index is maintained by Postgres on every insert and delete.
+    # CONCURRENTLY is not available on partitioned tables.
+    concurrently = not _is_partitioned()
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_messages_content_fts",
+            "messages",
+            [sa.text(TSVECTOR)],
+            if_not_exists=True,
+            postgresql_using="gin",
+            postgresql_concurrently=concurrently,
+        )
+
+
+def _upgrade_sqlite() -> None:
+    # FTS5 table for local development and tests, kept in sync by triggers.
+    # It stores the message id instead of relying on the rowid of messages,
+    # which VACUUM may renumber.
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "content, message_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts (content, message_id) VALUES (new.content, new.id); END"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "DELETE FROM messages_fts WHERE message_id = old.id; END"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+        "UPDATE messages_fts SET content = new.content WHERE message_id = old.id; END"
+    )
+    op.execute(
+        "INSERT INTO messages_fts (content, message_id) SELECT content, id FROM messages "
+        "WHERE id NOT IN (SELECT message_id FROM messages_fts)"
+    )
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        _upgrade_postgresql()
+    elif dialect == "sqlite":
+        _upgrade_sqlite()
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        with op.get_context().autocommit_block():
+            op.drop_index(
+                "ix_messages_content_fts",
+                table_name="messages",
+                if_exists=True,
+                postgresql_concurrently=not _is_partitioned(),
+            )
+    elif dialect == "sqlite":
+        for trigger in ("messages_fts_insert", "messages_fts_delete", "messages_fts_update"):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS messages_fts")
@@ -1,14 +1,20 @@
+import asyncio
 import logging
+import time
 import uuid
 from datetime import datetime, timezone
-from typing import AsyncGenerator
+from functools import lru_cache
+from typing import Any, AsyncGenerator
 
-from sqlalchemy import DateTime, ForeignKey, String, Text
+from sqlalchemy import DateTime, ForeignKey, Index, String, Text, event, text
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from ..metrics import registry
 from ..settings import settings
+from ..tracing import tracer
 
 logger = logging.getLogger(__name__)
 
@@ -21,12 +27,58 @@ def _resolve_async_database_url(url: str) -> str:
     return url
 
 
+POOL_CHECKOUT_WAIT = registry.histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the DB pool.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+
+
+DB_QUERY_DURATION = registry.histogram(
+    "db_query_duration_seconds",
+    "DB statement execution time by SQL operation.",
+    ("operation",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0),
+)
+_SQL_OPERATIONS = frozenset({"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"})
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    def _do_get(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+
+def _engine_options(url: str) -> dict[str, Any]:
+    options: dict[str, Any] = {
+        "echo": settings.sqlalchemy_echo,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+    }
+    if ":memory:" in url:
+        return options
+    options.update(
+        poolclass=InstrumentedAsyncPool if registry.enabled else AsyncAdaptedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout_seconds,
+    )
+    if url.startswith("postgresql+asyncpg"):
+        # Set to 0 when running behind PgBouncer in transaction pooling mode.
+        options["connect_args"] = {"prepared_statement_cache_size": settings.db_statement_cache_size}
+    return options
+
+
 class Base(DeclarativeBase):
     pass
 
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
+    __table_args__ = (Index("ix_chat_sessions_created_at", "created_at"),)
 
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
@@ -34,6 +86,10 @@ class ChatSession(Base):
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False
     )
+    # NULL for sessions created before practice profiles, i.e. the default practice.
+    practice_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    summary: Mapped[str | None] = mapped_column(Text, nullable=True)
+    summary_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
     messages: Mapped[list["Message"]] = relationship(
         back_populates="session", cascade="all, delete-orphan", order_by="Message.timestamp"
@@ -42,6 +98,7 @@ class ChatSession(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (Index("ix_messages_session_id_timestamp", "session_id", "timestamp"),)
 
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
@@ -58,23 +115,119 @@ class Message(Base):
     session: Mapped[ChatSession] = relationship(back_populates="messages")
 
 
-engine = create_async_engine(
-    _resolve_async_database_url(settings.database_url),
-    echo=settings.sqlalchemy_echo,
-)
-async_session_factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+def _before_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+) -> None:
+    context._query_started = time.perf_counter()
+
+
+def _operation(statement: str) -> str:
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return operation if operation in _SQL_OPERATIONS else "OTHER"
+
+
+def _after_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+) -> None:
+    DB_QUERY_DURATION.observe(time.perf_counter() - context._query_started, operation=_operation(statement))
+
+
+def _start_query_span(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+) -> None:
+    # Only statements run on behalf of a traced request or job; pool pings and
+    # background work without a trace do not start traces of their own.
+    if tracer.current_trace_id() is None:
+        return
+    operation = _operation(statement)
+    # The statement text has placeholders only, never the values.
+    context._query_span = tracer.start(
+        f"db.{operation.lower()}", operation=operation, statement=" ".join(statement.split())[:300]
+    )
+
+
+def _end_query_span(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool
+) -> None:
+    span = getattr(context, "_query_span", None)
+    if span is None:
+        return
+    # Drivers report -1 for SELECT; callers add the rows they read to their own span.
+    if cursor.rowcount >= 0:
+        span.set(rows=cursor.rowcount)
+    tracer.end(span)
+
+
+def _fail_query_span(exception_context: Any) -> None:
+    span = getattr(exception_context.execution_context, "_query_span", None)
+    if span is not None:
+        tracer.end(span, exception_context.original_exception)
+
+
+# The engine is built on first use: importing the models (Alembic, CLI tools,
+# the launcher before it forks workers) neither loads the driver nor creates a pool.
+@lru_cache
+def get_engine() -> AsyncEngine:
+    url = _resolve_async_database_url(settings.database_url)
+    engine = create_async_engine(url, **_engine_options(url))
+    if registry.enabled:
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    if tracer.enabled:
+        event.listen(engine.sync_engine, "before_cursor_execute", _start_query_span)
+        event.listen(engine.sync_engine, "after_cursor_execute", _end_query_span)
+        event.listen(engine.sync_engine, "handle_error", _fail_query_span)
+    return engine
+
+
+@lru_cache
+def get_autocommit_engine() -> AsyncEngine:
+    # Single-statement reads and writes on the chat hot path skip BEGIN/COMMIT round trips.
+    return get_engine().execution_options(isolation_level="AUTOCOMMIT")
+
+
+@lru_cache
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(get_engine(), expire_on_commit=False, class_=AsyncSession)
+
+
+async def warm_pool(connections: int) -> None:
+    # Checked out concurrently so each one is a separate connection; they stay
+    # in the pool and the first requests skip connect and authentication.
+    async def ping() -> None:
+        async with get_engine().connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(connections)))
+
+
+async def dispose_engine() -> None:
+    if get_engine.cache_info().currsize:
+        await get_engine().dispose()
+
+
+def _pool_occupancy() -> dict[tuple[str, ...], float]:
+    if not get_engine.cache_info().currsize:
+        return {}
+    pool = get_engine().sync_engine.pool
+    if not isinstance(pool, AsyncAdaptedQueuePool):
+        return {}
+    return {
+        ("size",): pool.size(),
+        ("checked_out",): pool.checkedout(),
+        ("checked_in",): pool.checkedin(),
+        ("overflow",): max(pool.overflow(), 0),
+    }
+
+
+registry.gauge("db_pool_connections", "DB pool occupancy by state.", ("state",), callback=_pool_occupancy)
 
 
 async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
-    session = async_session_factory()
+    session = get_session_factory()()
     try:
         yield session
     finally:
         await session.close()
 
 
-async def init_models() -> None:
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        logger.info("Database tables ensured.")
-
@@ -0,0 +1,112 @@
+import logging
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import Connection, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from ..settings import settings
+from .database import get_engine
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+MIGRATION_LOCK_KEY = 0x4D494752
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+# Alembic is imported inside these helpers: it is only needed once per start,
+# never on the request path.
+def _alembic_config(connection: Connection | None = None) -> Any:
+    from alembic.config import Config
+
+    config = Config(str(ALEMBIC_INI))
+    config.attributes["connection"] = connection
+    return config
+
+
+def head_revision() -> str | None:
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(_alembic_config()).get_current_head()
+
+
+def _current_revision(connection: Connection) -> str | None:
+    from alembic.runtime.migration import MigrationContext
+
+    return MigrationContext.configure(connection).get_current_revision()
+
+
+def _upgrade(connection: Connection) -> None:
+    from alembic import command
+
+    command.upgrade(_alembic_config(connection), "head")
+
+
+async def _revision(engine: AsyncEngine) -> str | None:
+    async with engine.connect() as conn:
+        return await conn.run_sync(_current_revision)
+
+
+async def _lock(conn: AsyncConnection) -> None:
+    # Workers started together on an empty database wait here instead of
+    # racing each other through the same migrations.
+    if conn.dialect.name == "postgresql":
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        await conn.commit()
+
+
+async def _unlock(conn: AsyncConnection) -> None:
+    if conn.dialect.name == "postgresql":
+        await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        await conn.commit()
+
+
+async def ensure_schema(engine: AsyncEngine | None = None, migrate: bool | None = None) -> None:
+    # Replaces create_all on boot: an up-to-date schema costs one query; an
+    # outdated one is migrated (DB_MIGRATE_ON_START) or refuses to start.
+    engine = engine or get_engine()
+    migrate = settings.db_migrate_on_start if migrate is None else migrate
+    head = head_revision()
+    current = await _revision(engine)
+    if current == head:
+        return
+    if not migrate:
+        raise SchemaOutdated(
+            f"Database schema is at revision {current}, expected {head}. "
+            "Run `alembic -c backend/alembic.ini upgrade head`."
+        )
+    async with engine.connect() as lock_conn:
+        await _lock(lock_conn)
+        try:
+            current = await _revision(engine)
+            if current != head:
+                logger.info("Migrating database schema from %s to %s.", current, head)
+                async with engine.connect() as conn:
+                    await conn.run_sync(_upgrade)
+                    await conn.commit()
+        finally:
+            await _unlock(lock_conn)
+
+
+def migrate() -> None:
+    # For the launcher: runs once before the workers start, on a connection of
+    # its own so no pool is created in the parent process.
+    import asyncio
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    from .database import _resolve_async_database_url
+
+    async def run() -> None:
+        engine = create_async_engine(_resolve_async_database_url(settings.database_url), poolclass=NullPool)
+        try:
+            await ensure_schema(engine)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
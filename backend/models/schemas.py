@@ -26,4 +26,36 @@ class MessageResponse(BaseModel):
 class HistoryResponse(BaseModel):
     session_id: uuid.UUID
     messages: list[MessageResponse]
+    has_more: bool = False
+    before_cursor: Optional[str] = Field(None, description="Cursor für ältere Nachrichten (`before`)")
+    after_cursor: Optional[str] = Field(None, description="Cursor für neuere Nachrichten (`after`)")
 
+
+class SearchHit(BaseModel):
+    message_id: uuid.UUID
+    session_id: uuid.UUID
+    role: Literal["user", "assistant"]
+    timestamp: datetime
+    snippet: str = Field(..., description="HTML-escaped Textausschnitt, Treffer in `<mark>`")
+
+
+class SearchResponse(BaseModel):
+    query: str
+    results: list[SearchHit]
+    has_more: bool = False
+    next_cursor: Optional[str] = Field(None, description="Cursor für ältere Treffer (`before`)")
+
+
+class JobAcceptedResponse(BaseModel):
+    job_id: uuid.UUID
+    status: Literal["queued", "running", "succeeded", "failed"]
+    user_message: MessageResponse
+
+
+class JobStatusResponse(BaseModel):
+    job_id: uuid.UUID
+    session_id: uuid.UUID
+    status: Literal["queued", "running", "succeeded", "failed"]
+    attempts: int
+    message: Optional[MessageResponse] = None
+    error: Optional[str] = None
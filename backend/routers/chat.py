@@ -1,280 +1,563 @@
-import json
 import logging
+import math
 import uuid
-from typing import Any
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator
 
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
     Path,
-    Request,
+    Query,
     WebSocket,
     WebSocketDisconnect,
     status,
 )
-from sqlalchemy import select
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..dependencies import enforce_https, limiter, verify_api_key
-from ..models.database import ChatSession, Message, async_session_factory, get_db_session
-from ..models.schemas import HistoryResponse, MessageRequest, MessageResponse, SessionCreateResponse
+from ..dependencies import client_ip, current_practice, current_staff_practice, enforce_https, rate_limit
+from ..metrics import registry, timed
+from ..models.database import ChatSession, Message, get_db_session, get_session_factory
+from ..models.schemas import (
+    HistoryResponse,
+    JobAcceptedResponse,
+    JobStatusResponse,
+    MessageRequest,
+    MessageResponse,
+    SearchResponse,
+    SessionCreateResponse,
+)
+from ..serialization import FastJSONResponse, dumps, dumps_text
+from ..services.admission import (
+    BUSY_MESSAGE,
+    AdmissionRejected,
+    ClientDisconnected,
+    admission_controller,
+    is_emergency_text,
+    raise_if_disconnected,
+)
+from ..services.context_window import context_builder
+from ..services.jobs import GenerationJob, QueueFullError, generation_pool
+from ..services.message_search import message_search
+from ..services.message_store import decode_cursor, message_store
+from ..services.message_writer import Durability, durability_for
 from ..services.openai_service import openai_service
+from ..services.practices import Practice, practice_registry
+from ..services.rate_limit import SESSION_TURN_RATE, WEBSOCKET_MESSAGE_RATE, RateLimitExceeded, rate_limiter
+from ..services.summarizer import conversation_summarizer
+from ..services.websocket_manager import ws_manager
+from ..services.ws_protocol import HEARTBEAT_FRAMES, PROTOCOL_VERSION, negotiate, receive_frame
 from ..settings import settings
+from ..tracing import tracer
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 
-class WebSocketManager:
-    def __init__(self) -> None:
-        self.connections: dict[uuid.UUID, set[WebSocket]] = {}
-
-    async def connect(self, session_id: uuid.UUID, websocket: WebSocket) -> None:
-        await websocket.accept()
-        self.connections.setdefault(session_id, set()).add(websocket)
-        logger.debug("WebSocket connected for session %s", session_id)
-
-    def disconnect(self, session_id: uuid.UUID, websocket: WebSocket) -> None:
-        session_connections = self.connections.get(session_id)
-        if not session_connections:
-            return
-        session_connections.discard(websocket)
-        if not session_connections:
-            self.connections.pop(session_id, None)
-        logger.debug("WebSocket disconnected for session %s", session_id)
-
-    async def broadcast(self, session_id: uuid.UUID, payload: dict[str, Any]) -> None:
-        connections = self.connections.get(session_id, set())
-        if not connections:
-            return
-        message = json.dumps(payload, default=str)
-        for websocket in list(connections):
-            try:
-                await websocket.send_text(message)
-            except Exception:  # noqa: BLE001
-                logger.exception("Failed to broadcast to session %s", session_id)
-                self.disconnect(session_id, websocket)
-
-
-ws_manager = WebSocketManager()
+def _message_payload(message: Message) -> dict[str, Any]:
+    return {
+        "message_id": str(message.id),
+        "session_id": str(message.session_id),
+        "role": message.role,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat(),
+    }
 
 
-async def _get_session(session_id: uuid.UUID, db: AsyncSession) -> ChatSession:
-    session = await db.get(ChatSession, session_id)
-    if session is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sitzung nicht gefunden.")
-    return session
+def _sse_event(frame: dict[str, Any]) -> str:
+    return f"event: {frame['type']}\ndata: {dumps_text(frame)}\n\n"
 
 
 @router.post(
     "/session",
     response_model=SessionCreateResponse,
     status_code=status.HTTP_201_CREATED,
-    dependencies=[Depends(verify_api_key)],
+    dependencies=[Depends(rate_limit("10/minute"))],
 )
-@limiter.limit("10/minute")
 async def create_session(
-    request: Request,
     db: AsyncSession = Depends(get_db_session),
+    practice: Practice = Depends(current_practice),
     _: None = Depends(enforce_https),
 ) -> SessionCreateResponse:
-    new_session = ChatSession()
+    new_session = ChatSession(id=uuid.uuid4(), created_at=datetime.now(timezone.utc), practice_id=practice.id)
     db.add(new_session)
     await db.commit()
-    await db.refresh(new_session)
     logger.info("Chat session created: %s", new_session.id)
     return SessionCreateResponse(session_id=new_session.id, created_at=new_session.created_at)
 
 
+def _parse_cursor(cursor: str | None) -> tuple[datetime, uuid.UUID] | None:
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Ungültiger Cursor.") from exc
+
+
+# Above the 20/minute of the message endpoints on purpose: the widget loads
+# one page per request while the user scrolls back through a long session.
 @router.get(
     "/history/{session_id}",
     response_model=HistoryResponse,
-    dependencies=[Depends(verify_api_key)],
+    dependencies=[Depends(rate_limit("60/minute"))],
 )
-@limiter.limit("20/minute")
 async def get_history(
-    request: Request,
     session_id: uuid.UUID = Path(..., description="ID der Sitzung"),
-    db: AsyncSession = Depends(get_db_session),
+    before: str | None = Query(None, description="Nur Nachrichten vor diesem Cursor"),
+    after: str | None = Query(None, description="Nur Nachrichten nach diesem Cursor"),
+    limit: int = Query(50, ge=1, le=200),
+    practice: Practice = Depends(current_practice),
     _: None = Depends(enforce_https),
-) -> HistoryResponse:
-    await _get_session(session_id, db)
-    result = await db.execute(
-        select(Message)
-        .where(Message.session_id == session_id)
-        .order_by(Message.timestamp.asc())
-    )
-    messages = [
-        MessageResponse(
-            message_id=message.id,  # type: ignore[arg-type]
-            session_id=session_id,
-            role=message.role,  # type: ignore[arg-type]
-            content=message.content,
-            timestamp=message.timestamp,
+) -> FastJSONResponse:
+    if before is not None and after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="`before` und `after` schließen sich aus."
         )
-        for message in result.scalars()
-    ]
-    return HistoryResponse(session_id=session_id, messages=messages)
+    page = await message_store.load_page(
+        session_id, practice.id, limit, before=_parse_cursor(before), after=_parse_cursor(after)
+    )
+    if page is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sitzung nicht gefunden.")
+    # Rows are encoded straight to JSON; building a pydantic model per message
+    # dominated the cost of large pages. `response_model` still documents the shape.
+    return FastJSONResponse(
+        {
+            "session_id": str(session_id),
+            "messages": [_message_payload(row) for row in page.rows],
+            "has_more": page.has_more,
+            "before_cursor": page.before_cursor,
+            "after_cursor": page.after_cursor,
+        }
+    )
+
+
+@router.get(
+    "/history/{session_id}/stream",
+    response_class=StreamingResponse,
+    dependencies=[Depends(rate_limit("10/minute"))],
+)
+async def stream_history(
+    session_id: uuid.UUID = Path(..., description="ID der Sitzung"),
+    after: str | None = Query(None, description="Nur Nachrichten nach diesem Cursor"),
+    practice: Practice = Depends(current_practice),
+    _: None = Depends(enforce_https),
+) -> StreamingResponse:
+    cursor = _parse_cursor(after)
+    if not await message_store.session_exists(session_id, practice.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sitzung nicht gefunden.")
+
+    async def ndjson() -> AsyncIterator[bytes]:
+        async for row in message_store.stream_history(session_id, after=cursor):
+            yield dumps(_message_payload(row)) + b"\n"
 
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
+
+@router.get(
+    "/search",
+    response_model=SearchResponse,
+    dependencies=[Depends(rate_limit("30/minute"))],
+)
+async def search_messages(
+    q: str = Query(..., min_length=2, max_length=200, description="Suchbegriffe, z. B. Name oder Medikament"),
+    session_id: uuid.UUID | None = Query(None, description="Nur in dieser Sitzung suchen"),
+    before: str | None = Query(None, description="Nur Treffer vor diesem Cursor"),
+    limit: int = Query(20, ge=1, le=100),
+    practice: Practice = Depends(current_staff_practice),
+    _: None = Depends(enforce_https),
+) -> FastJSONResponse:
+    cursor = _parse_cursor(before)
+    try:
+        page = await message_search.search(q, practice.id, limit, before=cursor, session_id=session_id)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Der Suchbegriff enthält keine Wörter."
+        ) from exc
+    return FastJSONResponse(
+        {"query": q, "results": page.hits(), "has_more": page.has_more, "next_cursor": page.next_cursor}
+    )
+
+
+HISTORY_LATENCY = registry.histogram(
+    "conversation_history_duration_seconds", "Time to load the conversation window for a turn."
+)
+
+
+@timed(HISTORY_LATENCY)
 async def _build_conversation_history(
-    db: AsyncSession, session_id: uuid.UUID, limit: int = 10
+    session_id: uuid.UUID, content: str, practice: Practice
 ) -> list[dict[str, str]]:
-    result = await db.execute(
-        select(Message).where(Message.session_id == session_id).order_by(Message.timestamp.desc()).limit(limit)
-    )
-    messages = list(result.scalars())
-    return [
-        {"role": message.role, "content": message.content}
-        for message in reversed(messages)
-    ]
+    history = await message_store.load_conversation(session_id, context_builder.fetch_limit)
+    if history is None or not practice.owns(history.practice_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sitzung nicht gefunden.")
+    with tracer.span("context.build") as span:
+        context = context_builder.build(history, content)
+        span.set(messages=len(context.messages), tokens=context.tokens, overflow=len(context.overflow))
+    if conversation_summarizer is not None:
+        conversation_summarizer.schedule(session_id, context.overflow)
+    return context.messages
+
+
+async def _start_turn(
+    session_id: uuid.UUID, content: str, practice: Practice
+) -> tuple[Message, list[dict[str, str]]]:
+    tracer.current().set(session_id=str(session_id), practice=practice.id)
+    # Every turn costs a model call, so REST, SSE, async jobs and WebSocket
+    # share one budget per session, across workers when the store is shared.
+    with tracer.span("rate_limit"):
+        await rate_limiter.hit("session_turn", str(session_id), SESSION_TURN_RATE)
+    # The user message is not written yet: it is appended to the history in
+    # memory and persisted together with the assistant reply.
+    conversation = await _build_conversation_history(session_id, content, practice)
+    user_message = message_store.new_message(session_id, "user", content)
+    await ws_manager.broadcast(session_id, {"type": "user_message", "message": _message_payload(user_message)})
+    return user_message, conversation
+
+
+def _local_reply(content: str, practice: Practice) -> str | None:
+    if practice.intent_router is None:
+        return None
+    with tracer.span("intent.match") as span:
+        match = practice.intent_router.match(content)
+        span.set(hit=match is not None)
+    return match.reply if match else None
+
+
+async def _generate_reply(conversation: list[dict[str, str]], practice: Practice) -> str:
+    local_reply = _local_reply(conversation[-1]["content"], practice)
+    if local_reply is not None:
+        return local_reply
+    raise_if_disconnected()
+    return await openai_service.generate_response(conversation, practice)
 
 
 @router.post(
     "/message",
     response_model=MessageResponse,
-    dependencies=[Depends(verify_api_key)],
+    dependencies=[Depends(rate_limit("20/minute"))],
 )
-@limiter.limit("20/minute")
 async def post_message(
-    request: Request,
     payload: MessageRequest,
-    db: AsyncSession = Depends(get_db_session),
+    practice: Practice = Depends(current_practice),
     _: None = Depends(enforce_https),
-) -> MessageResponse:
-    session = await _get_session(payload.session_id, db)
-
-    user_message = Message(session_id=session.id, role="user", content=payload.content.strip())
-    db.add(user_message)
-    await db.commit()
-    await db.refresh(user_message)
-
-    await ws_manager.broadcast(
-        session.id,
-        {
-            "type": "user_message",
-            "message": {
-                "message_id": str(user_message.id),
-                "session_id": str(session.id),
-                "role": "user",
-                "content": user_message.content,
-                "timestamp": user_message.timestamp.isoformat(),
-            },
-        },
-    )
-
-    conversation = await _build_conversation_history(db, session.id, limit=10)
+) -> FastJSONResponse:
+    user_message, conversation = await _start_turn(payload.session_id, payload.content.strip(), practice)
 
     try:
-        assistant_reply = await openai_service.generate_response(conversation)
+        assistant_reply = await _generate_reply(conversation, practice)
+    except ClientDisconnected:
+        await message_store.save(user_message, durability=durability_for("rest"))
+        raise
     except Exception as exc:  # noqa: BLE001
-        await db.rollback()
+        await message_store.save(user_message, durability=durability_for("rest"))
         logger.exception("Assistant response failed: %s", exc)
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
             detail="Antwort des Assistenten derzeit nicht verfügbar.",
         ) from exc
 
-    assistant_message = Message(session_id=session.id, role="assistant", content=assistant_reply)
-    db.add(assistant_message)
-    await db.commit()
-    await db.refresh(user_message)
-    await db.refresh(assistant_message)
-
-    response_payload = MessageResponse(
-        message_id=assistant_message.id,
-        session_id=session.id,
-        role="assistant",
-        content=assistant_message.content,
-        timestamp=assistant_message.timestamp,
+    assistant_message = message_store.new_message(payload.session_id, "assistant", assistant_reply)
+    await message_store.save(user_message, assistant_message, durability=durability_for("rest"))
+
+    response_payload = _message_payload(assistant_message)
+    await ws_manager.broadcast(payload.session_id, {"type": "assistant_message", "message": response_payload})
+    return FastJSONResponse(response_payload)
+
+
+async def _stream_assistant_reply(
+    user_message: Message, conversation: list[dict[str, str]], practice: Practice, durability: Durability
+) -> AsyncIterator[dict[str, Any]]:
+    session_id = user_message.session_id
+    message_id = uuid.uuid4()
+    reply = _local_reply(user_message.content, practice)
+    if reply is None:
+        parts: list[str] = []
+        try:
+            async for delta in openai_service.stream_response(conversation, practice):
+                parts.append(delta)
+                frame = {
+                    "type": "assistant_delta",
+                    "message_id": str(message_id),
+                    "session_id": str(session_id),
+                    "delta": delta,
+                }
+                await ws_manager.broadcast(session_id, frame)
+                yield frame
+        except BaseException:
+            # Keep the user turn even if generation fails or the client goes away.
+            await message_store.save(user_message, durability=durability)
+            raise
+        reply = "".join(parts)
+
+    assistant_message = message_store.new_message(session_id, "assistant", reply, message_id=message_id)
+    await message_store.save(user_message, assistant_message, durability=durability)
+
+    frame = {"type": "assistant_message", "message": _message_payload(assistant_message)}
+    await ws_manager.broadcast(session_id, frame)
+    yield frame
+
+
+@router.post(
+    "/message/stream",
+    response_class=StreamingResponse,
+    dependencies=[Depends(rate_limit("20/minute"))],
+)
+async def post_message_stream(
+    payload: MessageRequest,
+    practice: Practice = Depends(current_practice),
+    _: None = Depends(enforce_https),
+) -> StreamingResponse:
+    user_message, conversation = await _start_turn(payload.session_id, payload.content.strip(), practice)
+    user_frame = {"type": "user_message", "message": _message_payload(user_message)}
+
+    async def event_stream() -> AsyncIterator[str]:
+        yield _sse_event(user_frame)
+        try:
+            async for frame in _stream_assistant_reply(
+                user_message, conversation, practice, durability_for("stream")
+            ):
+                yield _sse_event(frame)
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Assistant stream failed: %s", exc)
+            yield _sse_event({"type": "error", "message": "Antwort des Assistenten derzeit nicht verfügbar."})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
-    await ws_manager.broadcast(
-        session.id,
-        {
-            "type": "assistant_message",
-            "message": response_payload.dict(),
-        },
+
+async def run_generation_job(job: GenerationJob) -> dict[str, Any]:
+    # Continues the trace of the request that queued the job.
+    with tracer.span("generation.job", job.traceparent, job_id=str(job.id), attempt=job.attempts):
+        reply = await _generate_reply(job.conversation, practice_registry.get(job.practice_id))
+        assistant_message = message_store.new_message(job.session_id, "assistant", reply)
+        await message_store.save(assistant_message, durability=durability_for("async"))
+        payload = _message_payload(assistant_message)
+        await ws_manager.broadcast(
+            job.session_id, {"type": "assistant_message", "job_id": str(job.id), "message": payload}
+        )
+        return payload
+
+
+async def notify_generation_failure(job: GenerationJob) -> None:
+    with tracer.span("generation.failed", job.traceparent, job_id=str(job.id)):
+        await ws_manager.broadcast(job.session_id, {"type": "error", "job_id": str(job.id), "message": job.error})
+
+
+@router.post(
+    "/message/async",
+    response_model=JobAcceptedResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(rate_limit("20/minute"))],
+)
+async def post_message_async(
+    payload: MessageRequest,
+    practice: Practice = Depends(current_practice),
+    _: None = Depends(enforce_https),
+) -> JobAcceptedResponse:
+    user_message, conversation = await _start_turn(payload.session_id, payload.content.strip(), practice)
+    # The reply is produced by another worker, so the user turn is stored right away.
+    await message_store.save(user_message, durability=durability_for("async"))
+
+    try:
+        job = await generation_pool.submit(payload.session_id, conversation, practice.id)
+    except QueueFullError as exc:
+        logger.warning("Generation queue full, rejecting message for session %s", payload.session_id)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=BUSY_MESSAGE,
+            headers={"Retry-After": "5"},
+        ) from exc
+
+    return JobAcceptedResponse(
+        job_id=job.id,
+        status=job.status,  # type: ignore[arg-type]
+        user_message=MessageResponse(**_message_payload(user_message)),
     )
 
-    return response_payload
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=JobStatusResponse,
+    dependencies=[Depends(rate_limit("60/minute"))],
+)
+async def get_job(
+    job_id: uuid.UUID = Path(..., description="ID des Generierungsauftrags"),
+    practice: Practice = Depends(current_practice),
+    _: None = Depends(enforce_https),
+) -> JobStatusResponse:
+    job = await generation_pool.queue.fetch(job_id)
+    if job is None or not practice.owns(job.practice_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Auftrag nicht gefunden.")
+    return JobStatusResponse(
+        job_id=job.id,
+        session_id=job.session_id,
+        status=job.status,  # type: ignore[arg-type]
+        attempts=job.attempts,
+        message=MessageResponse(**job.result) if job.result else None,
+        error=job.error,
+    )
+
+
+async def _replay_missed(
+    session_id: uuid.UUID, websocket: WebSocket, practice: Practice, last_message_id: str
+) -> None:
+    # A reconnecting client names the last message it has; it gets the ones
+    # after it instead of refetching the history. If that message is unknown
+    # or the gap is too long, it is told to resync through the history API.
+    try:
+        cursor = await message_store.message_cursor(session_id, uuid.UUID(last_message_id))
+    except ValueError:
+        cursor = None
+    page = None
+    if cursor is not None:
+        page = await message_store.load_page(session_id, practice.id, settings.ws_resume_max_messages, after=cursor)
+    if page is None or page.has_more:
+        await ws_manager.send(session_id, websocket, {"type": "resync"})
+        return
+    for row in page.rows:
+        await ws_manager.send(session_id, websocket, {"type": f"{row.role}_message", "message": _message_payload(row)})
+
+
+async def _handle_websocket_message(
+    session_id: uuid.UUID,
+    websocket: WebSocket,
+    practice: Practice,
+    data: Any,
+    remote_ip: str,
+    durability: Durability,
+) -> None:
+    try:
+        await rate_limiter.hit("websocket_message", f"{practice.id}:{remote_ip}", WEBSOCKET_MESSAGE_RATE)
+        content = data.get("content") if isinstance(data, dict) else None
+        if not isinstance(content, str) or not content.strip():
+            await ws_manager.send(session_id, websocket, {"error": "Ungültige Nachricht."})
+            return
+        # Same slots as the REST turns; held until the reply has been sent.
+        async with admission_controller.admit(emergency=is_emergency_text(content)):
+            await _answer_websocket_message(
+                session_id, websocket, practice, content.strip(), bool(data.get("stream")), durability
+            )
+    except RateLimitExceeded as exc:
+        await _send_retry_later(
+            session_id, websocket, "Zu viele Nachrichten. Bitte versuchen Sie es gleich erneut.", exc.retry_after
+        )
+    except AdmissionRejected as exc:
+        await _send_retry_later(session_id, websocket, BUSY_MESSAGE, exc.retry_after)
+
+
+async def _send_retry_later(session_id: uuid.UUID, websocket: WebSocket, message: str, retry_after: float) -> None:
+    await ws_manager.send(
+        session_id,
+        websocket,
+        {"type": "error", "message": message, "retry_after": math.ceil(retry_after)},
+    )
+
+
+async def _answer_websocket_message(
+    session_id: uuid.UUID,
+    websocket: WebSocket,
+    practice: Practice,
+    content: str,
+    stream: bool,
+    durability: Durability,
+) -> None:
+    user_message, conversation = await _start_turn(session_id, content, practice)
+    ws_manager.touch(session_id, websocket, busy=True)
+    if stream:
+        try:
+            async for _frame in _stream_assistant_reply(user_message, conversation, practice, durability):
+                pass
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Assistant stream failed: %s", exc)
+            await ws_manager.send(
+                session_id,
+                websocket,
+                {"type": "error", "message": "Antwort des Assistenten derzeit nicht verfügbar."},
+            )
+        return
+
+    try:
+        assistant_reply = await _generate_reply(conversation, practice)
+    except Exception as exc:  # noqa: BLE001
+        await message_store.save(user_message, durability=durability)
+        logger.exception("Assistant response failed: %s", exc)
+        await ws_manager.send(
+            session_id,
+            websocket,
+            {"type": "error", "message": "Antwort des Assistenten derzeit nicht verfügbar."},
+        )
+        return
+
+    assistant_message = message_store.new_message(session_id, "assistant", assistant_reply)
+    await message_store.save(user_message, assistant_message, durability=durability)
+
+    await ws_manager.broadcast(
+        session_id, {"type": "assistant_message", "message": _message_payload(assistant_message)}
+    )
 
 
 @router.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: uuid.UUID) -> None:
     api_key = websocket.headers.get("x-api-key") or websocket.query_params.get("api_key")
-    if api_key != settings.api_key:
+    practice = practice_registry.for_api_key(api_key) if api_key else None
+    if practice is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # The session is only checked out for this lookup; each turn uses its own
+    # short-lived connections, so idle sockets do not pin a pooled connection.
+    async with get_session_factory()() as db_session:
+        chat_session = await db_session.get(ChatSession, session_id)
+    if chat_session is None or not practice.owns(chat_session.practice_id):
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    await ws_manager.connect(session_id, websocket)
+    protocol = negotiate(websocket)
+    await ws_manager.connect(session_id, websocket, protocol)
+    remote_ip = client_ip(websocket)
+    durability = durability_for("websocket")
 
     try:
-        async with async_session_factory() as db_session:
-            await _get_session(session_id, db_session)
-
-            while True:
-                raw_data = await websocket.receive_text()
-                data = json.loads(raw_data)
-                content = data.get("content")
-                if not isinstance(content, str) or not content.strip():
-                    await websocket.send_text(json.dumps({"error": "Ungültige Nachricht."}))
-                    continue
-
-                user_message = Message(session_id=session_id, role="user", content=content.strip())
-                db_session.add(user_message)
-                await db_session.commit()
-                await db_session.refresh(user_message)
-
-                await ws_manager.broadcast(
-                    session_id,
-                    {
-                        "type": "user_message",
-                        "message": {
-                            "message_id": str(user_message.id),
-                            "session_id": str(session_id),
-                            "role": "user",
-                            "content": user_message.content,
-                            "timestamp": user_message.timestamp.isoformat(),
-                        },
-                    },
-                )
-
-                conversation = await _build_conversation_history(db_session, session_id, limit=10)
-                try:
-                    assistant_reply = await openai_service.generate_response(conversation)
-                except Exception as exc:  # noqa: BLE001
-                    await db_session.rollback()
-                    logger.exception("Assistant response failed: %s", exc)
-                    await websocket.send_text(
-                        json.dumps({"type": "error", "message": "Antwort des Assistenten derzeit nicht verfügbar."})
-                    )
-                    continue
-
-                assistant_message = Message(session_id=session_id, role="assistant", content=assistant_reply)
-                db_session.add(assistant_message)
-                await db_session.commit()
-                await db_session.refresh(assistant_message)
-
-                payload = {
-                    "type": "assistant_message",
-                    "message": {
-                        "message_id": str(assistant_message.id),
-                        "session_id": str(session_id),
-                        "role": "assistant",
-                        "content": assistant_message.content,
-                        "timestamp": assistant_message.timestamp.isoformat(),
-                    },
-                }
-                await ws_manager.broadcast(session_id, payload)
+        if protocol.version >= 2:
+            await ws_manager.send(
+                session_id,
+                websocket,
+                {
+                    "type": "hello",
+                    "protocol": PROTOCOL_VERSION,
+                    "heartbeat_interval": settings.ws_heartbeat_interval_seconds,
+                    "idle_timeout": settings.ws_idle_timeout_seconds,
+                },
+            )
+        last_message_id = websocket.query_params.get("last_message_id")
+        if last_message_id:
+            await _replay_missed(session_id, websocket, practice, last_message_id)
+
+        while True:
+            # Idle from here until the next frame arrives.
+            ws_manager.touch(session_id, websocket)
+            try:
+                data = await receive_frame(websocket, protocol)
+            except ValueError:
+                data = None
+            frame_type = data.get("type") if isinstance(data, dict) else None
+            if frame_type in HEARTBEAT_FRAMES:
+                if frame_type == "ping":
+                    await ws_manager.send(session_id, websocket, {"type": "pong"})
+                continue
+            # Each message is a trace of its own; the socket may stay open for hours.
+            with tracer.span("WebSocket message"):
+                await _handle_websocket_message(session_id, websocket, practice, data, remote_ip, durability)
     except WebSocketDisconnect:
-        ws_manager.disconnect(session_id, websocket)
+        await ws_manager.release(session_id, websocket)
     except Exception as exc:  # noqa: BLE001
         logger.exception("WebSocket error for session %s: %s", session_id, exc)
-        ws_manager.disconnect(session_id, websocket)
-    finally:
-        if db_session:
-            await db_session.close()
+        await ws_manager.release(session_id, websocket)
 
@@ -0,0 +1,56 @@
+import json
+import logging
+import uuid
+from datetime import date, datetime
+from typing import Any, Callable
+
+from starlette.responses import JSONResponse
+
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+SERIALIZERS = ("auto", "orjson", "json")
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if hasattr(value, "dict"):
+        return value.dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(value: Any) -> bytes:
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _load_serializer(name: str) -> tuple[str, Callable[[Any], bytes], Callable[[str | bytes], Any]]:
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown JSON_SERIALIZER {name!r}, expected one of {', '.join(SERIALIZERS)}")
+    if name in ("auto", "orjson"):
+        try:
+            import orjson
+        except ImportError:
+            if name == "orjson":
+                raise
+            logger.info("orjson is not installed, using the standard library JSON encoder.")
+        else:
+            # orjson handles datetime and UUID natively; the output matches the
+            # isoformat()/str() strings the stdlib path produces.
+            return "orjson", lambda value: orjson.dumps(value, default=_default), orjson.loads
+    return "json", _stdlib_dumps, json.loads
+
+
+SERIALIZER, dumps, loads = _load_serializer(settings.json_serializer)
+
+
+def dumps_text(value: Any) -> str:
+    return dumps(value).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
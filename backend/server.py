@@ -0,0 +1,116 @@
+import importlib
+import logging
+import os
+import signal
+import time
+from contextlib import suppress
+from socket import socket
+
+import uvicorn
+
+from .models.migrations import migrate
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+APP = "backend.main:app"
+
+# Imported lazily by the application; loading them in the master before the
+# fork lets every worker share the pages instead of importing them again.
+PRELOAD_MODULES = ("openai",)
+
+# uvicorn's exit code when the lifespan startup failed; restarting does not help.
+STARTUP_FAILURE = 3
+
+
+def _options() -> dict[str, object]:
+    return {
+        "host": settings.host,
+        "port": settings.port,
+        # Protocol-level pings close half-open sockets of every client; browsers
+        # answer them without any application code.
+        "ws_ping_interval": settings.ws_ping_interval_seconds,
+        "ws_ping_timeout": settings.ws_ping_timeout_seconds,
+        "ws_per_message_deflate": settings.ws_per_message_deflate,
+    }
+
+
+def _serve(config: uvicorn.Config, sock: socket) -> None:
+    # uvicorn installs its own handlers; the master's must not leak into the worker.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 1
+    try:
+        server = uvicorn.Server(config)
+        server.run(sockets=[sock])
+        code = 0 if server.started else STARTUP_FAILURE
+    finally:
+        os._exit(code)
+
+
+def _prefork(workers: int) -> None:
+    config = uvicorn.Config(APP, **_options())
+    # The application is imported once, before forking; the workers start from a
+    # copy of this process and only run the lifespan (pool, clients, tasks).
+    config.load()
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+    migrate()
+    sock = config.bind_socket()
+    children: set[int] = set()
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            _serve(config, sock)
+        children.add(pid)
+
+    def stop(signum: int, _: object) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            with suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    logger.info("Started %d worker(s) on %s:%d.", workers, settings.host, settings.port)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        code = os.waitstatus_to_exitcode(status)
+        if stopping:
+            continue
+        if code == STARTUP_FAILURE:
+            logger.error("Worker %d failed to start, shutting down.", pid)
+            stop(signal.SIGTERM, None)
+            continue
+        logger.warning("Worker %d exited with %d, starting a new one.", pid, code)
+        time.sleep(1)
+        spawn()
+    sock.close()
+
+
+def run() -> None:
+    if settings.debug:
+        uvicorn.run(APP, reload=True, **_options())
+        return
+    if settings.web_concurrency <= 1:
+        uvicorn.run(APP, **_options())
+        return
+    if not hasattr(os, "fork"):
+        migrate()
+        uvicorn.run(APP, workers=settings.web_concurrency, **_options())
+        return
+    _prefork(settings.web_concurrency)
+
+
+if __name__ == "__main__":
+    run()
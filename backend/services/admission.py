@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager, suppress
+from contextvars import ContextVar
+from typing import Any, AsyncIterator
+
+from starlette.responses import JSONResponse, Response
+
+from ..metrics import registry
+from ..serialization import loads
+from ..settings import settings
+from ..tracing import tracer
+from .openai_governor import EMERGENCY_PATTERN
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "Der Assistent ist derzeit ausgelastet. Bitte versuchen Sie es später erneut."
+# Answer to a client that is already gone (as in nginx). Nobody reads it, but
+# the middleware above still expects a response, and the latency metrics keep
+# abandoned turns apart.
+CLIENT_CLOSED_REQUEST = 499
+
+# How often the event loop is probed; a probe that wakes up late measures the lag.
+LAG_PROBE_INTERVAL = 0.1
+# Weight of the newest turn in the moving average of turn durations.
+TURN_DURATION_WEIGHT = 0.2
+
+ADMISSION_REJECTED = registry.counter(
+    "admission_rejected_total", "Chat turns turned away before any work was done, by reason.", ("reason",)
+)
+ADMISSION_ABANDONED = registry.counter(
+    "admission_abandoned_total", "Chat turns dropped because the client disconnected, by stage.", ("stage",)
+)
+ADMISSION_WAIT = registry.histogram(
+    "admission_queue_wait_seconds",
+    "Time an admitted chat turn waited for a slot.",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(f"Chat turn rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# Set by AdmissionMiddleware while a turn runs; the event fires when the client goes away.
+_disconnected: ContextVar[asyncio.Event | None] = ContextVar("client_disconnected", default=None)
+
+
+def raise_if_disconnected() -> None:
+    # Called right before the model is asked: nobody would read the answer.
+    event = _disconnected.get()
+    if event is not None and event.is_set():
+        ADMISSION_ABANDONED.inc(stage="before_model")
+        raise ClientDisconnected()
+
+
+def is_emergency_text(content: Any) -> bool:
+    return isinstance(content, str) and EMERGENCY_PATTERN.search(content) is not None
+
+
+class AdmissionController:
+    # Bounds the chat turns a worker runs at once and sheds load early: a turn
+    # that would wait longer than the latency target allows is rejected right
+    # away with a Retry-After instead of timing out in the client. Emergency
+    # messages are always admitted and never wait.
+    def __init__(
+        self,
+        enabled: bool,
+        max_in_flight: int = 32,
+        max_queue: int = 64,
+        max_queue_wait: float = 5.0,
+        target_latency: float = 12.0,
+        max_loop_lag: float = 0.25,
+    ) -> None:
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.target_latency = target_latency
+        self.max_loop_lag = max_loop_lag
+        self.in_flight = 0
+        self.loop_lag = 0.0
+        # Moving average over finished turns; 0 until the first one is measured.
+        self.turn_duration = 0.0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._monitor: asyncio.Task[None] | None = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for future in self._waiters if not future.done())
+
+    async def start(self) -> None:
+        if self.enabled and self._monitor is None:
+            self._monitor = asyncio.create_task(self._watch_loop_lag(), name="admission-loop-lag")
+
+    async def stop(self) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._monitor
+            self._monitor = None
+
+    async def _watch_loop_lag(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            lag = max(0.0, time.perf_counter() - started - LAG_PROBE_INTERVAL)
+            # A single late probe is kept for a few rounds instead of being
+            # forgotten by the next punctual one.
+            self.loop_lag = max(lag, self.loop_lag / 2)
+
+    def predicted_wait(self) -> float:
+        # Turns ahead in the queue, drained max_in_flight at a time.
+        return (self.queued + 1) / self.max_in_flight * self.turn_duration
+
+    def _check(self) -> None:
+        if self.loop_lag > self.max_loop_lag:
+            self._reject("loop_lag", 1.0)
+        if self.in_flight < self.max_in_flight and not self.queued:
+            return
+        wait = self.predicted_wait()
+        if self.queued >= self.max_queue:
+            self._reject("queue_full", wait)
+        if wait > self.max_queue_wait or wait + self.turn_duration > self.target_latency:
+            self._reject("latency", wait)
+
+    def _reject(self, reason: str, retry_after: float) -> None:
+        ADMISSION_REJECTED.inc(reason=reason)
+        logger.warning(
+            "Rejecting chat turn (%s): %d in flight, %d queued, loop lag %.0f ms.",
+            reason,
+            self.in_flight,
+            self.queued,
+            self.loop_lag * 1000,
+        )
+        raise AdmissionRejected(reason, max(1.0, retry_after))
+
+    async def _acquire(self) -> None:
+        self._check()
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            return
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.max_queue_wait)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout", self.predicted_wait())
+        except asyncio.CancelledError:
+            # The slot may have been handed over right before the cancellation.
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.max_in_flight:
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def admit(self, emergency: bool = False) -> AsyncIterator[None]:
+        if not self.enabled:
+            yield
+            return
+        queued_at = time.perf_counter()
+        if emergency:
+            self.in_flight += 1
+        else:
+            await self._acquire()
+        admitted_at = time.perf_counter()
+        ADMISSION_WAIT.observe(admitted_at - queued_at)
+        tracer.current().set(admission_wait_ms=round((admitted_at - queued_at) * 1000, 1))
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - admitted_at
+            self.turn_duration = (
+                duration
+                if not self.turn_duration
+                else TURN_DURATION_WEIGHT * duration + (1 - TURN_DURATION_WEIGHT) * self.turn_duration
+            )
+            self._release()
+
+
+def busy_response(exc: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(
+        {"detail": BUSY_MESSAGE},
+        status_code=503,
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
+class AdmissionMiddleware:
+    # Plain ASGI: the request body has to be read here (emergency check) and
+    # the client has to be watched for a disconnect while the turn waits.
+    # Everything else, /health included, passes straight through.
+    def __init__(self, app: Any, controller: AdmissionController, paths: tuple[str, ...]) -> None:
+        self.app = app
+        self.controller = controller
+        self.paths = paths
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        chunks: list[bytes] = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                await Response(status_code=CLIENT_CLOSED_REQUEST)(scope, receive, send)
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        try:
+            content = loads(body).get("content") if body else None
+        except (ValueError, AttributeError):
+            content = None  # the route answers with 422
+
+        disconnected = asyncio.Event()
+        body_sent = False
+        admitted = False
+        response_started = False
+
+        async def replay() -> dict[str, Any]:
+            # The app reads the buffered body once, then only hears about a disconnect.
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def watched_send(message: dict[str, Any]) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        async def run_turn() -> None:
+            nonlocal admitted
+            try:
+                async with self.controller.admit(emergency=is_emergency_text(content)):
+                    admitted = True
+                    await self.app(scope, replay, watched_send)
+            except AdmissionRejected as exc:
+                if not disconnected.is_set():
+                    await busy_response(exc)(scope, replay, watched_send)
+
+        token = _disconnected.set(disconnected)
+        try:
+            turn = asyncio.create_task(run_turn())
+        finally:
+            _disconnected.reset(token)
+
+        async def watch() -> None:
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+            if not admitted:
+                # Still queued: give the slot to someone who is waiting for it.
+                ADMISSION_ABANDONED.inc(stage="queued")
+                turn.cancel()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await asyncio.wait({turn})
+        finally:
+            watcher.cancel()
+            turn.cancel()
+        if not turn.cancelled():
+            turn.result()
+        # The client left while queued, or was rejected after it had left.
+        if not response_started:
+            await Response(status_code=CLIENT_CLOSED_REQUEST)(scope, replay, send)
+
+
+def _create_admission_controller() -> AdmissionController:
+    return AdmissionController(
+        settings.admission_enabled,
+        max_in_flight=settings.admission_max_in_flight,
+        max_queue=settings.admission_max_queue,
+        max_queue_wait=settings.admission_max_queue_wait_seconds,
+        target_latency=settings.admission_target_latency_seconds,
+        max_loop_lag=settings.admission_max_loop_lag_seconds,
+    )
+
+
+admission_controller = _create_admission_controller()
+
+registry.gauge(
+    "admission_in_flight", "Chat turns currently admitted.", callback=lambda: admission_controller.in_flight
+)
+registry.gauge("admission_queued", "Chat turns waiting for a slot.", callback=lambda: admission_controller.queued)
+registry.gauge(
+    "admission_event_loop_lag_seconds",
+    "How late the event loop ran a timer, as last measured.",
+    callback=lambda: admission_controller.loop_lag,
+)
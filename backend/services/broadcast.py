@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable
+
+from ..metrics import registry
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[uuid.UUID, str], Awaitable[None]]
+
+PUBLISH_FAILED = registry.counter(
+    "ws_broadcast_publish_failures_total", "Broadcasts that only reached this worker because publishing failed."
+)
+
+
+class BroadcastBackend(ABC):
+    @abstractmethod
+    async def start(self, deliver: Deliver) -> None: ...
+
+    @abstractmethod
+    async def publish(self, session_id: uuid.UUID, message: str) -> None: ...
+
+    # Called when the first socket of a session joins this worker and when the
+    # last one leaves.
+    async def subscribe(self, session_id: uuid.UUID) -> None:
+        return None
+
+    async def unsubscribe(self, session_id: uuid.UUID) -> None:
+        return None
+
+    async def stop(self) -> None:
+        return None
+
+
+class InProcessBroadcastBackend(BroadcastBackend):
+    def __init__(self) -> None:
+        self._deliver: Deliver | None = None
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def publish(self, session_id: uuid.UUID, message: str) -> None:
+        if self._deliver is not None:
+            await self._deliver(session_id, message)
+
+
+# Every worker subscribes to the channels of the sessions it holds sockets for
+# and delivers events to them, including the events it published itself.
+class RedisBroadcastBackend(BroadcastBackend):
+    def __init__(self, client: Any, channel_prefix: str = "chat:session:") -> None:
+        from redis.exceptions import RedisError
+
+        self.client = client
+        self.channel_prefix = channel_prefix
+        self._errors = (RedisError, OSError)
+        self._deliver: Deliver | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._channels: set[str] = set()
+        self._pubsub: Any = None
+        self._wake = asyncio.Event()
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        self._task = asyncio.create_task(self._listen(), name="redis-broadcast-listener")
+
+    async def publish(self, session_id: uuid.UUID, message: str) -> None:
+        try:
+            await self.client.publish(self._channel(session_id), message)
+        except self._errors as exc:
+            # Sockets on other workers miss this event, the ones here still get it.
+            PUBLISH_FAILED.inc()
+            logger.warning("Redis publish for session %s failed, delivering locally only: %s", session_id, exc)
+            if self._deliver is not None:
+                await self._deliver(session_id, message)
+
+    async def subscribe(self, session_id: uuid.UUID) -> None:
+        channel = self._channel(session_id)
+        self._channels.add(channel)
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.subscribe(channel)
+            except self._errors as exc:
+                # The listener subscribes to every channel again when it reconnects.
+                logger.warning("Redis subscribe for session %s failed: %s", session_id, exc)
+        self._wake.set()
+
+    async def unsubscribe(self, session_id: uuid.UUID) -> None:
+        channel = self._channel(session_id)
+        self._channels.discard(channel)
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.unsubscribe(channel)
+            except self._errors as exc:
+                logger.warning("Redis unsubscribe for session %s failed: %s", session_id, exc)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.client.aclose()
+
+    def _channel(self, session_id: uuid.UUID) -> str:
+        return f"{self.channel_prefix}{session_id}"
+
+    async def _listen(self) -> None:
+        backoff = 0.5
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub = pubsub
+            try:
+                if self._channels:
+                    await pubsub.subscribe(*self._channels)
+                backoff = 0.5
+                while True:
+                    if not pubsub.subscribed:
+                        # No socket on this worker: nothing to listen to until one joins.
+                        self._wake.clear()
+                        await self._wake.wait()
+                        continue
+                    event = await pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+                    if event is not None:
+                        await self._handle(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # noqa: BLE001
+                logger.warning("Redis broadcast listener failed, retrying in %.1fs: %s", backoff, exc)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+            finally:
+                self._pubsub = None
+                await pubsub.aclose()
+
+    async def _handle(self, event: dict[str, Any]) -> None:
+        if event.get("type") != "message" or self._deliver is None:
+            return
+        channel = event["channel"]
+        data = event["data"]
+        if isinstance(channel, bytes):
+            channel = channel.decode("utf-8")
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        try:
+            session_id = uuid.UUID(channel[len(self.channel_prefix) :])
+        except ValueError:
+            logger.warning("Ignoring broadcast on unexpected channel %s", channel)
+            return
+        await self._deliver(session_id, data)
+
+
+def create_broadcast_backend() -> BroadcastBackend:
+    if settings.broadcast_backend == "redis":
+        from redis.asyncio import Redis
+
+        return RedisBroadcastBackend(Redis.from_url(settings.redis_url))
+    if settings.broadcast_backend != "memory":
+        raise ValueError(f"Unknown BROADCAST_BACKEND {settings.broadcast_backend!r}")
+    return InProcessBroadcastBackend()
@@ -0,0 +1,65 @@
+from dataclasses import dataclass, field
+
+from ..settings import settings
+from .conversation_cache import ConversationHistory, Turn
+from .tokenizer import TokenCounter, token_counter
+
+# Two extra messages (one exchange: a user message and its reply) are fetched
+# beyond the packed window, so messages leaving it show up as overflow and
+# trigger the summarizer. It reads everything up to the newest of them from the
+# database, so a backlog left by a skipped or failed run is not lost.
+CONTEXT_HEADROOM_MESSAGES = 2
+
+SUMMARY_PREFIX = "Zusammenfassung des bisherigen Gesprächs (ältere Nachrichten):\n"
+
+
+@dataclass
+class ContextWindow:
+    messages: list[dict[str, str]]
+    tokens: int
+    overflow: list[Turn] = field(default_factory=list)
+
+
+class ContextBuilder:
+    def __init__(self, counter: TokenCounter, token_budget: int, max_messages: int) -> None:
+        self.counter = counter
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+
+    @property
+    def fetch_limit(self) -> int:
+        return self.max_messages + CONTEXT_HEADROOM_MESSAGES
+
+    def build(self, history: ConversationHistory, user_content: str) -> ContextWindow:
+        # The new user message and the summary are always sent, even if they
+        # alone exceed the budget; older turns are packed newest first.
+        user_turn = {"role": "user", "content": user_content}
+        prefix = []
+        if history.summary:
+            prefix.append({"role": "system", "content": SUMMARY_PREFIX + history.summary})
+        used = self.counter.count_messages([*prefix, user_turn])
+
+        packed: list[dict[str, str]] = []
+        for turn in reversed(history.turns):
+            if len(packed) >= self.max_messages:
+                break
+            message = turn.as_message()
+            cost = self.counter.count_message(message)
+            if used + cost > self.token_budget:
+                break
+            packed.append(message)
+            used += cost
+
+        overflow = history.turns[: len(history.turns) - len(packed)]
+        return ContextWindow(messages=[*prefix, *reversed(packed), user_turn], tokens=used, overflow=overflow)
+
+
+def _create_builder() -> ContextBuilder:
+    return ContextBuilder(
+        token_counter(settings.openai_model),
+        token_budget=settings.context_token_budget,
+        max_messages=settings.context_max_messages,
+    )
+
+
+context_builder = _create_builder()
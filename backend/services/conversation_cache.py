@@ -0,0 +1,108 @@
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import NamedTuple
+
+
+class Turn(NamedTuple):
+    role: str
+    content: str
+    timestamp: datetime
+
+    def as_message(self) -> dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+@dataclass
+class ConversationHistory:
+    turns: list[Turn] = field(default_factory=list)
+    summary: str | None = None
+    # Turns up to and including this timestamp are folded into the summary.
+    summarized_until: datetime | None = None
+    practice_id: str | None = None
+
+
+class _Window:
+    __slots__ = ("turns", "summary", "summarized_until", "practice_id", "touched_at")
+
+    def __init__(
+        self, turns: deque[Turn], summary: str | None, summarized_until: datetime | None, practice_id: str | None
+    ) -> None:
+        self.turns = turns
+        self.summary = summary
+        self.summarized_until = summarized_until
+        self.practice_id = practice_id
+        self.touched_at = time.monotonic()
+
+
+class ConversationWindowCache:
+    def __init__(self, window: int = 10, max_sessions: int = 5000, idle_seconds: float = 1800.0) -> None:
+        self.window = window
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions: OrderedDict[uuid.UUID, _Window] = OrderedDict()
+        self.stats: dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict_idle(self) -> None:
+        # Entries are kept in access order, so idle sessions sit at the front.
+        deadline = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            session_id, window = next(iter(self._sessions.items()))
+            if window.touched_at >= deadline:
+                break
+            del self._sessions[session_id]
+            self.stats["evictions"] += 1
+
+    def _touch(self, session_id: uuid.UUID, window: _Window) -> None:
+        window.touched_at = time.monotonic()
+        self._sessions.move_to_end(session_id)
+
+    def get(self, session_id: uuid.UUID, limit: int) -> ConversationHistory | None:
+        self._evict_idle()
+        window = self._sessions.get(session_id)
+        if window is None or limit > self.window:
+            self.stats["misses"] += 1
+            return None
+        self._touch(session_id, window)
+        self.stats["hits"] += 1
+        turns = list(window.turns)
+        if window.summarized_until is not None:
+            turns = [turn for turn in turns if turn.timestamp > window.summarized_until]
+        return ConversationHistory(turns[-limit:], window.summary, window.summarized_until, window.practice_id)
+
+    def fill(self, session_id: uuid.UUID, history: ConversationHistory) -> None:
+        window = _Window(
+            deque(history.turns, maxlen=self.window), history.summary, history.summarized_until, history.practice_id
+        )
+        self._sessions[session_id] = window
+        self._touch(session_id, window)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def append(self, session_id: uuid.UUID, turn: Turn) -> None:
+        # Sessions that are not cached are rebuilt from the database on their next read.
+        window = self._sessions.get(session_id)
+        if window is None:
+            return
+        window.turns.append(turn)
+        self._touch(session_id, window)
+
+    def set_summary(self, session_id: uuid.UUID, summary: str, summarized_until: datetime) -> None:
+        window = self._sessions.get(session_id)
+        if window is None:
+            return
+        if window.summarized_until is None or summarized_until > window.summarized_until:
+            window.summary = summary
+            window.summarized_until = summarized_until
+
+    def discard(self, session_id: uuid.UUID) -> None:
+        self._sessions.pop(session_id, None)
+
+    def clear(self) -> None:
+        self._sessions.clear()
@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import re
+from types import SimpleNamespace
+from typing import Any, AsyncIterator
+
+DEFAULT_FAKE_REPLY = (
+    "Vielen Dank für Ihre Nachricht. Die Hausarztpraxis Orchideenkamp ist Montag bis Freitag "
+    "von 08:00 bis 13:00 Uhr sowie Montag und Donnerstag von 15:00 bis 18:30 Uhr erreichbar."
+)
+
+EMBEDDING_DIMENSIONS = 64
+
+
+def embed_text(text: str) -> list[float]:
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for token in re.findall(r"\w+", text.casefold()):
+        bucket = int(hashlib.md5(token.encode("utf-8")).hexdigest(), 16) % EMBEDDING_DIMENSIONS
+        vector[bucket] += 1.0
+    return vector
+
+
+def estimate_usage(messages: list[dict[str, Any]], reply: str) -> dict[str, int]:
+    prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 4
+    completion_tokens = len(reply) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class _FakeCompletions:
+    def __init__(self, owner: "FakeAsyncOpenAI") -> None:
+        self._owner = owner
+
+    async def create(
+        self,
+        *,
+        messages: list[dict[str, Any]],
+        stream: bool = False,
+        stream_options: dict[str, Any] | None = None,
+        **_: Any,
+    ) -> Any:
+        self._owner.calls.append(messages)
+        if self._owner.latency:
+            await asyncio.sleep(self._owner.latency)
+        reply = self._owner.reply
+        if stream:
+            usage = None
+            if (stream_options or {}).get("include_usage"):
+                usage = SimpleNamespace(**estimate_usage(messages, reply))
+            return self._owner._stream(reply, usage)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=reply))],
+            usage=SimpleNamespace(**estimate_usage(messages, reply)),
+        )
+
+
+class _FakeEmbeddings:
+    async def create(self, *, input: str, **_: Any) -> Any:
+        return SimpleNamespace(data=[SimpleNamespace(index=0, embedding=embed_text(input))])
+
+
+class FakeAsyncOpenAI:
+
+    def __init__(
+        self,
+        reply: str = DEFAULT_FAKE_REPLY,
+        latency: float = 0.0,
+        chunk_size: int = 8,
+        chunk_delay: float = 0.0,
+    ) -> None:
+        self.reply = reply
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.calls: list[list[dict[str, Any]]] = []
+        self.chat = SimpleNamespace(completions=_FakeCompletions(self))
+        self.embeddings = _FakeEmbeddings()
+
+    async def _stream(self, reply: str, usage: Any = None) -> AsyncIterator[Any]:
+        for start in range(0, len(reply), self.chunk_size):
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            delta = SimpleNamespace(role="assistant", content=reply[start : start + self.chunk_size])
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)])
+        yield SimpleNamespace(
+            choices=[SimpleNamespace(index=0, delta=SimpleNamespace(role=None, content=None), finish_reason="stop")]
+        )
+        if usage is not None:
+            yield SimpleNamespace(choices=[], usage=usage)
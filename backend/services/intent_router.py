@@ -0,0 +1,172 @@
+import argparse
+import json
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+_UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+_TOKEN = re.compile(r"\w+")
+_END = "\0"
+
+DEFAULT_INTENTS_PATH = Path(__file__).resolve().parent.parent / "data" / "intents.json"
+FRONTEND_RESPONSES_PATH = Path(__file__).resolve().parents[2] / "frontend" / "src" / "data" / "responses.ts"
+# Just enough of responses.ts to compare it: top-level entries, their text or
+# html, and the link cards in order.
+_TS_ENTRY = re.compile(r"^  '([^']+)': \{\n(.*?)^  \}", re.MULTILINE | re.DOTALL)
+_TS_TEXT = re.compile(r"^    text: '([^']*)'", re.MULTILINE)
+_TS_HTML = re.compile(r"^    html: `([^`]*)`", re.MULTILINE)
+_TS_LINK = re.compile(r"\{ icon: '([^']*)', title: '([^']*)', subtitle: '([^']*)'(?:, url: '([^']*)')?")
+
+STOPWORDS = frozenset(
+    """
+    a ab am an auch bei bitte brauche bräuchte da das dass dem den der des die du ein eine einem einen einer
+    es fuer für gern gerne guten hallo hab habe haben hi ich ihr ihre ihnen im in ist ja kann koennen können
+    koennte könnte mal mein meine meinen mich mir mit moechte möchte morgen nach noch nun oder sie sind so tag
+    und uns von vom wann was welche wie wo wollen wuerde würde zu zum zur
+    """.split()
+)
+
+
+def _tokenize(text: str) -> list[str]:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return [token.translate(_UMLAUTS) for token in _TOKEN.findall(text) if token not in STOPWORDS]
+
+
+@dataclass
+class IntentMatch:
+    intent: str
+    confidence: float
+    reply: str
+
+
+class IntentRouter:
+    def __init__(self, intents: list[dict[str, Any]], min_confidence: float = 0.75) -> None:
+        self.min_confidence = min_confidence
+        self._replies: dict[str, str] = {}
+        self._trie: dict[str, Any] = {}
+        for intent in intents:
+            name = intent["intent"]
+            self._replies[name] = self._render(intent)
+            for keyword in intent.get("keywords", []):
+                self._insert(_tokenize(keyword), name)
+
+    @classmethod
+    def from_file(cls, path: Path, min_confidence: float = 0.75) -> "IntentRouter":
+        with path.open(encoding="utf-8") as handle:
+            data = json.load(handle)
+        return cls(data["intents"], min_confidence=min_confidence)
+
+    @staticmethod
+    def _render(intent: dict[str, Any]) -> str:
+        links = intent.get("links", [])
+        if intent.get("html"):
+            lines = [intent["html"].replace("\n", "")]
+            lines.extend(f"{link['icon']} <strong>{link['title']}</strong>: {link['subtitle']}" for link in links)
+            return "<br>".join(lines)
+        lines = [intent.get("text", "")]
+        lines.extend(f"{link['icon']} {link['title']}: {link['subtitle']}" for link in links)
+        return "\n".join(lines)
+
+    def _insert(self, tokens: list[str], intent: str) -> None:
+        if not tokens:
+            return
+        node = self._trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[_END] = intent
+
+    def classify(self, text: str) -> IntentMatch | None:
+        tokens = _tokenize(text)
+        if not tokens:
+            return None
+
+        coverage: dict[str, int] = {}
+        position = 0
+        while position < len(tokens):
+            node = self._trie
+            matched_intent: str | None = None
+            matched_length = 0
+            for offset, token in enumerate(tokens[position:]):
+                node = node.get(token)
+                if node is None:
+                    break
+                if _END in node:
+                    matched_intent, matched_length = node[_END], offset + 1
+            if matched_intent is None:
+                position += 1
+                continue
+            coverage[matched_intent] = coverage.get(matched_intent, 0) + matched_length
+            position += matched_length
+
+        if not coverage:
+            return None
+        ranked = sorted(coverage.items(), key=lambda item: item[1], reverse=True)
+        best_intent, best_tokens = ranked[0]
+        confidence = best_tokens / len(tokens)
+        # A tie between two intents is ambiguous, leave it to the LLM.
+        if len(ranked) > 1 and ranked[1][1] == best_tokens:
+            confidence /= 2
+        return IntentMatch(intent=best_intent, confidence=confidence, reply=self._replies[best_intent])
+
+    def match(self, text: str) -> IntentMatch | None:
+        result = self.classify(text)
+        if result is None or result.confidence < self.min_confidence:
+            return None
+        logger.debug("Intent %s answered locally (confidence %.2f)", result.intent, result.confidence)
+        return result
+
+
+def _collapse(html: str) -> str:
+    return " ".join(html.split())
+
+
+def _frontend_templates(path: Path) -> dict[str, dict[str, Any]]:
+    templates = {}
+    for name, body in _TS_ENTRY.findall(path.read_text(encoding="utf-8")):
+        text, html = _TS_TEXT.search(body), _TS_HTML.search(body)
+        templates[name] = {
+            "text": text.group(1) if text else None,
+            "html": _collapse(html.group(1)) if html else None,
+            "links": _TS_LINK.findall(body),
+        }
+    return templates
+
+
+def template_differences(intents: list[dict[str, Any]], frontend: dict[str, dict[str, Any]]) -> list[str]:
+    # The widget renders menu answers from responses.ts, the intent router
+    # answers typed questions from intents.json; both must say the same.
+    differences = []
+    for intent in intents:
+        name = intent["intent"]
+        template = frontend.get(name)
+        if template is None:
+            continue
+        if intent.get("text") != template["text"]:
+            differences.append(f"{name}: text differs")
+        if intent.get("html") is not None and _collapse(intent["html"]) != template["html"]:
+            differences.append(f"{name}: html differs")
+        links = [
+            (link["icon"], link["title"], link["subtitle"], link.get("url", "")) for link in intent.get("links", [])
+        ]
+        if links != template["links"]:
+            differences.append(f"{name}: links differ")
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check intents.json against the frontend's responses.ts.")
+    parser.add_argument("--intents", type=Path, default=DEFAULT_INTENTS_PATH, help="intent templates to check")
+    parser.add_argument("--responses", type=Path, default=FRONTEND_RESPONSES_PATH, help="frontend responses.ts")
+    args = parser.parse_args()
+    with args.intents.open(encoding="utf-8") as handle:
+        differences = template_differences(json.load(handle)["intents"], _frontend_templates(args.responses))
+    for difference in differences:
+        print(difference)
+    if differences:
+        raise SystemExit(f"{len(differences)} intent template(s) out of sync with {args.responses}")
+    print(f"{args.intents} matches {args.responses}")
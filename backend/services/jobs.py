@@ -0,0 +1,360 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable
+
+from ..metrics import registry
+from ..settings import settings
+from ..tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_FINISHED = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+@dataclass
+class GenerationJob:
+    session_id: uuid.UUID
+    conversation: list[dict[str, str]]
+    # None for jobs queued before practice profiles, i.e. the default practice.
+    practice_id: str | None = None
+    id: uuid.UUID = field(default_factory=uuid.uuid4)
+    status: str = JOB_QUEUED
+    attempts: int = 0
+    available_at: float = 0.0
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    # W3C traceparent of the request that queued the job, if it was traced.
+    traceparent: str | None = None
+    finished_at: float | None = None
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["id"] = str(self.id)
+        data["session_id"] = str(self.session_id)
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "GenerationJob":
+        data = json.loads(raw)
+        data["id"] = uuid.UUID(data["id"])
+        data["session_id"] = uuid.UUID(data["session_id"])
+        return cls(**data)
+
+
+class JobQueue(ABC):
+    @abstractmethod
+    async def put(self, job: GenerationJob) -> None: ...
+
+    @abstractmethod
+    async def get(self) -> GenerationJob: ...
+
+    @abstractmethod
+    async def update(self, job: GenerationJob) -> None: ...
+
+    @abstractmethod
+    async def fetch(self, job_id: uuid.UUID) -> GenerationJob | None: ...
+
+    @abstractmethod
+    def depth(self) -> int: ...
+
+    # Finished jobs carry the whole conversation; they are kept only long enough
+    # for clients to poll the result.
+    async def purge_finished(self) -> int:
+        return 0
+
+    async def close(self) -> None:
+        return None
+
+
+class InMemoryJobQueue(JobQueue):
+    def __init__(self, max_size: int = 1000, retain_finished: int = 5000, retain_seconds: float = 3600.0) -> None:
+        self.max_size = max_size
+        self.retain_finished = retain_finished
+        self.retain_seconds = retain_seconds
+        self._ready: asyncio.Queue[uuid.UUID] = asyncio.Queue()
+        self._active: dict[uuid.UUID, GenerationJob] = {}
+        self._finished: OrderedDict[uuid.UUID, GenerationJob] = OrderedDict()
+
+    async def put(self, job: GenerationJob) -> None:
+        if job.id not in self._active and len(self._active) >= self.max_size:
+            raise QueueFullError("Generation queue is full.")
+        job.status = JOB_QUEUED
+        self._active[job.id] = job
+        delay = job.available_at - time.time()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, job.id)
+        else:
+            self._ready.put_nowait(job.id)
+
+    async def get(self) -> GenerationJob:
+        while True:
+            job = self._active.get(await self._ready.get())
+            if job is not None and job.status == JOB_QUEUED:
+                job.status = JOB_RUNNING
+                return job
+
+    async def update(self, job: GenerationJob) -> None:
+        if job.status not in JOB_FINISHED:
+            self._active[job.id] = job
+            return
+        self._active.pop(job.id, None)
+        self._finished[job.id] = job
+        while len(self._finished) > self.retain_finished:
+            self._finished.popitem(last=False)
+        await self.purge_finished()
+
+    async def fetch(self, job_id: uuid.UUID) -> GenerationJob | None:
+        return self._active.get(job_id) or self._finished.get(job_id)
+
+    def depth(self) -> int:
+        return len(self._active)
+
+    async def purge_finished(self) -> int:
+        # Kept in the order they finished.
+        cutoff = time.time() - self.retain_seconds
+        purged = 0
+        while self._finished:
+            job = next(iter(self._finished.values()))
+            if (job.finished_at or 0.0) > cutoff:
+                break
+            self._finished.popitem(last=False)
+            purged += 1
+        return purged
+
+
+# Durable local backend; worker processes on the same host can share the file.
+# A running job holds a lease: for running rows, available_at is the time the
+# lease runs out. A job whose worker died (crash, restart, OOM) is queued again
+# by the next get() after its lease has expired. For finished rows, available_at
+# is the time they finished; they are deleted retain_seconds later.
+class SQLiteJobQueue(JobQueue):
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 1000,
+        poll_interval: float = 0.2,
+        lease_seconds: float = 300.0,
+        retain_seconds: float = 3600.0,
+    ) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retain_seconds = retain_seconds
+        self._conn: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+        # Refreshed by every query that touches the queue; read by the metrics
+        # gauge, which must not block the event loop on the database.
+        self._depth = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Opened on first use, i.e. in the worker process: a connection created
+        # before a fork must not be used by the children.
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generation_jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, available_at REAL NOT NULL, payload TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_generation_jobs_ready ON generation_jobs (status, available_at)"
+            )
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, sql: str, params: tuple[Any, ...] = ()) -> list[tuple[Any, ...]]:
+        async with self._lock:
+            return await asyncio.to_thread(lambda: self.conn.execute(sql, params).fetchall())
+
+    async def _count_active(self) -> None:
+        rows = await self._run(
+            "SELECT count(*) FROM generation_jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+        )
+        self._depth = rows[0][0]
+
+    async def put(self, job: GenerationJob) -> None:
+        if job.attempts == 0:
+            (queued,) = (await self._run("SELECT count(*) FROM generation_jobs WHERE status = ?", (JOB_QUEUED,)))[0]
+            if queued >= self.max_size:
+                raise QueueFullError("Generation queue is full.")
+        job.status = JOB_QUEUED
+        await self._run(
+            "INSERT OR REPLACE INTO generation_jobs (id, status, available_at, payload) VALUES (?, ?, ?, ?)",
+            (str(job.id), job.status, job.available_at, job.to_json()),
+        )
+        await self._count_active()
+
+    async def get(self) -> GenerationJob:
+        while True:
+            now = time.time()
+            # The interrupted run counts as an attempt.
+            for (job_id,) in await self._run(
+                "UPDATE generation_jobs SET status = ?, "
+                "payload = json_set(payload, '$.attempts', json_extract(payload, '$.attempts') + 1) "
+                "WHERE status = ? AND available_at <= ? RETURNING id",
+                (JOB_QUEUED, JOB_RUNNING, now),
+            ):
+                logger.warning("Lease of generation job %s expired, queueing it again.", job_id)
+            rows = await self._run(
+                "UPDATE generation_jobs SET status = ?, available_at = ? WHERE id = ("
+                "SELECT id FROM generation_jobs WHERE status = ? AND available_at <= ? "
+                "ORDER BY available_at LIMIT 1) RETURNING payload",
+                (JOB_RUNNING, now + self.lease_seconds, JOB_QUEUED, now),
+            )
+            if rows:
+                job = GenerationJob.from_json(rows[0][0])
+                job.status = JOB_RUNNING
+                return job
+            await asyncio.sleep(self.poll_interval)
+
+    async def update(self, job: GenerationJob) -> None:
+        finished = job.status in JOB_FINISHED
+        await self._run(
+            "UPDATE generation_jobs SET status = ?, available_at = ?, payload = ? WHERE id = ?",
+            (job.status, job.finished_at if finished else job.available_at, job.to_json(), str(job.id)),
+        )
+        if finished:
+            await self.purge_finished()
+            await self._count_active()
+
+    async def fetch(self, job_id: uuid.UUID) -> GenerationJob | None:
+        rows = await self._run("SELECT payload FROM generation_jobs WHERE id = ?", (str(job_id),))
+        return GenerationJob.from_json(rows[0][0]) if rows else None
+
+    def depth(self) -> int:
+        return self._depth
+
+    async def purge_finished(self) -> int:
+        rows = await self._run(
+            "DELETE FROM generation_jobs WHERE status IN (?, ?) AND available_at <= ? RETURNING id",
+            (*JOB_FINISHED, time.time() - self.retain_seconds),
+        )
+        return len(rows)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+JobHandler = Callable[[GenerationJob], Awaitable[dict[str, Any]]]
+FailureHandler = Callable[[GenerationJob], Awaitable[None]]
+
+
+class GenerationWorkerPool:
+    def __init__(
+        self,
+        queue: JobQueue,
+        workers: int = 4,
+        max_attempts: int = 3,
+        retry_delay: float = 1.0,
+    ) -> None:
+        self.queue = queue
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._handler: JobHandler | None = None
+        self._on_failure: FailureHandler | None = None
+        self._tasks: list[asyncio.Task[None]] = []
+
+    async def start(self, handler: JobHandler, on_failure: FailureHandler | None = None) -> None:
+        self._handler = handler
+        self._on_failure = on_failure
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f"generation-worker-{index}") for index in range(self.workers)
+        ]
+        logger.info("Started %d generation worker(s).", self.workers)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.queue.close()
+
+    async def submit(
+        self, session_id: uuid.UUID, conversation: list[dict[str, str]], practice_id: str | None = None
+    ) -> GenerationJob:
+        job = GenerationJob(
+            session_id=session_id,
+            conversation=conversation,
+            practice_id=practice_id,
+            traceparent=tracer.traceparent(),
+        )
+        await self.queue.put(job)
+        return job
+
+    async def _work(self) -> None:
+        assert self._handler is not None
+        while True:
+            job = await self.queue.get()
+            job.attempts += 1
+            try:
+                job.result = await self._handler(job)
+            except asyncio.CancelledError:
+                # Shutting down: hand the job back without counting the attempt.
+                job.attempts -= 1
+                await self.queue.put(job)
+                raise
+            except Exception as exc:  # noqa: BLE001
+                if job.attempts < self.max_attempts:
+                    delay = self.retry_delay * 2 ** (job.attempts - 1)
+                    logger.warning(
+                        "Generation job %s failed (attempt %d), retrying in %.1fs: %s", job.id, job.attempts, delay, exc
+                    )
+                    job.available_at = time.time() + delay
+                    await self.queue.put(job)
+                    continue
+                logger.exception("Generation job %s failed permanently: %s", job.id, exc)
+                job.status = JOB_FAILED
+                job.error = "Antwort des Assistenten derzeit nicht verfügbar."
+                job.finished_at = time.time()
+                await self.queue.update(job)
+                if self._on_failure is not None:
+                    await self._on_failure(job)
+                continue
+            job.status = JOB_SUCCEEDED
+            job.finished_at = time.time()
+            await self.queue.update(job)
+
+
+def _create_queue() -> JobQueue:
+    if settings.generation_queue_backend == "sqlite":
+        return SQLiteJobQueue(
+            settings.generation_queue_path,
+            max_size=settings.generation_queue_size,
+            lease_seconds=settings.generation_job_lease_seconds,
+            retain_seconds=settings.generation_job_retain_seconds,
+        )
+    if settings.generation_queue_backend != "memory":
+        raise ValueError(f"Unknown GENERATION_QUEUE_BACKEND {settings.generation_queue_backend!r}")
+    return InMemoryJobQueue(
+        max_size=settings.generation_queue_size, retain_seconds=settings.generation_job_retain_seconds
+    )
+
+
+generation_pool = GenerationWorkerPool(
+    _create_queue(),
+    workers=settings.generation_workers,
+    max_attempts=settings.generation_max_attempts,
+    retry_delay=settings.generation_retry_delay_seconds,
+)
+
+registry.gauge("generation_queue_depth", "Generation jobs waiting for a worker.", callback=generation_pool.queue.depth)
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable
+
+from ..metrics import registry
+from ..tracing import tracer
+from .openai_governor import OpenAIGovernor, Priority
+from .tokenizer import token_counter
+
+logger = logging.getLogger(__name__)
+
+LLM_TOKENS = registry.counter("llm_tokens_total", "Tokens reported by the model providers.", ("provider", "kind"))
+
+_END = object()
+
+
+def _record_usage(provider: str, prompt_tokens: int, completion_tokens: int) -> None:
+    LLM_TOKENS.inc(prompt_tokens, provider=provider, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, provider=provider, kind="completion")
+    tracer.current().set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+@dataclass
+class Completion:
+    content: str
+    provider: str
+
+
+# Requests are provider-neutral: {"messages", "temperature", "max_tokens"}; each
+# provider adds its own model name. The timeout bounds the upstream's answer (for
+# streams: the first token), not the wait for a governor slot or budget.
+class LLMProvider(ABC):
+    name: str
+
+    @abstractmethod
+    async def complete(
+        self, request: dict[str, Any], priority: Priority, timeout: float | None = None
+    ) -> Completion: ...
+
+    @abstractmethod
+    def stream(
+        self, request: dict[str, Any], priority: Priority, timeout: float | None = None
+    ) -> AsyncIterator[str]: ...
+
+    async def embed(self, text: str) -> list[float]:
+        raise NotImplementedError(f"Provider {self.name} does not support embeddings.")
+
+    def warm_up(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+
+# OpenAI itself, the local fake client, and any server speaking the OpenAI chat
+# API (a second region, Azure, llama.cpp's llama-server, vLLM, ...).
+class OpenAICompatibleProvider(LLMProvider):
+    def __init__(
+        self,
+        name: str,
+        client_factory: Callable[[], Any],
+        model: str,
+        governor: OpenAIGovernor,
+        embedding_model: str | None = None,
+    ) -> None:
+        self.name = name
+        self.client_factory = client_factory
+        self._client: Any = None
+        self.model = model
+        self.governor = governor
+        self.embedding_model = embedding_model
+        self.counter = token_counter(model)
+
+    @property
+    def client(self) -> Any:
+        # Built on first use: importing and configuring the SDK is a good part of
+        # the start-up time, and a client must not be carried across a fork.
+        if self._client is None:
+            self._client = self.client_factory()
+        return self._client
+
+    def warm_up(self) -> None:
+        self.client
+
+    def _estimate_tokens(self, request: dict[str, Any]) -> int:
+        return self.counter.count_messages(request["messages"]) + request["max_tokens"]
+
+    def _settle(self, slot: Any, usage: Any) -> None:
+        if usage is None:
+            return
+        slot.settle(usage)
+        _record_usage(self.name, usage.prompt_tokens, usage.completion_tokens)
+
+    async def complete(self, request: dict[str, Any], priority: Priority, timeout: float | None = None) -> Completion:
+        async with self.governor.slot(priority, self._estimate_tokens(request)) as slot:
+            response = await slot.call(
+                lambda: self.client.chat.completions.create(model=self.model, **request), timeout
+            )
+            self._settle(slot, getattr(response, "usage", None))
+        content = response.choices[0].message.content
+        if not content:
+            raise ValueError("Assistant response was empty.")
+        return Completion(content, self.name)
+
+    async def stream(
+        self, request: dict[str, Any], priority: Priority, timeout: float | None = None
+    ) -> AsyncIterator[str]:
+        # The slot is held until the stream ends; only opening it is retried.
+        async with self.governor.slot(priority, self._estimate_tokens(request)) as slot:
+            stream = await slot.call(
+                lambda: self.client.chat.completions.create(
+                    model=self.model, **request, stream=True, stream_options={"include_usage": True}
+                ),
+                timeout,
+            )
+            # Disarmed at the first token: after that the consumer sets the pace.
+            async with asyncio.timeout(timeout) as first_token:
+                async for chunk in stream:
+                    self._settle(slot, getattr(chunk, "usage", None))
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        first_token.reschedule(None)
+                        yield delta
+
+    async def embed(self, text: str) -> list[float]:
+        if self.embedding_model is None:
+            return await super().embed(text)
+        response = await self.client.embeddings.create(model=self.embedding_model, input=text)
+        return list(response.data[0].embedding)
+
+    async def close(self) -> None:
+        close = getattr(self._client, "close", None)
+        if close is not None:
+            await close()
+
+
+# A GGUF model run in-process on the CPU through llama-cpp-python. Slow, but
+# independent of any network; meant as the fallback when upstream is down.
+class LocalLlamaProvider(LLMProvider):
+    def __init__(self, model_path: str, threads: int = 4, context_size: int = 4096, name: str = "local") -> None:
+        self.name = name
+        self.model_path = model_path
+        self.threads = threads
+        self.context_size = context_size
+        self._llama: Any = None
+        # A llama.cpp context is not thread-safe; generations run one at a time.
+        self._lock = asyncio.Lock()
+
+    def _load(self) -> Any:
+        if self._llama is None:
+            try:
+                from llama_cpp import Llama
+            except ImportError as exc:
+                raise RuntimeError("LOCAL_MODEL_PATH requires the llama-cpp-python package.") from exc
+            logger.info("Loading local model %s", self.model_path)
+            self._llama = Llama(
+                model_path=self.model_path, n_ctx=self.context_size, n_threads=self.threads, verbose=False
+            )
+        return self._llama
+
+    # warm_up() leaves the model unloaded: reading gigabytes of weights in every
+    # worker would cost more start-up time than all the rest together.
+
+    async def complete(self, request: dict[str, Any], priority: Priority, timeout: float | None = None) -> Completion:
+        async with self._lock:
+            llama = await asyncio.to_thread(self._load)
+            async with asyncio.timeout(timeout):
+                result = await asyncio.to_thread(llama.create_chat_completion, **request)
+        usage = result.get("usage")
+        if usage:
+            _record_usage(self.name, usage["prompt_tokens"], usage["completion_tokens"])
+        content = result["choices"][0]["message"].get("content")
+        if not content:
+            raise ValueError("Assistant response was empty.")
+        return Completion(content, self.name)
+
+    async def stream(
+        self, request: dict[str, Any], priority: Priority, timeout: float | None = None
+    ) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Any] = asyncio.Queue()
+        stop = threading.Event()
+
+        def produce(llama: Any) -> None:
+            try:
+                for chunk in llama.create_chat_completion(**request, stream=True):
+                    if stop.is_set():
+                        break
+                    delta = chunk["choices"][0]["delta"].get("content")
+                    if delta:
+                        loop.call_soon_threadsafe(queue.put_nowait, delta)
+                loop.call_soon_threadsafe(queue.put_nowait, _END)
+            except Exception as exc:  # noqa: BLE001
+                loop.call_soon_threadsafe(queue.put_nowait, exc)
+
+        async with self._lock:
+            llama = await asyncio.to_thread(self._load)
+            producer = loop.run_in_executor(None, produce, llama)
+            try:
+                async with asyncio.timeout(timeout) as first_token:
+                    while True:
+                        item = await queue.get()
+                        if item is _END:
+                            break
+                        if isinstance(item, Exception):
+                            raise item
+                        first_token.reschedule(None)
+                        yield item
+            finally:
+                # Stop after the next token and keep the lock until the thread is done.
+                stop.set()
+                with suppress(Exception):
+                    await asyncio.shield(producer)
@@ -0,0 +1,400 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable
+
+from ..metrics import registry
+from ..settings import settings
+from ..tracing import tracer
+from .fake_openai import FakeAsyncOpenAI
+from .llm_providers import Completion, LLMProvider, LocalLlamaProvider, OpenAICompatibleProvider
+from .openai_governor import OpenAIGovernor, Priority
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_REQUESTS = registry.counter(
+    "llm_provider_requests_total", "Model provider calls by outcome.", ("provider", "operation", "outcome")
+)
+PROVIDER_LATENCY = registry.histogram(
+    "llm_provider_latency_seconds",
+    "Provider latency: full completion, or time to first token for streams.",
+    ("provider", "operation"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0),
+)
+HEDGED_REQUESTS = registry.counter(
+    "llm_hedged_requests_total", "Requests that fired a hedge, by the side that answered.", ("operation", "winner")
+)
+FAILOVERS = registry.counter("llm_failovers_total", "Requests served by the fallback provider.", ("operation",))
+
+_END = object()
+
+
+class ProviderUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN:
+            # A single probe decides whether the provider is back.
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def record_cancelled(self) -> None:
+        # A cancelled probe (e.g. the losing side of a hedge) proves nothing.
+        self._probing = False
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 200, min_samples: int = 20) -> None:
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, rank: float) -> float | None:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[max(0, math.ceil(rank / 100 * len(ordered)) - 1)]
+
+
+class _StreamPump:
+    # Runs one provider stream inside its own task and hands deltas over through
+    # a queue, so the losing side of a hedge can be cancelled cleanly.
+    def __init__(self, router: "ProviderRouter", provider: LLMProvider, request: dict[str, Any], priority: Priority):
+        self.provider = provider
+        self.queue: asyncio.Queue[Any] = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._run(router, request, priority))
+
+    async def _run(self, router: "ProviderRouter", request: dict[str, Any], priority: Priority) -> None:
+        with tracer.span("llm.provider", provider=self.provider.name, operation="stream") as span:
+            breaker = router.breakers[self.provider.name]
+            started = time.monotonic()
+            received = False
+            try:
+                iterator = self.provider.stream(request, priority, router.timeout).__aiter__()
+                first = await iterator.__anext__()
+                received = True
+                router._observe(self.provider, "stream", time.monotonic() - started)
+                span.set(first_token_ms=round((time.monotonic() - started) * 1000, 1))
+                await self.queue.put(first)
+                async for delta in iterator:
+                    await self.queue.put(delta)
+            except asyncio.CancelledError:
+                breaker.record_cancelled()
+                PROVIDER_REQUESTS.inc(provider=self.provider.name, operation="stream", outcome="cancelled")
+                raise
+            except Exception as exc:  # noqa: BLE001
+                if isinstance(exc, StopAsyncIteration) and not received:
+                    exc = ValueError("Assistant response was empty.")
+                elif isinstance(exc, TimeoutError):
+                    exc = ProviderUnavailable(f"Provider {self.provider.name} sent no token within {router.timeout}s.")
+                breaker.record_failure()
+                PROVIDER_REQUESTS.inc(provider=self.provider.name, operation="stream", outcome="error")
+                # Handed to the consumer instead of raised, so the span is ended as failed here.
+                tracer.end(span, exc)
+                await self.queue.put(exc)
+                return
+            breaker.record_success()
+            PROVIDER_REQUESTS.inc(provider=self.provider.name, operation="stream", outcome="success")
+            await self.queue.put(_END)
+
+
+class ProviderRouter:
+    def __init__(
+        self,
+        primary: LLMProvider,
+        hedge: LLMProvider | None = None,
+        fallback: LLMProvider | None = None,
+        *,
+        hedge_enabled: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 1.0,
+        timeout: float = 30.0,
+        breaker_failures: int = 5,
+        breaker_cooldown: float = 30.0,
+    ) -> None:
+        self.primary = primary
+        # Without a second upstream the hedge is a re-issue against the primary.
+        self.hedge = hedge or primary
+        self.fallback = fallback
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.timeout = timeout
+        self.breakers = {
+            provider.name: CircuitBreaker(breaker_failures, breaker_cooldown) for provider in self.providers
+        }
+        self._latency = {"complete": LatencyTracker(), "stream": LatencyTracker()}
+
+    @property
+    def providers(self) -> list[LLMProvider]:
+        providers: list[LLMProvider] = []
+        for provider in (self.primary, self.hedge, self.fallback):
+            if provider is not None and provider not in providers:
+                providers.append(provider)
+        return providers
+
+    def hedge_delay(self, operation: str) -> float:
+        observed = self._latency[operation].percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, observed or 0.0)
+
+    def _observe(self, provider: LLMProvider, operation: str, seconds: float) -> None:
+        PROVIDER_LATENCY.observe(seconds, provider=provider.name, operation=operation)
+        if provider is self.primary:
+            self._latency[operation].observe(seconds)
+
+    async def _call(self, provider: LLMProvider, request: dict[str, Any], priority: Priority) -> Completion:
+        with tracer.span("llm.provider", provider=provider.name, operation="complete"):
+            breaker = self.breakers[provider.name]
+            started = time.monotonic()
+            try:
+                completion = await provider.complete(request, priority, self.timeout)
+            except asyncio.CancelledError:
+                breaker.record_cancelled()
+                PROVIDER_REQUESTS.inc(provider=provider.name, operation="complete", outcome="cancelled")
+                raise
+            except TimeoutError as exc:
+                breaker.record_failure()
+                PROVIDER_REQUESTS.inc(provider=provider.name, operation="complete", outcome="error")
+                raise ProviderUnavailable(f"Provider {provider.name} did not answer within {self.timeout}s.") from exc
+            except Exception:
+                breaker.record_failure()
+                PROVIDER_REQUESTS.inc(provider=provider.name, operation="complete", outcome="error")
+                raise
+            breaker.record_success()
+            PROVIDER_REQUESTS.inc(provider=provider.name, operation="complete", outcome="success")
+            self._observe(provider, "complete", time.monotonic() - started)
+            return completion
+
+    async def complete(self, request: dict[str, Any], priority: Priority) -> Completion:
+        if self.breakers[self.primary.name].allow():
+            try:
+                return await self._hedged_complete(request, priority)
+            except Exception as exc:
+                if self.fallback is None:
+                    raise
+                logger.warning("Provider %s failed, answering from %s: %s", self.primary.name, self.fallback.name, exc)
+        elif self.fallback is None:
+            raise ProviderUnavailable(f"Provider {self.primary.name} is unavailable (circuit open).")
+        FAILOVERS.inc(operation="complete")
+        return await self._call(self.fallback, request, priority)
+
+    async def _hedged_complete(self, request: dict[str, Any], priority: Priority) -> Completion:
+        if not self.hedge_enabled:
+            return await self._call(self.primary, request, priority)
+        tasks = [asyncio.ensure_future(self._call(self.primary, request, priority))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay("complete"))
+            if not done and self.breakers[self.hedge.name].allow():
+                tasks.append(asyncio.ensure_future(self._call(self.hedge, request, priority)))
+            pending = set(tasks)
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            HEDGED_REQUESTS.inc(operation="complete", winner="primary" if task is tasks[0] else "hedge")
+                        return task.result()
+                    error = error or task.exception()
+            if len(tasks) > 1:
+                HEDGED_REQUESTS.inc(operation="complete", winner="none")
+            assert error is not None
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream(self, request: dict[str, Any], priority: Priority) -> AsyncIterator[str]:
+        pumps: list[_StreamPump] = []
+        try:
+            winner: _StreamPump | None = None
+            first = ""
+            if self.breakers[self.primary.name].allow():
+                try:
+                    winner, first = await self._first_delta(pumps, request, priority)
+                except Exception as exc:
+                    # Failing over is only possible before anything reached the client.
+                    if self.fallback is None:
+                        raise
+                    logger.warning(
+                        "Provider %s failed, streaming from %s: %s", self.primary.name, self.fallback.name, exc
+                    )
+            elif self.fallback is None:
+                raise ProviderUnavailable(f"Provider {self.primary.name} is unavailable (circuit open).")
+            if winner is None:
+                assert self.fallback is not None
+                FAILOVERS.inc(operation="stream")
+                pumps.append(_StreamPump(self, self.fallback, request, priority))
+                first = await self._next(pumps[-1])
+                winner = pumps[-1]
+
+            yield first
+            while (delta := await self._next(winner)) is not _END:
+                yield delta
+        finally:
+            for pump in pumps:
+                pump.task.cancel()
+
+    @staticmethod
+    async def _next(pump: _StreamPump) -> Any:
+        item = await pump.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def _first_delta(
+        self, pumps: list[_StreamPump], request: dict[str, Any], priority: Priority
+    ) -> tuple[_StreamPump, str]:
+        # Hedging on time to first token: whichever stream starts first is kept.
+        pumps.append(_StreamPump(self, self.primary, request, priority))
+        waiting = {asyncio.ensure_future(pumps[0].queue.get()): pumps[0]}
+        hedged = False
+        error: BaseException | None = None
+        try:
+            if self.hedge_enabled:
+                done, _ = await asyncio.wait(waiting, timeout=self.hedge_delay("stream"))
+                if not done and self.breakers[self.hedge.name].allow():
+                    hedged = True
+                    pumps.append(_StreamPump(self, self.hedge, request, priority))
+                    waiting[asyncio.ensure_future(pumps[1].queue.get())] = pumps[1]
+            while waiting:
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                for getter in done:
+                    pump = waiting.pop(getter)
+                    item = getter.result()
+                    if isinstance(item, Exception):
+                        error = error or item
+                        continue
+                    for other in pumps:
+                        if other is not pump:
+                            other.task.cancel()
+                    if hedged:
+                        HEDGED_REQUESTS.inc(operation="stream", winner="primary" if pump is pumps[0] else "hedge")
+                    return pump, item
+            if hedged:
+                HEDGED_REQUESTS.inc(operation="stream", winner="none")
+            assert error is not None
+            raise error
+        finally:
+            for getter in waiting:
+                getter.cancel()
+
+    def warm_up(self) -> None:
+        for provider in self.providers:
+            provider.warm_up()
+
+    async def close(self) -> None:
+        for provider in self.providers:
+            await provider.close()
+
+
+def _governor(max_concurrency: int, tokens_per_minute: int) -> OpenAIGovernor:
+    return OpenAIGovernor(
+        max_concurrency=max_concurrency,
+        tokens_per_minute=tokens_per_minute,
+        max_retries=settings.openai_max_retries,
+        backoff_base=settings.openai_backoff_base_seconds,
+        backoff_max=settings.openai_backoff_max_seconds,
+    )
+
+
+def _openai_client(api_key: str, base_url: str | None) -> Callable[[], Any]:
+    def build() -> Any:
+        from openai import AsyncOpenAI
+
+        # Retries are left to the governor, which also honours Retry-After across requests.
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+    return build
+
+
+def _create_primary() -> LLMProvider:
+    governor = _governor(settings.openai_max_concurrency, settings.openai_tokens_per_minute)
+    if settings.openai_fake:
+        logger.warning("OPENAI_FAKE is enabled, using the local fake OpenAI client.")
+        return OpenAICompatibleProvider(
+            "fake", FakeAsyncOpenAI, settings.openai_model, governor, settings.embedding_model
+        )
+    return OpenAICompatibleProvider(
+        "openai",
+        _openai_client(settings.openai_api_key, settings.openai_base_url),
+        settings.openai_model,
+        governor,
+        settings.embedding_model,
+    )
+
+
+def _create_secondary() -> LLMProvider | None:
+    if not settings.llm_secondary_base_url:
+        return None
+    return OpenAICompatibleProvider(
+        "secondary",
+        _openai_client(settings.llm_secondary_api_key or settings.openai_api_key, settings.llm_secondary_base_url),
+        settings.llm_secondary_model or settings.openai_model,
+        _governor(settings.openai_max_concurrency, settings.openai_tokens_per_minute),
+    )
+
+
+def _create_local() -> LLMProvider | None:
+    if settings.local_model_path:
+        return LocalLlamaProvider(
+            settings.local_model_path, threads=settings.local_model_threads, context_size=settings.local_model_context
+        )
+    if settings.local_model_url:
+        # e.g. llama.cpp's llama-server; the API key is not checked.
+        return OpenAICompatibleProvider(
+            "local",
+            _openai_client("local", settings.local_model_url),
+            settings.local_model_name,
+            _governor(settings.local_model_concurrency, 0),
+        )
+    return None
+
+
+def create_router() -> ProviderRouter:
+    return ProviderRouter(
+        _create_primary(),
+        hedge=_create_secondary(),
+        fallback=_create_local(),
+        hedge_enabled=settings.llm_hedge_enabled,
+        hedge_percentile=settings.llm_hedge_percentile,
+        hedge_min_delay=settings.llm_hedge_min_delay_seconds,
+        timeout=settings.llm_timeout_seconds,
+        breaker_failures=settings.llm_breaker_failures,
+        breaker_cooldown=settings.llm_breaker_cooldown_seconds,
+    )
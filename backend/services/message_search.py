@@ -0,0 +1,147 @@
+import html
+import re
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import Select, column, func, literal_column, select, table
+
+from ..metrics import registry, timed
+from ..models.database import ChatSession, Message, get_autocommit_engine
+from .message_store import _before, _in_practice, encode_cursor
+
+# Has to match the expression of ix_messages_content_fts (migration 0006); as a
+# literal, not a bound parameter, so the planner can use the index.
+TEXT_SEARCH_CONFIG = literal_column("'german'::regconfig")
+MAX_TERMS = 8
+SNIPPET_WORDS = 12
+
+# Hits are marked with private-use characters first; the snippet is escaped
+# and only then are they turned into <mark> tags.
+_MARK_START, _MARK_END = "\ue000", "\ue001"
+_HEADLINE_OPTIONS = (
+    f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords={SNIPPET_WORDS * 2}, MinWords={SNIPPET_WORDS}, "
+    'MaxFragments=2, FragmentDelimiter=" … "'
+)
+_TERM = re.compile(r"[^\W_]+")
+
+_fts = table("messages_fts", column("content"), column("message_id"))
+
+SEARCH_LATENCY = registry.histogram(
+    "message_search_duration_seconds", "Time to answer a full-text search over messages."
+)
+
+
+def search_terms(query: str) -> list[str]:
+    # Only word characters reach the database, so neither tsquery nor FTS5
+    # syntax in the input can break the query. Every term is a prefix match.
+    return _TERM.findall(query.lower())[:MAX_TERMS]
+
+
+def _highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+@dataclass
+class SearchPage:
+    rows: list[Any]
+    has_more: bool
+
+    @property
+    def next_cursor(self) -> str | None:
+        if not self.has_more or not self.rows:
+            return None
+        return encode_cursor(self.rows[-1].timestamp, self.rows[-1].id)
+
+    def hits(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "message_id": str(row.id),
+                "session_id": str(row.session_id),
+                "role": row.role,
+                "timestamp": row.timestamp.isoformat(),
+                "snippet": _highlight(row.snippet),
+            }
+            for row in self.rows
+        ]
+
+
+class MessageSearch:
+    @timed(SEARCH_LATENCY)
+    async def search(
+        self,
+        query: str,
+        practice_id: str,
+        limit: int,
+        before: tuple[datetime, uuid.UUID] | None = None,
+        session_id: uuid.UUID | None = None,
+    ) -> SearchPage:
+        terms = search_terms(query)
+        if not terms:
+            raise ValueError("The search query contains no words.")
+        # Newest hits first, paginated on (timestamp, id) like the history; one
+        # extra row tells whether more exist.
+        engine = get_autocommit_engine()
+        if engine.dialect.name == "postgresql":
+            statement = self._postgresql(terms, practice_id, limit + 1, before, session_id)
+        elif engine.dialect.name == "sqlite":
+            statement = self._sqlite(terms, practice_id, limit + 1, before, session_id)
+        else:
+            raise RuntimeError(f"Message search is not available on {engine.dialect.name}.")
+        async with engine.connect() as conn:
+            rows = list((await conn.execute(statement)).all())
+        return SearchPage(rows=rows[:limit], has_more=len(rows) > limit)
+
+    @staticmethod
+    def _filtered(statement: Select[Any], practice_id: str, before: Any, session_id: Any) -> Select[Any]:
+        statement = statement.join(ChatSession, ChatSession.id == Message.session_id).where(
+            _in_practice(practice_id)
+        )
+        if session_id is not None:
+            statement = statement.where(Message.session_id == session_id)
+        if before is not None:
+            statement = statement.where(_before(before))
+        return statement.order_by(Message.timestamp.desc(), Message.id.desc())
+
+    def _postgresql(
+        self, terms: list[str], practice_id: str, limit: int, before: Any, session_id: Any
+    ) -> Select[Any]:
+        tsquery = func.to_tsquery(TEXT_SEARCH_CONFIG, " & ".join(f"{term}:*" for term in terms))
+        matches = self._filtered(
+            select(Message.id, Message.session_id, Message.role, Message.content, Message.timestamp).where(
+                func.to_tsvector(TEXT_SEARCH_CONFIG, Message.content).op("@@")(tsquery)
+            ),
+            practice_id,
+            before,
+            session_id,
+        ).limit(limit).subquery()
+        # ts_headline re-parses the whole message, so it only runs on the page.
+        return select(
+            matches.c.id,
+            matches.c.session_id,
+            matches.c.role,
+            matches.c.timestamp,
+            func.ts_headline(TEXT_SEARCH_CONFIG, matches.c.content, tsquery, _HEADLINE_OPTIONS).label("snippet"),
+        ).order_by(matches.c.timestamp.desc(), matches.c.id.desc())
+
+    def _sqlite(self, terms: list[str], practice_id: str, limit: int, before: Any, session_id: Any) -> Select[Any]:
+        fts_table = literal_column("messages_fts")
+        return self._filtered(
+            select(
+                Message.id,
+                Message.session_id,
+                Message.role,
+                Message.timestamp,
+                func.snippet(fts_table, 0, _MARK_START, _MARK_END, "…", SNIPPET_WORDS).label("snippet"),
+            )
+            .select_from(_fts)
+            .join(Message, Message.id == _fts.c.message_id)
+            .where(fts_table.op("MATCH")(" ".join(f'"{term}"*' for term in terms))),
+            practice_id,
+            before,
+            session_id,
+        ).limit(limit)
+
+
+message_search = MessageSearch()
@@ -0,0 +1,357 @@
+import base64
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator
+
+from sqlalchemy import ColumnElement, and_, exists, func, insert, or_, select, update
+
+from ..metrics import registry
+from ..models.database import ChatSession, Message, get_autocommit_engine, get_engine
+from ..settings import settings
+from ..tracing import traced, tracer
+from .context_window import CONTEXT_HEADROOM_MESSAGES
+from .conversation_cache import ConversationHistory, ConversationWindowCache, Turn
+from .message_writer import Durability, GroupCommitWriter, Rows
+
+logger = logging.getLogger(__name__)
+
+
+def _as_utc(value: datetime | None) -> datetime | None:
+    # SQLite hands timestamps back without tzinfo; they are always stored as UTC.
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+HISTORY_COLUMNS = (Message.id, Message.session_id, Message.role, Message.content, Message.timestamp)
+
+
+def encode_cursor(timestamp: datetime, message_id: uuid.UUID) -> str:
+    raw = f"{_as_utc(timestamp).isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        timestamp, message_id = raw.split("|", 1)
+        return _as_utc(datetime.fromisoformat(timestamp)), uuid.UUID(message_id)
+    except ValueError as exc:
+        raise ValueError("Invalid history cursor.") from exc
+
+
+def _before(cursor: tuple[datetime, uuid.UUID]) -> ColumnElement[bool]:
+    timestamp, message_id = cursor
+    return or_(Message.timestamp < timestamp, and_(Message.timestamp == timestamp, Message.id < message_id))
+
+
+def _after(cursor: tuple[datetime, uuid.UUID]) -> ColumnElement[bool]:
+    timestamp, message_id = cursor
+    return or_(Message.timestamp > timestamp, and_(Message.timestamp == timestamp, Message.id > message_id))
+
+
+def _in_practice(practice_id: str) -> ColumnElement[bool]:
+    # Sessions without a practice predate practice profiles and belong to the default one.
+    return func.coalesce(ChatSession.practice_id, settings.default_practice) == practice_id
+
+
+async def _insert_messages(rows: Rows) -> None:
+    # One multi-row INSERT, committed on its own (or for several turns at once by the writer).
+    async with get_autocommit_engine().connect() as conn:
+        await conn.execute(insert(Message).values(rows))
+
+
+@dataclass
+class HistoryPage:
+    rows: list[Any]
+    has_more: bool
+
+    @property
+    def before_cursor(self) -> str | None:
+        return encode_cursor(self.rows[0].timestamp, self.rows[0].id) if self.rows else None
+
+    @property
+    def after_cursor(self) -> str | None:
+        return encode_cursor(self.rows[-1].timestamp, self.rows[-1].id) if self.rows else None
+
+
+class MessageStore:
+    def __init__(
+        self, window_cache: ConversationWindowCache | None = None, writer: GroupCommitWriter | None = None
+    ) -> None:
+        self.window_cache = window_cache
+        self.writer = writer
+
+    @staticmethod
+    def new_message(
+        session_id: uuid.UUID, role: str, content: str, message_id: uuid.UUID | None = None
+    ) -> Message:
+        return Message(
+            id=message_id or uuid.uuid4(),
+            session_id=session_id,
+            role=role,
+            content=content,
+            timestamp=datetime.now(timezone.utc),
+        )
+
+    @traced("history.load")
+    async def load_conversation(self, session_id: uuid.UUID, limit: int) -> ConversationHistory | None:
+        fetch_limit = limit
+        if self.window_cache is not None:
+            cached = self.window_cache.get(session_id, limit)
+            if cached is not None:
+                tracer.current().set(cache="hit", rows=len(cached.turns))
+                return cached
+            fetch_limit = max(limit, self.window_cache.window)
+        await self._settle(session_id)
+
+        # The outer join validates the session and loads its summary and the
+        # latest messages not yet folded into it in one statement; a session
+        # without such messages yields a single row with NULL message columns.
+        statement = (
+            select(
+                ChatSession.id,
+                ChatSession.practice_id,
+                ChatSession.summary,
+                ChatSession.summary_until,
+                Message.role,
+                Message.content,
+                Message.timestamp,
+            )
+            .outerjoin(
+                Message,
+                and_(
+                    Message.session_id == ChatSession.id,
+                    or_(ChatSession.summary_until.is_(None), Message.timestamp > ChatSession.summary_until),
+                ),
+            )
+            .where(ChatSession.id == session_id)
+            .order_by(Message.timestamp.desc())
+            .limit(fetch_limit)
+        )
+        async with get_autocommit_engine().connect() as conn:
+            rows = (await conn.execute(statement)).all()
+        tracer.current().set(cache="miss" if self.window_cache is not None else "off", rows=len(rows))
+        if not rows:
+            return None
+        history = ConversationHistory(
+            turns=[
+                Turn(row.role, row.content, _as_utc(row.timestamp)) for row in reversed(rows) if row.role is not None
+            ],
+            summary=rows[0].summary,
+            summarized_until=_as_utc(rows[0].summary_until),
+            practice_id=rows[0].practice_id,
+        )
+        if self.window_cache is not None:
+            self.window_cache.fill(session_id, history)
+        history.turns = history.turns[-limit:]
+        return history
+
+    async def load_unsummarized(
+        self, session_id: uuid.UUID, until: datetime, limit: int
+    ) -> ConversationHistory | None:
+        # Oldest first: the messages after the stored watermark, up to `until`,
+        # together with the summary they are to be folded into.
+        await self._settle(session_id)
+        statement = (
+            select(ChatSession.summary, ChatSession.summary_until, Message.role, Message.content, Message.timestamp)
+            .outerjoin(
+                Message,
+                and_(
+                    Message.session_id == ChatSession.id,
+                    or_(ChatSession.summary_until.is_(None), Message.timestamp > ChatSession.summary_until),
+                    Message.timestamp <= until,
+                ),
+            )
+            .where(ChatSession.id == session_id)
+            .order_by(Message.timestamp)
+            .limit(limit)
+        )
+        async with get_autocommit_engine().connect() as conn:
+            rows = (await conn.execute(statement)).all()
+        if not rows:
+            return None
+        return ConversationHistory(
+            turns=[Turn(row.role, row.content, _as_utc(row.timestamp)) for row in rows if row.role is not None],
+            summary=rows[0].summary,
+            summarized_until=_as_utc(rows[0].summary_until),
+        )
+
+    async def session_exists(self, session_id: uuid.UUID, practice_id: str) -> bool:
+        statement = select(exists().where(ChatSession.id == session_id, _in_practice(practice_id)))
+        async with get_autocommit_engine().connect() as conn:
+            return bool(await conn.scalar(statement))
+
+    async def message_cursor(
+        self, session_id: uuid.UUID, message_id: uuid.UUID
+    ) -> tuple[datetime, uuid.UUID] | None:
+        await self._settle(session_id)
+        statement = select(Message.timestamp).where(Message.id == message_id, Message.session_id == session_id)
+        async with get_autocommit_engine().connect() as conn:
+            timestamp = await conn.scalar(statement)
+        return (_as_utc(timestamp), message_id) if timestamp is not None else None
+
+    async def load_page(
+        self,
+        session_id: uuid.UUID,
+        practice_id: str,
+        limit: int,
+        before: tuple[datetime, uuid.UUID] | None = None,
+        after: tuple[datetime, uuid.UUID] | None = None,
+    ) -> HistoryPage | None:
+        await self._settle(session_id)
+        # Keyset pagination on (timestamp, id): without a cursor or with
+        # `before` the newest matching rows are read backwards, with `after`
+        # the rows following the cursor. One extra row tells whether more exist.
+        statement = (
+            select(*HISTORY_COLUMNS)
+            .join(ChatSession, ChatSession.id == Message.session_id)
+            .where(Message.session_id == session_id, _in_practice(practice_id))
+        )
+        if after is not None:
+            statement = statement.where(_after(after)).order_by(Message.timestamp.asc(), Message.id.asc())
+        else:
+            if before is not None:
+                statement = statement.where(_before(before))
+            statement = statement.order_by(Message.timestamp.desc(), Message.id.desc())
+        async with get_autocommit_engine().connect() as conn:
+            rows = list((await conn.execute(statement.limit(limit + 1))).all())
+        # Only an empty page needs the extra lookup to tell "no messages" from "no session".
+        if not rows and not await self.session_exists(session_id, practice_id):
+            return None
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if after is None:
+            rows.reverse()
+        return HistoryPage(rows=rows, has_more=has_more)
+
+    async def stream_history(
+        self, session_id: uuid.UUID, after: tuple[datetime, uuid.UUID] | None = None, batch_size: int = 500
+    ) -> AsyncIterator[Any]:
+        # Rows come from a server-side cursor in batches of `batch_size`, so memory
+        # stays flat no matter how long the session is. The pooled connection is
+        # held until the client has read the whole export.
+        await self._settle(session_id)
+        statement = select(*HISTORY_COLUMNS).where(Message.session_id == session_id)
+        if after is not None:
+            statement = statement.where(_after(after))
+        statement = statement.order_by(Message.timestamp.asc(), Message.id.asc()).execution_options(
+            yield_per=batch_size
+        )
+        async with get_engine().connect() as conn:
+            result = await conn.stream(statement)
+            async for row in result:
+                yield row
+
+    async def _settle(self, session_id: uuid.UUID) -> None:
+        # Reads see the session's own writes even while they sit in the write-behind buffer.
+        if self.writer is not None and self.writer.pending_for(session_id):
+            await self.writer.flush()
+
+    @traced("messages.save")
+    async def save(self, *messages: Message, durability: Durability = Durability.SYNC) -> None:
+        if not messages:
+            return
+        tracer.current().set(rows=len(messages), durability=durability.value)
+        rows = [
+            {
+                "id": message.id,
+                "session_id": message.session_id,
+                "role": message.role,
+                "content": message.content,
+                "timestamp": message.timestamp,
+            }
+            for message in messages
+        ]
+        if self.writer is None or durability is Durability.SYNC:
+            await _insert_messages(rows)
+        else:
+            await self.writer.write(rows, durability)
+        logger.debug("Persisted %d message(s) for session %s", len(rows), messages[0].session_id)
+
+        if self.window_cache is not None:
+            for message in messages:
+                self.window_cache.append(
+                    message.session_id, Turn(message.role, message.content, message.timestamp)
+                )
+
+    async def start(self) -> None:
+        if self.writer is not None:
+            await self.writer.start()
+
+    async def drain(self) -> None:
+        if self.writer is not None:
+            await self.writer.drain()
+
+    async def save_summary(self, session_id: uuid.UUID, summary: str, summarized_until: datetime) -> None:
+        # The watermark guard keeps a slower, older summary from overwriting a newer one.
+        statement = (
+            update(ChatSession)
+            .where(ChatSession.id == session_id)
+            .where(or_(ChatSession.summary_until.is_(None), ChatSession.summary_until < summarized_until))
+            .values(summary=summary, summary_until=summarized_until)
+        )
+        async with get_autocommit_engine().connect() as conn:
+            await conn.execute(statement)
+        if self.window_cache is not None:
+            self.window_cache.set_summary(session_id, summary, summarized_until)
+
+
+def _create_window_cache() -> ConversationWindowCache | None:
+    if not settings.conversation_cache_enabled:
+        return None
+    if settings.web_concurrency > 1:
+        # Only the worker that saved a turn writes it through; on any other
+        # worker a cached window would miss it (and a newer summary) until the
+        # entry idles out. Without sticky sessions every worker reads the database.
+        logger.info("WEB_CONCURRENCY=%d, conversation window cache disabled.", settings.web_concurrency)
+        return None
+    if settings.broadcast_backend == "redis":
+        # The same holds across replicas; a shared broadcast backend is the sign of running several.
+        logger.info("BROADCAST_BACKEND=redis, conversation window cache disabled.")
+        return None
+    return ConversationWindowCache(
+        # The cache has to hold the whole fetch window of the context builder.
+        window=max(
+            settings.conversation_cache_window, settings.context_max_messages + CONTEXT_HEADROOM_MESSAGES
+        ),
+        max_sessions=settings.conversation_cache_max_sessions,
+        idle_seconds=settings.conversation_cache_idle_seconds,
+    )
+
+
+def _create_writer() -> GroupCommitWriter | None:
+    modes = {settings.message_durability, *settings.message_durability_endpoints.values()}
+    if modes == {Durability.SYNC.value}:
+        return None
+    return GroupCommitWriter(
+        _insert_messages,
+        max_batch=settings.message_flush_batch_size,
+        max_delay=settings.message_flush_interval_seconds,
+        max_buffered=settings.message_buffer_max,
+    )
+
+
+message_store = MessageStore(_create_window_cache(), _create_writer())
+
+if message_store.writer is not None:
+    registry.gauge(
+        "message_write_buffer_rows",
+        "Messages waiting for the next group commit.",
+        callback=lambda: message_store.writer.pending_rows,
+    )
+
+if message_store.window_cache is not None:
+    registry.counter(
+        "conversation_cache_events_total",
+        "Conversation window cache events.",
+        ("event",),
+        callback=lambda: {(event,): count for event, count in message_store.window_cache.stats.items()},
+    )
+    registry.gauge(
+        "conversation_cache_sessions",
+        "Sessions held in the window cache.",
+        callback=lambda: len(message_store.window_cache),
+    )
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import uuid
+from collections import Counter, deque
+from contextlib import suppress
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Awaitable, Callable
+
+from ..metrics import registry
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+
+Rows = list[dict[str, Any]]
+
+
+class Durability(str, Enum):
+    # sync: the turn commits on its own before the response (the default).
+    # group: the turn waits for a commit it shares with other turns.
+    # buffered: the turn returns at once; a crash loses what is still buffered
+    # (up to max_buffered messages while the database lags behind).
+    SYNC = "sync"
+    GROUP = "group"
+    BUFFERED = "buffered"
+
+
+GROUP_COMMIT_ROWS = registry.histogram(
+    "message_group_commit_rows",
+    "Messages written per group commit.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+WRITE_FAILURES = registry.counter(
+    "message_write_failures_total", "Failed group commits by what happened to the messages.", ("outcome",)
+)
+
+
+def durability_for(endpoint: str) -> Durability:
+    return Durability(settings.message_durability_endpoints.get(endpoint, settings.message_durability))
+
+
+@dataclass
+class _Entry:
+    rows: Rows
+    # Set for callers that wait for the commit; buffered writes have none.
+    done: asyncio.Future[None] | None
+
+
+class GroupCommitWriter:
+    def __init__(
+        self,
+        insert: Callable[[Rows], Awaitable[None]],
+        max_batch: int = 100,
+        max_delay: float = 0.01,
+        max_buffered: int = 5000,
+        retry_delay: float = 0.5,
+    ) -> None:
+        self.insert = insert
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_buffered = max_buffered
+        self.retry_delay = retry_delay
+        self._entries: deque[_Entry] = deque()
+        self._rows = 0
+        self._sessions: Counter[uuid.UUID] = Counter()
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def pending_rows(self) -> int:
+        return self._rows
+
+    def pending_for(self, session_id: uuid.UUID) -> bool:
+        return self._sessions[session_id] > 0
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="message-group-commit")
+
+    async def write(self, rows: Rows, durability: Durability) -> None:
+        if self._task is None or self._task.done():
+            # Not started (CLI tools) or already drained: write directly.
+            await self.insert(rows)
+            return
+        # A full buffer turns buffered writes into waiting ones: memory stays
+        # bounded and callers feel the back-pressure of a slow database.
+        wait = durability is Durability.GROUP or self._rows >= self.max_buffered
+        entry = _Entry(rows, asyncio.get_running_loop().create_future() if wait else None)
+        self._enqueue(entry)
+        if entry.done is not None:
+            # A caller that goes away does not take its messages with it.
+            await asyncio.shield(entry.done)
+
+    async def flush(self) -> None:
+        # Everything queued before this call is committed when it returns.
+        if not self._entries or self._task is None or self._task.done():
+            return
+        entry = _Entry([], asyncio.get_running_loop().create_future())
+        self._enqueue(entry)
+        self._full.set()
+        await asyncio.shield(entry.done)
+
+    async def drain(self) -> None:
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        if self._entries:
+            logger.error("Shutting down with %d message(s) not written.", self._rows)
+
+    def _enqueue(self, entry: _Entry, front: bool = False) -> None:
+        if front:
+            self._entries.appendleft(entry)
+        else:
+            self._entries.append(entry)
+        self._rows += len(entry.rows)
+        self._sessions.update(row["session_id"] for row in entry.rows)
+        self._ready.set()
+        if self._rows >= self.max_batch:
+            self._full.set()
+
+    def _take(self) -> list[_Entry]:
+        batch: list[_Entry] = []
+        rows = 0
+        while self._entries and (not batch or rows + len(self._entries[0].rows) <= self.max_batch):
+            entry = self._entries.popleft()
+            batch.append(entry)
+            rows += len(entry.rows)
+        self._rows -= rows
+        self._sessions.subtract(row["session_id"] for entry in batch for row in entry.rows)
+        self._sessions += Counter()
+        if not self._entries:
+            self._ready.clear()
+        if self._rows < self.max_batch:
+            self._full.clear()
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            await self._ready.wait()
+            # The first message of a batch waits at most max_delay for company.
+            if not self._full.is_set():
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+            await self._commit(self._take())
+
+    async def _commit(self, batch: list[_Entry]) -> None:
+        rows = [row for entry in batch for row in entry.rows]
+        try:
+            if rows:
+                await self.insert(rows)
+        except Exception as exc:  # noqa: BLE001
+            await self._recover(batch, exc)
+            return
+        GROUP_COMMIT_ROWS.observe(len(rows))
+        for entry in batch:
+            _resolve(entry)
+
+    async def _recover(self, batch: list[_Entry], error: Exception) -> None:
+        # One bad turn (e.g. its session was deleted meanwhile) must not fail
+        # the others in the batch, so each is retried on its own. If none gets
+        # through, the database is down: buffered turns go back to the queue.
+        failed: list[tuple[_Entry, Exception]] = []
+        for entry in batch:
+            try:
+                if entry.rows:
+                    await self.insert(entry.rows)
+            except Exception as exc:  # noqa: BLE001
+                failed.append((entry, exc))
+            else:
+                _resolve(entry)
+        unavailable = len(failed) == sum(1 for entry in batch if entry.rows)
+        for entry, exc in reversed(failed):
+            if entry.done is not None:
+                WRITE_FAILURES.inc(outcome="raised")
+                if not entry.done.done():
+                    entry.done.set_exception(exc)
+            elif unavailable:
+                WRITE_FAILURES.inc(outcome="requeued")
+                self._enqueue(entry, front=True)
+            else:
+                WRITE_FAILURES.inc(outcome="dropped")
+                logger.error(
+                    "Dropping %d buffered message(s) of session %s: %s",
+                    len(entry.rows),
+                    entry.rows[0]["session_id"],
+                    exc,
+                )
+        if unavailable:
+            logger.warning("Group commit failed, retrying in %.1fs: %s", self.retry_delay, error)
+            await asyncio.sleep(self.retry_delay)
+
+
+def _resolve(entry: _Entry) -> None:
+    if entry.done is not None and not entry.done.done():
+        entry.done.set_result(None)
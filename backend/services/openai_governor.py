@@ -0,0 +1,317 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, TypeVar
+
+from ..metrics import registry
+from ..tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Messages that mention an emergency skip ahead of everything else waiting for
+# a model slot; the reply has to point to 112/116117 without delay.
+EMERGENCY_PATTERN = re.compile(
+    r"\b(?:notfall|notruf|112|atemnot|keine luft|brustschmerz\w*|herzinfarkt|schlaganfall|"
+    r"bewusstlos\w*|ohnmacht|krampfanfall|starke blutung|vergiftung|allergischer schock|suizid\w*)\b",
+    re.IGNORECASE,
+)
+
+
+class Priority(IntEnum):
+    EMERGENCY = 0
+    INTERACTIVE = 1
+    BACKGROUND = 2
+
+
+def is_emergency(messages: Iterable[dict]) -> bool:
+    for message in reversed(list(messages)):
+        if message.get("role") == "user":
+            return EMERGENCY_PATTERN.search(str(message.get("content", ""))) is not None
+    return False
+
+
+GOVERNOR_WAIT = registry.histogram(
+    "openai_governor_wait_seconds",
+    "Time a request waited for a model slot and token budget.",
+    ("priority",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+GOVERNOR_RETRIES = registry.counter("openai_retries_total", "Retried OpenAI calls by error.", ("error",))
+GOVERNOR_COALESCED = registry.counter(
+    "openai_coalesced_requests_total", "Requests answered by an identical in-flight OpenAI call."
+)
+
+
+class _PrioritySlots:
+    # A semaphore whose waiters are woken by priority, then arrival order.
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.in_use = 0
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._arrivals = itertools.count()
+
+    @property
+    def waiting(self) -> dict[Priority, int]:
+        counts = {priority: 0 for priority in Priority}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                counts[Priority(priority)] += 1
+        return counts
+
+    async def acquire(self, priority: Priority) -> None:
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over right before the cancellation.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self.wake()
+
+    def wake(self) -> None:
+        while self._waiters and self.in_use < self.limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.in_use += 1
+            future.set_result(None)
+
+
+class _TokenBudget:
+    # Tokens per minute, refilled continuously. Requests reserve their estimate
+    # up front; the difference to the reported usage is settled afterwards.
+    def __init__(self, tokens_per_minute: int) -> None:
+        self.capacity = float(tokens_per_minute)
+        self.per_second = tokens_per_minute / 60
+        self.tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.per_second)
+        self._updated_at = now
+
+    def delay(self, cost: int) -> float:
+        self._refill()
+        # A request larger than the whole budget waits for a full bucket instead of forever.
+        needed = min(float(cost), self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.per_second
+
+    def take(self, cost: int) -> None:
+        self.tokens -= cost
+
+    def settle(self, reserved: int, used: int) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + reserved - used)
+
+
+# The openai package is imported when a call fails, not when this module loads:
+# it is the single most expensive import of the application.
+def _is_retryable(exc: BaseException) -> bool:
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+
+    return isinstance(exc, (RateLimitError, APIConnectionError, InternalServerError))
+
+
+def _is_rate_limited(exc: BaseException) -> bool:
+    from openai import RateLimitError
+
+    return isinstance(exc, RateLimitError)
+
+
+def retry_after(exc: BaseException) -> float | None:
+    from openai import APIStatusError
+
+    response = getattr(exc, "response", None) if isinstance(exc, APIStatusError) else None
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class GovernorSlot:
+    def __init__(self, governor: "OpenAIGovernor", reserved_tokens: int) -> None:
+        self.governor = governor
+        self.reserved_tokens = reserved_tokens
+        self._settled = False
+
+    async def call(self, operation: Callable[[], Awaitable[T]], timeout: float | None = None) -> T:
+        return await self.governor._call_with_retries(operation, timeout)
+
+    def settle(self, usage: Any) -> None:
+        if usage is None or self._settled:
+            return
+        self._settled = True
+        self.governor._settle(self.reserved_tokens, usage.prompt_tokens + usage.completion_tokens)
+
+
+class OpenAIGovernor:
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        tokens_per_minute: int = 0,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = _PrioritySlots(max_concurrency)
+        self._budget = _TokenBudget(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._resume_at = 0.0
+        self._successes = 0
+
+    @property
+    def concurrency_limit(self) -> int:
+        return self._slots.limit
+
+    @property
+    def in_flight(self) -> int:
+        return self._slots.in_use
+
+    @property
+    def waiting(self) -> dict[Priority, int]:
+        return self._slots.waiting
+
+    @property
+    def available_tokens(self) -> float | None:
+        if self._budget is None:
+            return None
+        self._budget._refill()
+        return self._budget.tokens
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, estimated_tokens: int) -> AsyncIterator[GovernorSlot]:
+        started = time.perf_counter()
+        await self._slots.acquire(priority)
+        try:
+            # Slot holders are admitted by priority, so waiting for budget while
+            # holding one keeps emergencies ahead of everything queued behind them.
+            if self._budget is not None:
+                while (delay := self._budget.delay(estimated_tokens)) > 0:
+                    await asyncio.sleep(delay)
+                self._budget.take(estimated_tokens)
+            waited = time.perf_counter() - started
+            GOVERNOR_WAIT.observe(waited, priority=priority.name.lower())
+            tracer.current().set(governor_wait_ms=round(waited * 1000, 1))
+            slot = GovernorSlot(self, estimated_tokens)
+            yield slot
+        finally:
+            self._slots.release()
+
+    async def _call_with_retries(self, operation: Callable[[], Awaitable[T]], timeout: float | None = None) -> T:
+        # The timeout bounds each upstream attempt, not the pauses between them.
+        attempt = 0
+        while True:
+            pause = self._resume_at - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                async with asyncio.timeout(timeout):
+                    result = await operation()
+            except Exception as exc:
+                if not _is_retryable(exc) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(exc, attempt)
+                attempt += 1
+                GOVERNOR_RETRIES.inc(error=type(exc).__name__)
+                tracer.current().set(retries=attempt)
+                logger.warning(
+                    "OpenAI call failed (%s), retry %d/%d in %.2fs",
+                    type(exc).__name__,
+                    attempt,
+                    self.max_retries,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+                continue
+            self._on_success()
+            return result
+
+    def _backoff(self, exc: BaseException, attempt: int) -> float:
+        # Full jitter keeps retries of a burst from arriving together; the
+        # server's Retry-After is a lower bound when it sends one.
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        hinted = retry_after(exc)
+        if hinted is not None:
+            delay = max(delay, min(hinted, self.backoff_max))
+        if _is_rate_limited(exc):
+            # Throttled: every caller pauses and the concurrency cap is halved
+            # (AIMD), instead of each request finding out on its own. 429s from
+            # calls already in flight during the pause do not halve it again.
+            now = time.monotonic()
+            if now >= self._resume_at:
+                self._slots.limit = max(1, self._slots.limit // 2)
+                self._successes = 0
+            self._resume_at = max(self._resume_at, now + delay)
+        return delay
+
+    def _on_success(self) -> None:
+        if self._slots.limit >= self.max_concurrency:
+            return
+        self._successes += 1
+        if self._successes >= self._slots.limit:
+            self._successes = 0
+            self._slots.limit += 1
+            self._slots.wake()
+
+    def _settle(self, reserved: int, used: int) -> None:
+        if self._budget is not None:
+            self._budget.settle(reserved, used)
+
+
+class SingleFlight:
+    # Concurrent callers with the same key share one call. The call runs as its
+    # own task, so a caller that goes away does not cancel it for the others.
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Task[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, operation: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(operation())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            GOVERNOR_COALESCED.inc()
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task[Any]) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Marks the exception as retrieved when every caller has gone away.
+            task.exception()
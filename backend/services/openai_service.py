@@ -1,81 +1,214 @@
+import hashlib
 import logging
-from typing import List
-
-from openai import AsyncOpenAI, APIError, APIStatusError, RateLimitError
+from typing import Any, AsyncIterator, List
 
+from ..metrics import registry, timed
+from ..serialization import dumps
 from ..settings import settings
+from ..tracing import traced, tracer
+from .llm_providers import OpenAICompatibleProvider
+from .llm_router import CircuitBreaker, ProviderRouter, create_router
+from .openai_governor import Priority, SingleFlight, is_emergency
+from .practices import Practice
+from .response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
-SYSTEM_PROMPT = """
-Du bist virtueller Assistent der Hausarztpraxis Orchideenkamp von Dr. med. Carsten Schmidt in Westerstede. Unterstütze Patientinnen und Patienten bei:
-- Terminvereinbarungen und -absagen
-- Rezeptanforderungen (Name, Geburtsdatum, Medikament, Dosierung, Telefonnummer erfragen)
-- Anfragen zu Krankmeldungen (Name, Geburtsdatum, Telefonnummer, Grund, gewünschter Zeitraum, Arbeitgeber erfassen)
-- Überweisungswünschen (Name, Geburtsdatum, Telefonnummer, Fachrichtung und Anlass erfassen)
-- Befundanfragen
-- Allgemeinen Fragen zu Leistungen, Sprechzeiten und Kontaktwegen
-- Notfallhinweisen (immer sofort auf Notruf 112 bzw. ärztlichen Bereitschaftsdienst 116117 verweisen)
-
-Praxisinformationen:
-- Name: Hausarztpraxis Orchideenkamp – Dr. med. Carsten Schmidt
-- Adresse: Neuer Bahnweg 11, 26655 Westerstede
-- Telefon: 04488 528140
-- Fax: 04488 5281429
-- Website: https://drcarstenschmidt.com
-- Mitgliedschaft: Ärztekammer Niedersachsen, Karl-Wiechert-Allee 18-22, 30625 Hannover
-
-Sprechzeiten:
-- Montag bis Freitag: 08:00 – 13:00 Uhr
-- Montag & Donnerstag: 15:00 – 18:30 Uhr
-
-Leistungsschwerpunkte (bei Bedarf nennen):
-- Hausärztliche und psychosomatische Grundversorgung aller Altersstufen inkl. Notfallmanagement
-- Laboruntersuchungen inkl. Spezialdiagnostik (z. B. Covid-19-Testung)
-- Impfungen, inkl. Covid-19 (in KW 14+15 mRNA-Impfstoffe: Comirnaty oder Moderna)
-- Sonographie, EKG, Langzeit-Blutdruckmessung
-- Vorsorge, Prävention, Impfungen, reisemedizinische Beratung, ärztliche Atteste
-- Telemedizin und ernährungsmedizinische Beratung
-- Spezialsprechstunden nach individueller Vereinbarung
-
-Verhaltensregeln:
-- Antworte stets auf Deutsch, empathisch und professionell.
-- Sammle personenbezogene Daten nur schrittweise und nur, wenn für das Anliegen erforderlich.
-- Gib keine medizinischen Diagnosen oder individuelle Therapieempfehlungen.
-- Weisen bei Notfällen sofort auf den Notruf 112 hin, bei dringenden Fällen außerhalb der Sprechzeiten auch auf den ärztlichen Bereitschaftsdienst 116117.
-- Achte auf Datenschutz und DSGVO-Konformität.
-
-Fasse Informationen klar zusammen und unterstütze strukturiert bei der Datenerhebung.
+SUMMARY_PROMPT = """
+Du fasst den bisherigen Verlauf eines Chats zwischen Patientin bzw. Patient und dem virtuellen Assistenten einer Hausarztpraxis zusammen.
+Übernimm alle konkreten Angaben wörtlich: Name, Geburtsdatum, Kontaktdaten, Versicherung, Anliegen, Beschwerden, Medikamente, Termine und bereits gegebene Auskünfte.
+Ergänze eine vorhandene Zusammenfassung um die neuen Nachrichten, ohne frühere Angaben zu verlieren. Erfinde nichts. Antworte nur mit knappen Stichpunkten.
 """.strip()
 
+SUMMARY_ROLE_LABELS = {"user": "Patient/in", "assistant": "Assistent"}
+
+
+OPENAI_LATENCY = registry.histogram(
+    "openai_request_duration_seconds",
+    "Latency of assistant replies, including cache hits.",
+    ("operation",),
+)
+
+
+def _log_failure(exc: Exception, operation: str) -> None:
+    # Imported here, the openai package stays off the import path of the app.
+    from openai import APIError, RateLimitError
+
+    if isinstance(exc, RateLimitError):
+        logger.warning("OpenAI rate limit hit: %s", exc)
+    elif isinstance(exc, (APIError, ValueError)):
+        logger.error("OpenAI API error: %s", exc, exc_info=exc)
+    else:
+        logger.error("Unexpected error during OpenAI %s: %s", operation, exc, exc_info=exc)
+
+
+def _request_key(request: dict[str, Any]) -> str:
+    return hashlib.sha256(dumps(request)).hexdigest()
+
+
+def _cache_outcome(cache: ResponseCache | None, lookup: Any) -> str:
+    if cache is None:
+        return "off"
+    if lookup is None:
+        # Not cacheable, e.g. the conversation contains personal data.
+        return "bypass"
+    return "hit" if lookup.value is not None else "miss"
+
 
 class OpenAIService:
-    def __init__(self) -> None:
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key)
-        self.model = "gpt-4o-mini"
+    def __init__(self, router: ProviderRouter | None = None, cache: ResponseCache | None = None) -> None:
+        self.router = router or create_router()
+        self.cache = cache
+        self.single_flight = SingleFlight()
+
+    async def embed(self, text: str) -> list[float]:
+        return await self.router.primary.embed(text)
 
-    async def generate_response(self, messages: List[dict]) -> str:
+    def _build_request(self, messages: List[dict], practice: Practice) -> dict[str, Any]:
+        # The practice prompt leads every request unchanged, so upstream prompt
+        # caching can reuse it; only the conversation after it varies.
+        return {
+            "temperature": 0.3,
+            "max_tokens": 500,
+            "messages": [practice.system_message, *messages],
+        }
+
+    async def _complete(self, request: dict[str, Any], priority: Priority) -> str:
+        return (await self.router.complete(request, priority)).content
+
+    @timed(OPENAI_LATENCY, operation="generate")
+    @traced("llm.generate")
+    async def generate_response(self, messages: List[dict], practice: Practice) -> str:
+        lookup = await self.cache.lookup(messages, practice.prompt_hash) if self.cache is not None else None
+        span = tracer.current()
+        span.set(cache=_cache_outcome(self.cache, lookup), messages=len(messages))
+        if lookup is not None and lookup.value is not None:
+            return lookup.value
+        request = self._build_request(messages, practice)
+        priority = Priority.EMERGENCY if is_emergency(messages) else Priority.INTERACTIVE
+        span.set(priority=priority.name.lower())
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                temperature=0.3,
-                max_tokens=500,
-                messages=[{"role": "system", "content": SYSTEM_PROMPT}, *messages],
-            )
-            content = response.choices[0].message.content
-            if not content:
-                raise ValueError("Assistant response was empty.")
+            # Identical concurrent conversations (typically the same first question)
+            # share one completion.
+            content = await self.single_flight.do(_request_key(request), lambda: self._complete(request, priority))
+            if lookup is not None:
+                self.cache.store(lookup, content)
             return content
-        except RateLimitError as exc:
-            logger.warning("OpenAI rate limit hit: %s", exc)
-            raise
-        except (APIError, APIStatusError, ValueError) as exc:
-            logger.error("OpenAI API error: %s", exc, exc_info=True)
+        except Exception as exc:
+            _log_failure(exc, "call")
             raise
-        except Exception as exc:  # noqa: BLE001
-            logger.exception("Unexpected error during OpenAI call: %s", exc)
+
+    @timed(OPENAI_LATENCY, operation="summarize")
+    @traced("llm.summarize")
+    async def summarize(self, previous_summary: str | None, turns: List[dict], max_tokens: int) -> str:
+        transcript = "\n".join(
+            f"{SUMMARY_ROLE_LABELS.get(turn['role'], turn['role'])}: {turn['content']}" for turn in turns
+        )
+        content = f"Bisherige Zusammenfassung:\n{previous_summary}\n\n" if previous_summary else ""
+        content += f"Neue Nachrichten:\n{transcript}"
+        request = {
+            "temperature": 0,
+            "max_tokens": max_tokens,
+            "messages": [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": content}],
+        }
+        return (await self._complete(request, Priority.BACKGROUND)).strip()
+
+    @timed(OPENAI_LATENCY, operation="stream")
+    async def stream_response(self, messages: List[dict], practice: Practice) -> AsyncIterator[str]:
+        lookup = await self.cache.lookup(messages, practice.prompt_hash) if self.cache is not None else None
+        # A generator cannot keep a span current across its yields, so this one
+        # is ended by hand; the provider spans attach to the caller's span.
+        span = tracer.start("llm.stream", cache=_cache_outcome(self.cache, lookup), messages=len(messages))
+        if lookup is not None and lookup.value is not None:
+            tracer.end(span)
+            yield lookup.value
+            return
+        request = self._build_request(messages, practice)
+        priority = Priority.EMERGENCY if is_emergency(messages) else Priority.INTERACTIVE
+        span.set(priority=priority.name.lower())
+        try:
+            parts: list[str] = []
+            async for delta in self.router.stream(request, priority):
+                parts.append(delta)
+                yield delta
+            span.set(deltas=len(parts))
+            if lookup is not None:
+                self.cache.store(lookup, "".join(parts))
+        except Exception as exc:
+            tracer.end(span, exc)
+            _log_failure(exc, "stream")
             raise
+        finally:
+            tracer.end(span)
+
+
+def _create_cache(service: OpenAIService) -> ResponseCache | None:
+    if not settings.response_cache_enabled:
+        return None
+    return ResponseCache(
+        ttl_seconds=settings.response_cache_ttl_seconds,
+        max_entries=settings.response_cache_max_entries,
+        min_query_length=settings.response_cache_min_query_length,
+        embedder=service.embed if settings.response_cache_semantic else None,
+        similarity_threshold=settings.response_cache_similarity,
+    )
 
 
 openai_service = OpenAIService()
+openai_service.cache = _create_cache(openai_service)
+
+
+def _governed_providers() -> list[OpenAICompatibleProvider]:
+    return [provider for provider in openai_service.router.providers if isinstance(provider, OpenAICompatibleProvider)]
+
 
+registry.counter(
+    "response_cache_events_total",
+    "Response cache lookups by outcome.",
+    ("event",),
+    callback=lambda: {(event,): count for event, count in openai_service.cache.stats.items()}
+    if openai_service.cache is not None
+    else {},
+)
+registry.gauge(
+    "openai_governor_in_flight",
+    "Model calls holding a governor slot, and the current adaptive limit, by provider.",
+    ("provider", "kind"),
+    callback=lambda: {
+        key: value
+        for provider in _governed_providers()
+        for key, value in (
+            ((provider.name, "in_flight"), provider.governor.in_flight),
+            ((provider.name, "limit"), provider.governor.concurrency_limit),
+        )
+    },
+)
+registry.gauge(
+    "openai_governor_waiting",
+    "Requests waiting for a governor slot by provider and priority.",
+    ("provider", "priority"),
+    callback=lambda: {
+        (provider.name, priority.name.lower()): count
+        for provider in _governed_providers()
+        for priority, count in provider.governor.waiting.items()
+    },
+)
+registry.gauge(
+    "openai_governor_token_budget",
+    "Tokens left in the per-minute budget by provider.",
+    ("provider",),
+    callback=lambda: {
+        (provider.name,): provider.governor.available_tokens
+        for provider in _governed_providers()
+        if provider.governor.available_tokens is not None
+    },
+)
+_BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+registry.gauge(
+    "llm_circuit_state",
+    "Circuit breaker state by provider (0 closed, 1 half-open, 2 open).",
+    ("provider",),
+    callback=lambda: {
+        (name,): _BREAKER_STATES[breaker.state] for name, breaker in openai_service.router.breakers.items()
+    },
+)
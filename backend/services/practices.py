@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator
+
+from ..metrics import registry
+from ..settings import settings
+from .intent_router import IntentRouter
+from .tokenizer import token_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRACTICES_DIR = Path(__file__).resolve().parent.parent / "data" / "practices"
+
+PROMPT_TEMPLATE = """
+{assistant} Unterstütze Patientinnen und Patienten bei:
+- Terminvereinbarungen und -absagen
+- Rezeptanforderungen (Name, Geburtsdatum, Medikament, Dosierung, Telefonnummer erfragen)
+- Anfragen zu Krankmeldungen (Name, Geburtsdatum, Telefonnummer, Grund, gewünschter Zeitraum, Arbeitgeber erfassen)
+- Überweisungswünschen (Name, Geburtsdatum, Telefonnummer, Fachrichtung und Anlass erfassen)
+- Befundanfragen
+- Allgemeinen Fragen zu Leistungen, Sprechzeiten und Kontaktwegen
+- Notfallhinweisen (immer sofort auf Notruf 112 bzw. ärztlichen Bereitschaftsdienst 116117 verweisen)
+
+Praxisinformationen:
+{info}
+
+Sprechzeiten:
+{opening_hours}
+
+Leistungsschwerpunkte (bei Bedarf nennen):
+{services}
+
+Verhaltensregeln:
+- Antworte stets auf Deutsch, empathisch und professionell.
+- Sammle personenbezogene Daten nur schrittweise und nur, wenn für das Anliegen erforderlich.
+- Gib keine medizinischen Diagnosen oder individuelle Therapieempfehlungen.
+- Weisen bei Notfällen sofort auf den Notruf 112 hin, bei dringenden Fällen außerhalb der Sprechzeiten auch auf den ärztlichen Bereitschaftsdienst 116117.
+- Achte auf Datenschutz und DSGVO-Konformität.
+
+Fasse Informationen klar zusammen und unterstütze strukturiert bei der Datenerhebung.
+""".strip()
+
+
+class UnknownPractice(KeyError):
+    pass
+
+
+def _bullets(items: list[str]) -> str:
+    return "\n".join(f"- {item}" for item in items)
+
+
+def compile_prompt(profile: dict[str, Any]) -> str:
+    prompt = PROMPT_TEMPLATE.format(
+        assistant=profile["assistant"],
+        info=_bullets([f"{label}: {value}" for label, value in profile.get("info", {}).items()]),
+        opening_hours=_bullets(profile.get("opening_hours", [])),
+        services=_bullets(profile.get("services", [])),
+    )
+    # Upstream prompt caching matches on exact bytes, so the prompt is fixed
+    # here once: NFC, no trailing whitespace, no per-request content.
+    prompt = unicodedata.normalize("NFC", prompt)
+    return "\n".join(line.rstrip() for line in prompt.splitlines())
+
+
+@dataclass(frozen=True)
+class Practice:
+    id: str
+    name: str
+    system_prompt: str
+    # Sent as the first message of every request, always this very object.
+    system_message: dict[str, str]
+    prompt_hash: str
+    prompt_tokens: int
+    intent_router: IntentRouter | None = None
+
+    def owns(self, practice_id: str | None) -> bool:
+        # Sessions created before practices existed belong to the default practice.
+        return (practice_id or settings.default_practice) == self.id
+
+
+def load_practice(path: Path) -> Practice:
+    with path.open(encoding="utf-8") as handle:
+        profile = json.load(handle)
+    practice_id = profile.get("id") or path.stem
+    system_prompt = compile_prompt(profile)
+
+    intents_path = path.parent / profile["intents"] if profile.get("intents") else None
+    if practice_id == settings.default_practice and settings.intent_templates_path:
+        # INTENT_TEMPLATES_PATH predates practice profiles and still applies to the default one.
+        intents_path = Path(settings.intent_templates_path)
+    intent_router = None
+    if settings.intent_router_enabled and intents_path is not None:
+        intent_router = IntentRouter.from_file(intents_path, min_confidence=settings.intent_router_min_confidence)
+
+    return Practice(
+        id=practice_id,
+        name=profile.get("info", {}).get("Name", practice_id),
+        system_prompt=system_prompt,
+        system_message={"role": "system", "content": system_prompt},
+        prompt_hash=hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16],
+        prompt_tokens=token_counter(settings.openai_model).count(system_prompt),
+        intent_router=intent_router,
+    )
+
+
+def _key_digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class PracticeRegistry:
+    def __init__(
+        self,
+        practices: list[Practice],
+        api_keys: dict[str, str],
+        default: str,
+        staff_keys: dict[str, str] | None = None,
+    ) -> None:
+        self._practices = {practice.id: practice for practice in practices}
+        if default not in self._practices:
+            raise UnknownPractice(f"DEFAULT_PRACTICE {default!r} has no profile")
+        self.default = self._practices[default]
+        # Keys are held as digests; a lookup hashes the presented key first.
+        self._by_key: dict[str, Practice] = {}
+        for api_key, practice_id in api_keys.items():
+            if practice_id not in self._practices:
+                raise UnknownPractice(f"API key mapped to unknown practice {practice_id!r}")
+            self._by_key[_key_digest(api_key)] = self._practices[practice_id]
+        # Staff keys unlock endpoints that read across sessions (search); they
+        # are kept apart so a public widget key can never match one.
+        self._by_staff_key: dict[str, Practice] = {}
+        for staff_key, practice_id in (staff_keys or {}).items():
+            if practice_id not in self._practices:
+                raise UnknownPractice(f"Staff key mapped to unknown practice {practice_id!r}")
+            self._by_staff_key[_key_digest(staff_key)] = self._practices[practice_id]
+
+    @property
+    def has_staff_keys(self) -> bool:
+        return bool(self._by_staff_key)
+
+    def __iter__(self) -> Iterator[Practice]:
+        return iter(self._practices.values())
+
+    def __len__(self) -> int:
+        return len(self._practices)
+
+    def get(self, practice_id: str | None) -> Practice:
+        if practice_id is None:
+            return self.default
+        try:
+            return self._practices[practice_id]
+        except KeyError:
+            raise UnknownPractice(practice_id) from None
+
+    def for_api_key(self, api_key: str) -> Practice | None:
+        return self._by_key.get(_key_digest(api_key))
+
+    def for_staff_key(self, staff_key: str) -> Practice | None:
+        return self._by_staff_key.get(_key_digest(staff_key))
+
+    @classmethod
+    def from_directory(
+        cls, directory: Path, api_keys: dict[str, str], default: str, staff_keys: dict[str, str] | None = None
+    ) -> "PracticeRegistry":
+        practices = []
+        for path in sorted(directory.glob("*.json")):
+            practices.append(practice := load_practice(path))
+            logger.info("Loaded practice %s (%d prompt tokens)", practice.id, practice.prompt_tokens)
+        return cls(practices, api_keys, default, staff_keys)
+
+
+def _create_registry() -> PracticeRegistry:
+    directory = Path(settings.practices_dir) if settings.practices_dir else DEFAULT_PRACTICES_DIR
+    # API_KEY keeps working for single-practice deployments.
+    api_keys = {settings.api_key: settings.default_practice, **settings.practice_api_keys}
+    return PracticeRegistry.from_directory(
+        directory, api_keys, settings.default_practice, settings.staff_api_keys
+    )
+
+
+practice_registry = _create_registry()
+
+registry.gauge(
+    "practice_prompt_tokens",
+    "Tokens in the compiled system prompt of each practice.",
+    ("practice",),
+    callback=lambda: {(practice.id,): practice.prompt_tokens for practice in practice_registry},
+)
@@ -0,0 +1,164 @@
+import logging
+import math
+import re
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+from ..metrics import registry
+from ..settings import settings
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_DECISIONS = registry.counter(
+    "rate_limit_decisions_total", "Rate limit checks by scope and outcome.", ("scope", "outcome")
+)
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_RATE = re.compile(r"^\s*(\d+)\s*/\s*(second|minute|hour|day)s?\s*$")
+
+
+class Rate(NamedTuple):
+    # A bucket holds up to `capacity` tokens and refills at `per_second`, so
+    # "20/minute" allows a burst of 20 and then one request every three seconds.
+    capacity: int
+    per_second: float
+
+    @classmethod
+    def parse(cls, value: str) -> "Rate":
+        match = _RATE.match(value)
+        if match is None or int(match.group(1)) < 1:
+            raise ValueError(f"Invalid rate {value!r}, expected e.g. '20/minute'")
+        count = int(match.group(1))
+        return cls(count, count / _PERIODS[match.group(2)])
+
+
+class RateLimitDecision(NamedTuple):
+    allowed: bool
+    remaining: float
+    retry_after: float
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class BucketStore(ABC):
+    @abstractmethod
+    async def take(self, key: str, rate: Rate, cost: int = 1) -> RateLimitDecision: ...
+
+    async def close(self) -> None:
+        return None
+
+
+def _refill(tokens: float, elapsed: float, rate: Rate, cost: int) -> RateLimitDecision:
+    tokens = min(float(rate.capacity), tokens + max(elapsed, 0.0) * rate.per_second)
+    if tokens >= cost:
+        return RateLimitDecision(True, tokens - cost, 0.0)
+    return RateLimitDecision(False, tokens, (cost - tokens) / rate.per_second)
+
+
+# Per-process buckets for development and single-worker deployments. take() does
+# not await, so check-and-update is atomic on the event loop.
+class InProcessBucketStore(BucketStore):
+    def __init__(self, max_keys: int = 100_000) -> None:
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, rate: Rate, cost: int = 1) -> RateLimitDecision:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (float(rate.capacity), now))
+        decision = _refill(tokens, now - updated_at, rate, cost)
+        self._buckets[key] = (decision.remaining, now)
+        if len(self._buckets) > self.max_keys:
+            # The least recently used bucket is the one most likely to be full again.
+            self._buckets.popitem(last=False)
+        return decision
+
+
+# Refill and take in one server-side step: a single round trip per check and no
+# race between workers. Redis' clock is used so worker clock skew does not matter.
+TOKEN_BUCKET_SCRIPT = """
+redis.replicate_commands()
+local capacity = tonumber(ARGV[1])
+local per_second = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * per_second)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / per_second
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / per_second * 1000))
+return {allowed, tostring(tokens), tostring(retry_after)}
+"""
+
+
+class RedisBucketStore(BucketStore):
+    def __init__(self, client: Any, key_prefix: str = "ratelimit:") -> None:
+        self.client = client
+        self.key_prefix = key_prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, rate: Rate, cost: int = 1) -> RateLimitDecision:
+        allowed, remaining, retry_after = await self._script(
+            keys=[f"{self.key_prefix}{key}"], args=[rate.capacity, rate.per_second, cost]
+        )
+        return RateLimitDecision(bool(int(allowed)), float(remaining), float(retry_after))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class RateLimiter:
+    def __init__(self, store: BucketStore, enabled: bool = True) -> None:
+        self.store = store
+        self.enabled = enabled
+
+    async def hit(self, scope: str, key: str, rate: Rate, cost: int = 1) -> None:
+        if not self.enabled:
+            return
+        try:
+            decision = await self.store.take(f"{scope}:{key}", rate, cost)
+        except Exception as exc:  # noqa: BLE001
+            # Fail open: an unavailable limiter store must not take the chat down.
+            logger.warning("Rate limit check for %s failed, allowing the request: %s", scope, exc)
+            RATE_LIMIT_DECISIONS.inc(scope=scope, outcome="error")
+            return
+        RATE_LIMIT_DECISIONS.inc(scope=scope, outcome="allowed" if decision.allowed else "limited")
+        if not decision.allowed:
+            raise RateLimitExceeded(decision.retry_after)
+
+    async def close(self) -> None:
+        await self.store.close()
+
+
+def retry_after_header(exc: RateLimitExceeded) -> dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+
+
+def create_bucket_store() -> BucketStore:
+    if settings.rate_limit_backend == "redis":
+        from redis.asyncio import Redis
+
+        return RedisBucketStore(Redis.from_url(settings.redis_url))
+    if settings.rate_limit_backend != "memory":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND {settings.rate_limit_backend!r}")
+    return InProcessBucketStore()
+
+
+rate_limiter = RateLimiter(create_bucket_store(), enabled=settings.rate_limit_enabled)
+SESSION_TURN_RATE = Rate.parse(settings.rate_limit_session_turns)
+WEBSOCKET_MESSAGE_RATE = Rate.parse(settings.rate_limit_websocket_messages)
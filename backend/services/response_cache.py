@@ -0,0 +1,195 @@
+import logging
+import math
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+Embedder = Callable[[str], Awaitable[list[float]]]
+
+# Conversations in which any message mentions one of these are treated as
+# containing personal data and never read from or write to the cache. That
+# includes assistant turns and the rolling summary, which carries details of
+# user turns that have left the window.
+PERSONAL_DATA_PATTERNS = (
+    re.compile(r"\b\d{1,2}\s?\.\s?\d{1,2}\s?\.\s?\d{2,4}\b"),
+    re.compile(r"(?:\+49|\b0)\d[\d\s/-]{5,}\d"),
+    re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"),
+    re.compile(
+        r"\b(?:mein name|ich hei(?:ß|ss)e|geboren|geburtsdatum|versicherten|krankenkasse|"
+        r"telefonnummer|handynummer|adresse lautet|wohne in)\b",
+        re.IGNORECASE,
+    ),
+)
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def contains_personal_data(messages: Iterable[dict]) -> bool:
+    return any(
+        pattern.search(str(message.get("content", "")))
+        for message in messages
+        for pattern in PERSONAL_DATA_PATTERNS
+    )
+
+
+@dataclass
+class CacheLookup:
+    key: str
+    query: str
+    value: str | None = None
+    vector: list[float] | None = None
+
+
+class _VectorIndex:
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._vectors: OrderedDict[str, list[float]] = OrderedDict()
+
+    def add(self, key: str, vector: list[float]) -> None:
+        self._vectors[key] = vector
+        self._vectors.move_to_end(key)
+        while len(self._vectors) > self.max_entries:
+            self._vectors.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        self._vectors.pop(key, None)
+
+    def nearest(self, vector: list[float], prefix: str = "") -> tuple[str | None, float]:
+        best_key: str | None = None
+        best_score = -1.0
+        for key, candidate in self._vectors.items():
+            if not key.startswith(prefix):
+                continue
+            score = sum(a * b for a, b in zip(vector, candidate))
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key, best_score
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        ttl_seconds: float = 3600.0,
+        max_entries: int = 1024,
+        min_query_length: int = 12,
+        embedder: Embedder | None = None,
+        similarity_threshold: float = 0.92,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.min_query_length = min_query_length
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._index = _VectorIndex(max_entries) if embedder else None
+        self.stats: dict[str, int] = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "skipped": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _cacheable_query(self, messages: list[dict]) -> str | None:
+        if not messages or messages[-1].get("role") != "user":
+            return None
+        # Only opening questions are cached. The key holds the last user turn
+        # alone, so a follow-up ("und wie lange dauert das?") or a turn after
+        # a summary would get the answer given in another conversation.
+        if len(messages) > 1:
+            return None
+        if contains_personal_data(messages):
+            return None
+        query = normalize_query(str(messages[-1].get("content", "")))
+        # Very short turns ("ja", "danke") only make sense in context.
+        if len(query) < self.min_query_length:
+            return None
+        return query
+
+    def _get_entry(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self.stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _drop(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._index is not None:
+            self._index.discard(key)
+
+    async def _embed(self, query: str) -> list[float] | None:
+        if self.embedder is None:
+            return None
+        try:
+            vector = await self.embedder(query)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Embedding for response cache failed: %s", exc)
+            return None
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    async def lookup(self, messages: list[dict], prompt_hash: str) -> CacheLookup | None:
+        # Entries are namespaced by the hash of the system prompt they were
+        # answered under, so practices never see each other's answers.
+        query = self._cacheable_query(messages)
+        if query is None:
+            self.stats["skipped"] += 1
+            return None
+
+        key = f"{prompt_hash}:{query}"
+        lookup = CacheLookup(key=key, query=query, value=self._get_entry(key))
+        if lookup.value is not None:
+            self.stats["exact_hits"] += 1
+            return lookup
+
+        if self._index is not None:
+            lookup.vector = await self._embed(query)
+            if lookup.vector is not None:
+                nearest_key, score = self._index.nearest(lookup.vector, f"{prompt_hash}:")
+                if nearest_key is not None and score >= self.similarity_threshold:
+                    lookup.value = self._get_entry(nearest_key)
+                    if lookup.value is not None:
+                        self.stats["semantic_hits"] += 1
+                        logger.debug("Semantic cache hit (%.3f) for %r", score, query)
+                        return lookup
+
+        self.stats["misses"] += 1
+        return lookup
+
+    def store(self, lookup: CacheLookup, value: str) -> None:
+        self._entries[lookup.key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(lookup.key)
+        if self._index is not None and lookup.vector is not None:
+            self._index.add(lookup.key, lookup.vector)
+        while len(self._entries) > self.max_entries:
+            evicted_key, _ = self._entries.popitem(last=False)
+            if self._index is not None:
+                self._index.discard(evicted_key)
+            self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        if self._index is not None:
+            self._index = _VectorIndex(self.max_entries)
@@ -0,0 +1,433 @@
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import ColumnElement, delete, func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from ..metrics import registry
+from ..models.database import ChatSession, Message, dispose_engine, get_engine
+from ..serialization import dumps
+from ..settings import settings
+from .jobs import JobQueue, generation_pool
+from .message_store import HISTORY_COLUMNS, _as_utc, message_store
+
+logger = logging.getLogger(__name__)
+
+RETENTION_ROWS = registry.counter(
+    "retention_rows_total", "Rows removed by the retention job by table.", ("table",)
+)
+
+# Held for the duration of a run so only one worker process purges at a time.
+RETENTION_LOCK_KEY = 0x43484154
+# Monthly partitions of messages as created by migrations/sql/partition_messages_by_month.sql.
+PARTITION_NAME = re.compile(r"^messages_p(\d{4})(\d{2})$")
+PARTITION_MONTHS_AHEAD = 2
+
+
+def _month_start(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(value: datetime) -> datetime:
+    return value.replace(year=value.year + 1, month=1) if value.month == 12 else value.replace(month=value.month + 1)
+
+
+@dataclass
+class RetentionReport:
+    cutoff: datetime
+    dry_run: bool = False
+    sessions: int = 0
+    messages: int = 0
+    jobs: int = 0
+    batches: int = 0
+    partitions_dropped: list[str] = field(default_factory=list)
+    archive_path: Path | None = None
+    # Time spent working, without the pauses between batches.
+    busy_seconds: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        return self.sessions + self.messages
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.busy_seconds if self.busy_seconds else 0.0
+
+
+class JsonlArchive:
+    def __init__(self, directory: str | Path) -> None:
+        started = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self.path = Path(directory) / f"chat-archive-{started}.jsonl.gz"
+
+    async def write(self, records: list[dict[str, Any]]) -> None:
+        if records:
+            await asyncio.to_thread(self._write, records)
+
+    def _write(self, records: list[dict[str, Any]]) -> None:
+        # One gzip member per batch, synced before the batch is deleted from the
+        # database. Concatenated members read back as a single stream.
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as archive:
+                archive.write(b"".join(dumps(record) + b"\n" for record in records))
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def _message_record(row: Any) -> dict[str, Any]:
+    return {"message_id": row.id, "role": row.role, "content": row.content, "timestamp": _as_utc(row.timestamp)}
+
+
+def _session_record(
+    session_id: uuid.UUID, created_at: datetime | None, summary: str | None, messages: list[Any]
+) -> dict[str, Any]:
+    return {
+        "session_id": session_id,
+        "created_at": _as_utc(created_at),
+        "summary": summary,
+        "messages": [_message_record(row) for row in messages],
+    }
+
+
+class RetentionJob:
+    def __init__(
+        self,
+        retention_days: int,
+        batch_size: int = 200,
+        pause_seconds: float = 0.5,
+        archive_dir: str | Path | None = None,
+        db_engine: AsyncEngine | None = None,
+        job_queue: JobQueue | None = None,
+    ) -> None:
+        if retention_days < 1:
+            raise ValueError("retention_days must be at least 1")
+        self._engine = db_engine
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.archive_dir = archive_dir
+        self.job_queue = job_queue
+
+    @property
+    def engine(self) -> AsyncEngine:
+        return self._engine or get_engine()
+
+    def cutoff(self, now: datetime | None = None) -> datetime:
+        return (now or datetime.now(timezone.utc)) - timedelta(days=self.retention_days)
+
+    @staticmethod
+    def _expired(cutoff: datetime) -> list[ColumnElement[bool]]:
+        # A session expires once it is older than the cutoff and has had no message since.
+        recent = select(Message.id).where(Message.session_id == ChatSession.id, Message.timestamp >= cutoff).exists()
+        return [ChatSession.created_at < cutoff, ~recent]
+
+    async def run(self, now: datetime | None = None, dry_run: bool = False) -> RetentionReport | None:
+        async with self.engine.connect() as lock_conn:
+            if not await self._try_lock(lock_conn):
+                logger.info("Retention run skipped: another process holds the retention lock.")
+                return None
+            try:
+                report = RetentionReport(cutoff=self.cutoff(now), dry_run=dry_run)
+                if dry_run:
+                    await self._count(report)
+                else:
+                    archive = JsonlArchive(self.archive_dir) if self.archive_dir else None
+                    await self._purge_sessions(report, archive)
+                    await self._maintain_partitions(report, archive, now or datetime.now(timezone.utc))
+                    await self._purge_jobs(report)
+            finally:
+                await self._unlock(lock_conn)
+
+        logger.info(
+            "Retention %s: %d session(s), %d message(s), %d partition(s) older than %s, %d finished job(s) "
+            "in %.1fs (%.0f rows/s)",
+            "dry run" if dry_run else "run",
+            report.sessions,
+            report.messages,
+            len(report.partitions_dropped),
+            report.cutoff.isoformat(),
+            report.jobs,
+            report.busy_seconds,
+            report.rows_per_second,
+        )
+        return report
+
+    async def _try_lock(self, conn: AsyncConnection) -> bool:
+        if conn.dialect.name != "postgresql":
+            return True
+        locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": RETENTION_LOCK_KEY})
+        await conn.commit()
+        return bool(locked)
+
+    async def _unlock(self, conn: AsyncConnection) -> None:
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RETENTION_LOCK_KEY})
+            await conn.commit()
+
+    async def _purge_jobs(self, report: RetentionReport) -> None:
+        # Generation jobs hold whole conversations. They are normally deleted
+        # GENERATION_JOB_RETAIN_SECONDS after they finish; this run also catches
+        # the rows left when no job has finished since.
+        if self.job_queue is not None:
+            report.jobs = await self.job_queue.purge_finished()
+            RETENTION_ROWS.inc(report.jobs, table="generation_jobs")
+
+    async def _count(self, report: RetentionReport) -> None:
+        started = time.perf_counter()
+        expired = self._expired(report.cutoff)
+        async with self.engine.connect() as conn:
+            report.sessions = await conn.scalar(select(func.count()).select_from(ChatSession).where(*expired))
+            report.messages = await conn.scalar(
+                select(func.count())
+                .select_from(Message)
+                .where(Message.session_id.in_(select(ChatSession.id).where(*expired)))
+            )
+            if await self._is_partitioned(conn):
+                report.partitions_dropped = [
+                    name for name, end in await self._partitions(conn) if end <= report.cutoff
+                ]
+        report.busy_seconds = time.perf_counter() - started
+
+    async def _purge_sessions(self, report: RetentionReport, archive: JsonlArchive | None) -> None:
+        expired = self._expired(report.cutoff)
+        while True:
+            started = time.perf_counter()
+            # One short transaction per batch keeps row locks and WAL bursts bounded.
+            async with self.engine.begin() as conn:
+                session_ids = list(
+                    (
+                        await conn.execute(
+                            select(ChatSession.id)
+                            .where(*expired)
+                            .order_by(ChatSession.created_at)
+                            .limit(self.batch_size)
+                        )
+                    ).scalars()
+                )
+                if not session_ids:
+                    report.busy_seconds += time.perf_counter() - started
+                    break
+                if archive is not None:
+                    await archive.write(await self._session_records(conn, session_ids))
+                    report.archive_path = archive.path
+                messages = (await conn.execute(delete(Message).where(Message.session_id.in_(session_ids)))).rowcount
+                sessions = (await conn.execute(delete(ChatSession).where(ChatSession.id.in_(session_ids)))).rowcount
+
+            elapsed = time.perf_counter() - started
+            report.busy_seconds += elapsed
+            report.batches += 1
+            report.sessions += sessions
+            report.messages += messages
+            RETENTION_ROWS.inc(sessions, table="chat_sessions")
+            RETENTION_ROWS.inc(messages, table="messages")
+            if message_store.window_cache is not None:
+                for session_id in session_ids:
+                    message_store.window_cache.discard(session_id)
+            logger.debug(
+                "Retention batch %d: %d session(s), %d message(s) in %.3fs (%.0f rows/s)",
+                report.batches,
+                sessions,
+                messages,
+                elapsed,
+                (sessions + messages) / elapsed if elapsed else 0.0,
+            )
+            if len(session_ids) < self.batch_size:
+                break
+            await asyncio.sleep(self.pause_seconds)
+
+    async def _session_records(self, conn: AsyncConnection, session_ids: list[uuid.UUID]) -> list[dict[str, Any]]:
+        sessions = await conn.execute(
+            select(ChatSession.id, ChatSession.created_at, ChatSession.summary).where(ChatSession.id.in_(session_ids))
+        )
+        messages: dict[uuid.UUID, list[Any]] = {session_id: [] for session_id in session_ids}
+        rows = await conn.execute(
+            select(*HISTORY_COLUMNS)
+            .where(Message.session_id.in_(session_ids))
+            .order_by(Message.session_id, Message.timestamp, Message.id)
+        )
+        for row in rows:
+            messages[row.session_id].append(row)
+        return [_session_record(row.id, row.created_at, row.summary, messages[row.id]) for row in sessions]
+
+    async def _is_partitioned(self, conn: AsyncConnection) -> bool:
+        if conn.dialect.name != "postgresql":
+            return False
+        return bool(
+            await conn.scalar(
+                text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))")
+            )
+        )
+
+    async def _partitions(self, conn: AsyncConnection) -> list[tuple[str, datetime]]:
+        # (name, exclusive upper bound) of every monthly partition, oldest first.
+        rows = await conn.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = to_regclass('messages')"
+            )
+        )
+        partitions = []
+        for (name,) in rows:
+            match = PARTITION_NAME.match(name)
+            if match:
+                start = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+                partitions.append((name, _next_month(start)))
+        return sorted(partitions, key=lambda partition: partition[1])
+
+    async def _maintain_partitions(
+        self, report: RetentionReport, archive: JsonlArchive | None, now: datetime
+    ) -> None:
+        # Partitions that end before the cutoff only hold messages past retention,
+        # left over from sessions that are still active. Dropping them is a cheap
+        # catalog change instead of a large DELETE.
+        started = time.perf_counter()
+        async with self.engine.begin() as conn:
+            if not await self._is_partitioned(conn):
+                report.busy_seconds += time.perf_counter() - started
+                return
+            month = _month_start(now)
+            for _ in range(PARTITION_MONTHS_AHEAD + 1):
+                following = _next_month(month)
+                await conn.execute(
+                    text(
+                        f"CREATE TABLE IF NOT EXISTS messages_p{month:%Y%m} PARTITION OF messages "
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+                    )
+                )
+                month = following
+            expired = [name for name, end in await self._partitions(conn) if end <= report.cutoff]
+
+        report.busy_seconds += time.perf_counter() - started
+
+        for name in expired:
+            started = time.perf_counter()
+            async with self.engine.begin() as conn:
+                if archive is not None:
+                    await archive.write(await self._partition_records(conn, name))
+                    report.archive_path = archive.path
+                messages = await conn.scalar(text(f"SELECT count(*) FROM {name}"))
+                await conn.execute(text(f"DROP TABLE {name}"))
+            report.busy_seconds += time.perf_counter() - started
+            report.messages += messages
+            report.partitions_dropped.append(name)
+            RETENTION_ROWS.inc(messages, table="messages")
+            logger.info("Dropped partition %s with %d message(s).", name, messages)
+            await asyncio.sleep(self.pause_seconds)
+
+        if expired and message_store.window_cache is not None:
+            message_store.window_cache.clear()
+
+    async def _partition_records(self, conn: AsyncConnection, name: str) -> list[dict[str, Any]]:
+        rows = await conn.execute(
+            text(f"SELECT id, session_id, role, content, timestamp FROM {name} ORDER BY session_id, timestamp, id")
+        )
+        records: list[dict[str, Any]] = []
+        for row in rows:
+            if not records or records[-1]["session_id"] != row.session_id:
+                # The session itself is still active; only these old messages go.
+                records.append({**_session_record(row.session_id, None, None, []), "partial": True})
+            records[-1]["messages"].append(_message_record(row))
+        return records
+
+
+class RetentionScheduler:
+    def __init__(self, job: RetentionJob, interval_seconds: float, initial_delay: float = 60.0) -> None:
+        self.job = job
+        self.interval_seconds = interval_seconds
+        self.initial_delay = initial_delay
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="retention")
+        logger.info(
+            "Retention enabled: sessions idle for %d day(s) are purged every %.0fs.",
+            self.job.retention_days,
+            self.interval_seconds,
+        )
+
+    async def stop(self) -> None:
+        # A batch cut short by cancellation rolls back and is picked up by the next run.
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        await asyncio.sleep(self.initial_delay)
+        while True:
+            try:
+                await self.job.run()
+            except Exception:  # noqa: BLE001
+                logger.exception("Retention run failed, retrying in %.0fs.", self.interval_seconds)
+            await asyncio.sleep(self.interval_seconds)
+
+
+def _create_job(**overrides: Any) -> RetentionJob:
+    options: dict[str, Any] = {
+        "retention_days": settings.retention_days,
+        "batch_size": settings.retention_batch_size,
+        "pause_seconds": settings.retention_batch_pause_seconds,
+        "archive_dir": settings.retention_archive_dir,
+        "job_queue": generation_pool.queue,
+    }
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return RetentionJob(**options)
+
+
+def _create_scheduler() -> RetentionScheduler | None:
+    if not settings.retention_enabled:
+        return None
+    return RetentionScheduler(_create_job(), interval_seconds=settings.retention_interval_seconds)
+
+
+retention_scheduler = _create_scheduler()
+
+
+async def _main(args: argparse.Namespace) -> None:
+    job = _create_job(
+        retention_days=args.days,
+        batch_size=args.batch_size,
+        pause_seconds=args.pause,
+        archive_dir=args.archive_dir,
+    )
+    try:
+        report = await job.run(dry_run=args.dry_run)
+    finally:
+        await dispose_engine()
+    if report is None:
+        raise SystemExit("Another process is running the retention job.")
+    action = "Would purge" if report.dry_run else "Purged"
+    print(
+        f"{action} {report.sessions} session(s) and {report.messages} message(s) "
+        f"older than {report.cutoff:%Y-%m-%d %H:%M} UTC"
+    )
+    if report.partitions_dropped:
+        print(f"Partitions: {', '.join(report.partitions_dropped)}")
+    if not report.dry_run:
+        print(f"{report.batches} batch(es), {report.busy_seconds:.2f}s, {report.rows_per_second:.0f} rows/s")
+    if report.archive_path is not None:
+        print(f"Archive: {report.archive_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge or archive chat sessions past the retention period.")
+    parser.add_argument("--days", type=int, help="retention period, defaults to RETENTION_DAYS")
+    parser.add_argument("--batch-size", type=int, help="sessions per batch, defaults to RETENTION_BATCH_SIZE")
+    parser.add_argument(
+        "--pause", type=float, help="seconds between batches, defaults to RETENTION_BATCH_PAUSE_SECONDS"
+    )
+    parser.add_argument("--archive-dir", help="write gzip JSONL archives here before deleting")
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be purged")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+
+from ..settings import settings
+from .conversation_cache import Turn
+from .message_store import MessageStore, message_store
+from .openai_service import OpenAIService, openai_service
+
+logger = logging.getLogger(__name__)
+
+# Messages folded into the summary per model call when a backlog has built up.
+SUMMARY_BATCH_MESSAGES = 20
+
+
+class ConversationSummarizer:
+    def __init__(self, store: MessageStore, service: OpenAIService, max_tokens: int = 300) -> None:
+        self.store = store
+        self.service = service
+        self.max_tokens = max_tokens
+        self._running: dict[uuid.UUID, asyncio.Task] = {}
+
+    def schedule(self, session_id: uuid.UUID, overflow: list[Turn]) -> None:
+        # Runs after the turn, off the request path. A session that is already
+        # being summarized is skipped: the next run starts from the stored
+        # watermark, so messages whose overflow was skipped (or whose summary
+        # failed) are still folded in.
+        if not overflow or session_id in self._running:
+            return
+        task = asyncio.create_task(self._summarize(session_id, overflow[-1].timestamp))
+        self._running[session_id] = task
+        task.add_done_callback(lambda _: self._running.pop(session_id, None))
+
+    async def _summarize(self, session_id: uuid.UUID, until: datetime) -> None:
+        # Everything between the watermark and the newest message that left the
+        # window is read back from the database, in batches; the watermark only
+        # moves past messages that are in the stored summary.
+        try:
+            while True:
+                pending = await self.store.load_unsummarized(session_id, until, SUMMARY_BATCH_MESSAGES)
+                if pending is None or not pending.turns:
+                    return
+                summary = await self.service.summarize(
+                    pending.summary, [turn.as_message() for turn in pending.turns], self.max_tokens
+                )
+                await self.store.save_summary(session_id, summary, pending.turns[-1].timestamp)
+                logger.debug("Folded %d message(s) into the summary of session %s", len(pending.turns), session_id)
+                if len(pending.turns) < SUMMARY_BATCH_MESSAGES:
+                    return
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Summarizing session %s failed, retrying on its next turn: %s", session_id, exc)
+
+    async def drain(self) -> None:
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+
+def _create_summarizer() -> ConversationSummarizer | None:
+    if not settings.conversation_summary_enabled:
+        return None
+    return ConversationSummarizer(message_store, openai_service, max_tokens=settings.conversation_summary_max_tokens)
+
+
+conversation_summarizer = _create_summarizer()
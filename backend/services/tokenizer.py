@@ -0,0 +1,54 @@
+import logging
+import math
+from functools import lru_cache
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Role and separator tokens the chat format adds to every message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    def __init__(self, model: str, cache_size: int = 8192) -> None:
+        self.model = model
+        self._encoding: Any = None
+        self._loaded = False
+        # Window turns are re-counted on every request, so counts are memoised per text.
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    def _load_encoding(self) -> Any:
+        self._loaded = True
+        try:
+            import tiktoken
+        except ImportError:
+            logger.warning("tiktoken is not installed, estimating token counts from text length.")
+            return None
+        try:
+            return tiktoken.encoding_for_model(self.model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception as exc:  # noqa: BLE001
+            # tiktoken downloads its BPE files on first use, which fails on offline hosts.
+            logger.warning("Could not load tokenizer for %s, estimating token counts: %s", self.model, exc)
+            return None
+
+    def _count(self, text: str) -> int:
+        if not self._loaded:
+            self._encoding = self._load_encoding()
+        if self._encoding is None:
+            return math.ceil(len(text) / 4)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count_message(self, message: dict[str, str]) -> int:
+        return self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def count_messages(self, messages: list[dict[str, str]]) -> int:
+        return sum(self.count_message(message) for message in messages)
+
+
+@lru_cache
+def token_counter(model: str) -> TokenCounter:
+    # One counter per model, so counts memoised by one component (e.g. the
+    # compiled practice prompts) are hits for all others.
+    return TokenCounter(model)
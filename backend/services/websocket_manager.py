@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import re
+import time
+import uuid
+from collections import deque
+from typing import Any, Coroutine
+
+from fastapi import WebSocket, status
+
+from ..metrics import registry, timed
+from ..serialization import dumps_text
+from ..settings import settings
+from ..tracing import tracer
+from .broadcast import BroadcastBackend, create_broadcast_backend
+from .ws_protocol import LEGACY, FrameProtocol
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ("drop", "coalesce", "disconnect")
+
+_FRAME_TYPE = re.compile(r'^\{\s*"type"\s*:\s*"([a-z_]+)"')
+
+BROADCAST_LATENCY = registry.histogram(
+    "ws_broadcast_duration_seconds", "Time to serialize and publish a WebSocket frame."
+)
+
+
+def _frame_type(message: str) -> str:
+    match = _FRAME_TYPE.match(message)
+    return match.group(1) if match else ""
+
+
+def _with_trace(payload: dict[str, Any]) -> dict[str, Any]:
+    # Clients can quote the trace id of a turn; it is appended so "type" stays first.
+    trace_id = tracer.current_trace_id()
+    return {**payload, "trace_id": trace_id} if trace_id is not None else payload
+
+
+class _Connection:
+    __slots__ = ("websocket", "protocol", "pending", "ready", "writer", "last_seen", "busy")
+
+    def __init__(self, websocket: WebSocket, protocol: FrameProtocol) -> None:
+        self.websocket = websocket
+        self.protocol = protocol
+        self.pending: deque[tuple[str, str | bytes]] = deque()
+        self.ready = asyncio.Event()
+        self.writer: asyncio.Task[None] | None = None
+        self.last_seen = time.monotonic()
+        # While a turn runs the endpoint does not read, so pongs wait unread.
+        self.busy = False
+
+
+class WebSocketManager:
+    def __init__(
+        self,
+        backend: BroadcastBackend | None = None,
+        queue_size: int = 64,
+        policy: str = "coalesce",
+        send_timeout: float = 10.0,
+        heartbeat_interval: float = 20.0,
+        idle_timeout: float = 60.0,
+    ) -> None:
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}")
+        self.connections: dict[uuid.UUID, dict[WebSocket, _Connection]] = {}
+        self.backend = backend or create_broadcast_backend()
+        self.queue_size = queue_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.stats: dict[str, int] = {
+            "frames_sent": 0,
+            "frames_dropped": 0,
+            "slow_consumers_disconnected": 0,
+            "idle_disconnected": 0,
+        }
+        self._background: set[asyncio.Task[Any]] = set()
+        self._heartbeat_task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        await self.backend.start(self._deliver)
+        self._heartbeat_task = asyncio.create_task(self._heartbeat(), name="ws-heartbeat")
+
+    async def stop(self) -> None:
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+        await self.backend.stop()
+        for session_id, session_connections in list(self.connections.items()):
+            for websocket in list(session_connections):
+                self.disconnect(session_id, websocket)
+
+    def queue_depth(self) -> int:
+        return sum(
+            len(connection.pending)
+            for session_connections in self.connections.values()
+            for connection in session_connections.values()
+        )
+
+    async def connect(self, session_id: uuid.UUID, websocket: WebSocket, protocol: FrameProtocol = LEGACY) -> None:
+        await websocket.accept(subprotocol=protocol.subprotocol)
+        connection = _Connection(websocket, protocol)
+        connection.writer = asyncio.create_task(self._write(session_id, connection))
+        first = session_id not in self.connections
+        self.connections.setdefault(session_id, {})[websocket] = connection
+        if first:
+            await self.backend.subscribe(session_id)
+        logger.debug("WebSocket connected for session %s", session_id)
+
+    def disconnect(self, session_id: uuid.UUID, websocket: WebSocket) -> None:
+        session_connections = self.connections.get(session_id)
+        if not session_connections:
+            return
+        connection = session_connections.pop(websocket, None)
+        if connection is not None and connection.writer is not None:
+            connection.writer.cancel()
+        if not session_connections:
+            self.connections.pop(session_id, None)
+            self._spawn(self._unsubscribe(session_id))
+        logger.debug("WebSocket disconnected for session %s", session_id)
+
+    async def release(self, session_id: uuid.UUID, websocket: WebSocket) -> None:
+        connection = self.connections.get(session_id, {}).get(websocket)
+        self.disconnect(session_id, websocket)
+        if connection is not None and connection.writer is not None:
+            await asyncio.gather(connection.writer, return_exceptions=True)
+
+    async def _unsubscribe(self, session_id: uuid.UUID) -> None:
+        # A socket may have joined the session again in the meantime.
+        if session_id not in self.connections:
+            await self.backend.unsubscribe(session_id)
+
+    @timed(BROADCAST_LATENCY)
+    async def broadcast(self, session_id: uuid.UUID, payload: dict[str, Any]) -> None:
+        # Encoded once per broadcast; every socket and worker shares the same text.
+        # ASGI text frames must be str, so the encoder's bytes are decoded once here.
+        message = dumps_text(_with_trace(payload))
+        if payload.get("type") == "assistant_delta":
+            # One span per token would drown the rest of the turn.
+            await self.backend.publish(session_id, message)
+            return
+        with tracer.span("broadcast", type=payload.get("type")) as span:
+            await self.backend.publish(session_id, message)
+            span.set(local_connections=len(self.connections.get(session_id, ())))
+
+    async def send(self, session_id: uuid.UUID, websocket: WebSocket, payload: dict[str, Any]) -> None:
+        connection = self.connections.get(session_id, {}).get(websocket)
+        if connection is not None:
+            message = dumps_text(_with_trace(payload))
+            self._enqueue(session_id, connection, _frame_type(message), connection.protocol.encode(message))
+
+    def touch(self, session_id: uuid.UUID, websocket: WebSocket, busy: bool = False) -> None:
+        connection = self.connections.get(session_id, {}).get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+            connection.busy = busy
+
+    async def _deliver(self, session_id: uuid.UUID, message: str) -> None:
+        # Only enqueues: the payload is serialized once and each socket's writer
+        # task sends it, so a slow client never blocks the publisher or its peers.
+        session_connections = self.connections.get(session_id)
+        if not session_connections:
+            return
+        frame_type = _frame_type(message)
+        # Re-encoded at most once per protocol in use (msgpack), not per socket.
+        encoded: dict[FrameProtocol, str | bytes] = {}
+        for connection in list(session_connections.values()):
+            protocol = connection.protocol
+            if protocol not in encoded:
+                encoded[protocol] = protocol.encode(message)
+            self._enqueue(session_id, connection, frame_type, encoded[protocol])
+
+    def _enqueue(
+        self, session_id: uuid.UUID, connection: _Connection, frame_type: str, message: str | bytes
+    ) -> None:
+        pending = connection.pending
+        if len(pending) >= self.queue_size:
+            if self.policy == "disconnect":
+                logger.warning("Disconnecting slow WebSocket consumer for session %s", session_id)
+                self.stats["slow_consumers_disconnected"] += 1
+                self.stats["frames_dropped"] += len(pending) + 1
+                self._evict(session_id, connection, status.WS_1013_TRY_AGAIN_LATER)
+                return
+            if self.policy == "coalesce":
+                # Deltas are superseded by the final assistant_message frame.
+                kept = deque(frame for frame in pending if frame[0] != "assistant_delta")
+                self.stats["frames_dropped"] += len(pending) - len(kept)
+                connection.pending = pending = kept
+            if len(pending) >= self.queue_size:
+                self.stats["frames_dropped"] += 1
+                return
+        pending.append((frame_type, message))
+        connection.ready.set()
+
+    def _evict(self, session_id: uuid.UUID, connection: _Connection, code: int) -> None:
+        self.disconnect(session_id, connection.websocket)
+        self._spawn(connection.websocket.close(code=code))
+
+    def _spawn(self, coroutine: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _heartbeat(self) -> None:
+        # Protocol version 2 clients answer every ping with a pong; one that has
+        # sent nothing for idle_timeout is half-open and gets evicted. Version 1
+        # clients only get the server's protocol-level pings.
+        ping = dumps_text({"type": "ping"})
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for session_id, session_connections in list(self.connections.items()):
+                for connection in list(session_connections.values()):
+                    if connection.protocol.version < 2:
+                        continue
+                    if not connection.busy and now - connection.last_seen > self.idle_timeout:
+                        logger.info("Evicting idle WebSocket for session %s", session_id)
+                        self.stats["idle_disconnected"] += 1
+                        self._evict(session_id, connection, status.WS_1001_GOING_AWAY)
+                    else:
+                        self._enqueue(session_id, connection, "ping", connection.protocol.encode(ping))
+
+    async def _write(self, session_id: uuid.UUID, connection: _Connection) -> None:
+        try:
+            while True:
+                if not connection.pending:
+                    connection.ready.clear()
+                    await connection.ready.wait()
+                    continue
+                _, message = connection.pending.popleft()
+                if isinstance(message, bytes):
+                    send = connection.websocket.send_bytes(message)
+                else:
+                    send = connection.websocket.send_text(message)
+                await asyncio.wait_for(send, timeout=self.send_timeout)
+                self.stats["frames_sent"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # noqa: BLE001
+            logger.exception("Failed to broadcast to session %s", session_id)
+            self.disconnect(session_id, connection.websocket)
+
+
+ws_manager = WebSocketManager(
+    queue_size=settings.ws_send_queue_size,
+    policy=settings.ws_backpressure_policy,
+    send_timeout=settings.ws_send_timeout_seconds,
+    heartbeat_interval=settings.ws_heartbeat_interval_seconds,
+    idle_timeout=settings.ws_idle_timeout_seconds,
+)
+
+registry.gauge(
+    "ws_connections",
+    "Open WebSocket connections on this worker.",
+    callback=lambda: sum(len(connections) for connections in ws_manager.connections.values()),
+)
+registry.gauge(
+    "ws_sessions", "Sessions with at least one open WebSocket.", callback=lambda: len(ws_manager.connections)
+)
+registry.gauge(
+    "ws_connections_per_session_max",
+    "Largest number of sockets attached to a single session.",
+    callback=lambda: max((len(connections) for connections in ws_manager.connections.values()), default=0),
+)
+registry.gauge(
+    "ws_send_queue_depth", "Frames waiting in per-connection send queues.", callback=ws_manager.queue_depth
+)
+registry.counter(
+    "ws_frames_total",
+    "WebSocket frames by outcome.",
+    ("outcome",),
+    callback=lambda: {(outcome,): count for outcome, count in ws_manager.stats.items()},
+)
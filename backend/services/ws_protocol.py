@@ -0,0 +1,72 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from ..serialization import loads
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 2
+
+# Frame types that only keep the connection alive; they are not rate limited.
+HEARTBEAT_FRAMES = ("ping", "pong")
+
+
+@dataclass(frozen=True)
+class FrameProtocol:
+    # Negotiated per socket through Sec-WebSocket-Protocol. Without a subprotocol
+    # the socket speaks version 1: JSON text frames, no hello and no heartbeat.
+    # Compression (permessage-deflate) is negotiated by the server underneath.
+    subprotocol: str | None
+    version: int
+    binary: bool
+    pack: Callable[[Any], bytes] | None = None
+    unpack: Callable[[bytes], Any] | None = None
+
+    def encode(self, message: str) -> str | bytes:
+        # Broadcasts arrive as JSON text, encoded once for all JSON sockets.
+        return self.pack(loads(message)) if self.pack is not None else message
+
+    def decode(self, frame: dict[str, Any]) -> Any:
+        if frame.get("bytes") is not None:
+            return self.unpack(frame["bytes"]) if self.unpack is not None else loads(frame["bytes"])
+        return loads(frame["text"])
+
+
+LEGACY = FrameProtocol(None, 1, binary=False)
+JSON_V2 = FrameProtocol("chat.v2.json", PROTOCOL_VERSION, binary=False)
+
+
+def _msgpack_protocol() -> FrameProtocol | None:
+    try:
+        import msgpack
+    except ImportError:
+        logger.info("msgpack is not installed, WebSocket clients cannot negotiate chat.v2.msgpack.")
+        return None
+    return FrameProtocol(
+        "chat.v2.msgpack",
+        PROTOCOL_VERSION,
+        binary=True,
+        pack=msgpack.packb,
+        unpack=lambda data: msgpack.unpackb(data, raw=False),
+    )
+
+
+PROTOCOLS = {protocol.subprotocol: protocol for protocol in (JSON_V2, _msgpack_protocol()) if protocol is not None}
+
+
+def negotiate(websocket: WebSocket) -> FrameProtocol:
+    # The client lists the subprotocols it speaks in order of preference.
+    for offered in websocket.scope.get("subprotocols", []):
+        if offered in PROTOCOLS:
+            return PROTOCOLS[offered]
+    return LEGACY
+
+
+async def receive_frame(websocket: WebSocket, protocol: FrameProtocol) -> Any:
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    return protocol.decode(message)
@@ -1,24 +1,206 @@
 from functools import lru_cache
-from typing import List
+from typing import Dict, List
 
 from pydantic import AnyHttpUrl, BaseSettings, Field, HttpUrl, validator
 
+DURABILITY_MODES = ("sync", "group", "buffered")
+DURABILITY_ENDPOINTS = ("rest", "stream", "async", "websocket")
+TRACING_EXPORTERS = ("console", "file")
+
+
+def _split_key_mapping(value: str, name: str) -> Dict[str, str]:
+    mapping = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        api_key, separator, practice_id = entry.strip().rpartition("=")
+        if not separator or not api_key or not practice_id:
+            raise ValueError(f"{name} expects entries like 'api-key=practice-id'")
+        mapping[api_key] = practice_id
+    return mapping
+
 
 class Settings(BaseSettings):
     environment: str = Field(default="development", env="ENVIRONMENT")
     debug: bool = Field(default=False, env="DEBUG")
     openai_api_key: str = Field(..., env="OPENAI_API_KEY")
+    broadcast_backend: str = Field(default="memory", env="BROADCAST_BACKEND")
+    redis_url: str = Field(default="redis://localhost:6379/0", env="REDIS_URL")
+    ws_send_queue_size: int = Field(default=64, env="WS_SEND_QUEUE_SIZE")
+    ws_backpressure_policy: str = Field(default="coalesce", env="WS_BACKPRESSURE_POLICY")
+    ws_send_timeout_seconds: float = Field(default=10.0, env="WS_SEND_TIMEOUT_SECONDS")
+    ws_heartbeat_interval_seconds: float = Field(default=20.0, env="WS_HEARTBEAT_INTERVAL_SECONDS")
+    ws_idle_timeout_seconds: float = Field(default=60.0, env="WS_IDLE_TIMEOUT_SECONDS")
+    ws_resume_max_messages: int = Field(default=200, env="WS_RESUME_MAX_MESSAGES")
+    ws_ping_interval_seconds: float = Field(default=20.0, env="WS_PING_INTERVAL_SECONDS")
+    ws_ping_timeout_seconds: float = Field(default=20.0, env="WS_PING_TIMEOUT_SECONDS")
+    ws_per_message_deflate: bool = Field(default=True, env="WS_PER_MESSAGE_DEFLATE")
+    generation_workers: int = Field(default=4, env="GENERATION_WORKERS")
+    generation_queue_backend: str = Field(default="memory", env="GENERATION_QUEUE_BACKEND")
+    generation_queue_path: str = Field(default="generation_jobs.db", env="GENERATION_QUEUE_PATH")
+    generation_queue_size: int = Field(default=1000, env="GENERATION_QUEUE_SIZE")
+    generation_max_attempts: int = Field(default=3, env="GENERATION_MAX_ATTEMPTS")
+    generation_retry_delay_seconds: float = Field(default=1.0, env="GENERATION_RETRY_DELAY_SECONDS")
+    generation_job_lease_seconds: float = Field(default=300.0, env="GENERATION_JOB_LEASE_SECONDS")
+    generation_job_retain_seconds: float = Field(default=3600.0, env="GENERATION_JOB_RETAIN_SECONDS")
+    openai_fake: bool = Field(default=False, env="OPENAI_FAKE")
+    openai_base_url: str | None = Field(default=None, env="OPENAI_BASE_URL")
+    openai_model: str = Field(default="gpt-4o-mini", env="OPENAI_MODEL")
+    openai_max_concurrency: int = Field(default=16, env="OPENAI_MAX_CONCURRENCY")
+    openai_tokens_per_minute: int = Field(default=200000, env="OPENAI_TOKENS_PER_MINUTE")
+    openai_max_retries: int = Field(default=4, env="OPENAI_MAX_RETRIES")
+    openai_backoff_base_seconds: float = Field(default=0.5, env="OPENAI_BACKOFF_BASE_SECONDS")
+    openai_backoff_max_seconds: float = Field(default=20.0, env="OPENAI_BACKOFF_MAX_SECONDS")
+    llm_secondary_base_url: str | None = Field(default=None, env="LLM_SECONDARY_BASE_URL")
+    llm_secondary_api_key: str | None = Field(default=None, env="LLM_SECONDARY_API_KEY")
+    llm_secondary_model: str | None = Field(default=None, env="LLM_SECONDARY_MODEL")
+    llm_hedge_enabled: bool = Field(default=False, env="LLM_HEDGE_ENABLED")
+    llm_hedge_percentile: float = Field(default=95.0, env="LLM_HEDGE_PERCENTILE")
+    llm_hedge_min_delay_seconds: float = Field(default=1.0, env="LLM_HEDGE_MIN_DELAY_SECONDS")
+    llm_timeout_seconds: float = Field(default=30.0, env="LLM_TIMEOUT_SECONDS")
+    llm_breaker_failures: int = Field(default=5, env="LLM_BREAKER_FAILURES")
+    llm_breaker_cooldown_seconds: float = Field(default=30.0, env="LLM_BREAKER_COOLDOWN_SECONDS")
+    local_model_path: str | None = Field(default=None, env="LOCAL_MODEL_PATH")
+    local_model_threads: int = Field(default=4, env="LOCAL_MODEL_THREADS")
+    local_model_context: int = Field(default=4096, env="LOCAL_MODEL_CONTEXT")
+    local_model_url: str | None = Field(default=None, env="LOCAL_MODEL_URL")
+    local_model_name: str = Field(default="local", env="LOCAL_MODEL_NAME")
+    local_model_concurrency: int = Field(default=1, env="LOCAL_MODEL_CONCURRENCY")
+    response_cache_enabled: bool = Field(default=True, env="RESPONSE_CACHE_ENABLED")
+    response_cache_ttl_seconds: float = Field(default=3600.0, env="RESPONSE_CACHE_TTL_SECONDS")
+    response_cache_max_entries: int = Field(default=1024, env="RESPONSE_CACHE_MAX_ENTRIES")
+    response_cache_min_query_length: int = Field(default=12, env="RESPONSE_CACHE_MIN_QUERY_LENGTH")
+    response_cache_semantic: bool = Field(default=False, env="RESPONSE_CACHE_SEMANTIC")
+    response_cache_similarity: float = Field(default=0.92, env="RESPONSE_CACHE_SIMILARITY")
+    intent_router_enabled: bool = Field(default=True, env="INTENT_ROUTER_ENABLED")
+    intent_router_min_confidence: float = Field(default=0.75, env="INTENT_ROUTER_MIN_CONFIDENCE")
+    intent_templates_path: str | None = Field(default=None, env="INTENT_TEMPLATES_PATH")
+    embedding_model: str = Field(default="text-embedding-3-small", env="EMBEDDING_MODEL")
     database_url: str = Field(..., env="DATABASE_URL")
+    host: str = Field(default="0.0.0.0", env="HOST")
     port: int = Field(default=8000, env="PORT")
+    web_concurrency: int = Field(default=1, env="WEB_CONCURRENCY")
     cors_origins: str = Field(default="http://localhost:3000", env="CORS_ORIGINS")
     api_key: str = Field(..., env="API_KEY")
+    practices_dir: str | None = Field(default=None, env="PRACTICES_DIR")
+    default_practice: str = Field(default="orchideenkamp", env="DEFAULT_PRACTICE")
+    practice_api_keys: str = Field(default="", env="PRACTICE_API_KEYS")
+    staff_api_keys: str = Field(default="", env="STAFF_API_KEYS")
     enforce_https: bool = Field(default=True, env="ENFORCE_HTTPS")
+    rate_limit_enabled: bool = Field(default=True, env="RATE_LIMIT_ENABLED")
+    rate_limit_backend: str = Field(default="memory", env="RATE_LIMIT_BACKEND")
+    rate_limit_session_turns: str = Field(default="20/minute", env="RATE_LIMIT_SESSION_TURNS")
+    rate_limit_websocket_messages: str = Field(default="20/minute", env="RATE_LIMIT_WEBSOCKET_MESSAGES")
+    trusted_proxies: str = Field(default="127.0.0.1,::1", env="TRUSTED_PROXIES")
     sqlalchemy_echo: bool = Field(default=False, env="SQLALCHEMY_ECHO")
+    metrics_enabled: bool = Field(default=True, env="METRICS_ENABLED")
+    json_serializer: str = Field(default="auto", env="JSON_SERIALIZER")
+    tracing_enabled: bool = Field(default=False, env="TRACING_ENABLED")
+    tracing_sample_ratio: float = Field(default=1.0, env="TRACING_SAMPLE_RATIO")
+    tracing_exporter: str = Field(default="console", env="TRACING_EXPORTER")
+    tracing_file: str = Field(default="traces.jsonl", env="TRACING_FILE")
+    admission_enabled: bool = Field(default=True, env="ADMISSION_ENABLED")
+    admission_max_in_flight: int = Field(default=32, env="ADMISSION_MAX_IN_FLIGHT")
+    admission_max_queue: int = Field(default=64, env="ADMISSION_MAX_QUEUE")
+    admission_max_queue_wait_seconds: float = Field(default=5.0, env="ADMISSION_MAX_QUEUE_WAIT_SECONDS")
+    admission_target_latency_seconds: float = Field(default=12.0, env="ADMISSION_TARGET_LATENCY_SECONDS")
+    admission_max_loop_lag_seconds: float = Field(default=0.25, env="ADMISSION_MAX_LOOP_LAG_SECONDS")
+    db_pool_size: int = Field(default=10, env="DB_POOL_SIZE")
+    db_max_overflow: int = Field(default=10, env="DB_MAX_OVERFLOW")
+    db_pool_timeout_seconds: float = Field(default=10.0, env="DB_POOL_TIMEOUT_SECONDS")
+    db_pool_recycle_seconds: int = Field(default=1800, env="DB_POOL_RECYCLE_SECONDS")
+    db_pool_pre_ping: bool = Field(default=True, env="DB_POOL_PRE_PING")
+    db_statement_cache_size: int = Field(default=100, env="DB_STATEMENT_CACHE_SIZE")
+    db_pool_warm_connections: int = Field(default=2, env="DB_POOL_WARM_CONNECTIONS")
+    db_migrate_on_start: bool = Field(default=True, env="DB_MIGRATE_ON_START")
+    message_durability: str = Field(default="sync", env="MESSAGE_DURABILITY")
+    message_durability_endpoints: str = Field(default="", env="MESSAGE_DURABILITY_ENDPOINTS")
+    message_flush_batch_size: int = Field(default=100, env="MESSAGE_FLUSH_BATCH_SIZE")
+    message_flush_interval_seconds: float = Field(default=0.01, env="MESSAGE_FLUSH_INTERVAL_SECONDS")
+    message_buffer_max: int = Field(default=5000, env="MESSAGE_BUFFER_MAX")
+    conversation_cache_enabled: bool = Field(default=True, env="CONVERSATION_CACHE_ENABLED")
+    conversation_cache_window: int = Field(default=10, env="CONVERSATION_CACHE_WINDOW")
+    conversation_cache_max_sessions: int = Field(default=5000, env="CONVERSATION_CACHE_MAX_SESSIONS")
+    conversation_cache_idle_seconds: float = Field(default=1800.0, env="CONVERSATION_CACHE_IDLE_SECONDS")
+    context_token_budget: int = Field(default=1500, env="CONTEXT_TOKEN_BUDGET")
+    context_max_messages: int = Field(default=20, env="CONTEXT_MAX_MESSAGES")
+    conversation_summary_enabled: bool = Field(default=True, env="CONVERSATION_SUMMARY_ENABLED")
+    conversation_summary_max_tokens: int = Field(default=300, env="CONVERSATION_SUMMARY_MAX_TOKENS")
+    retention_enabled: bool = Field(default=False, env="RETENTION_ENABLED")
+    retention_days: int = Field(default=365, env="RETENTION_DAYS")
+    retention_batch_size: int = Field(default=200, env="RETENTION_BATCH_SIZE")
+    retention_batch_pause_seconds: float = Field(default=0.5, env="RETENTION_BATCH_PAUSE_SECONDS")
+    retention_interval_seconds: float = Field(default=86400.0, env="RETENTION_INTERVAL_SECONDS")
+    retention_archive_dir: str | None = Field(default=None, env="RETENTION_ARCHIVE_DIR")
+
+    @validator("web_concurrency")
+    def check_web_concurrency(cls, value: int, values: dict) -> int:
+        # Each worker would have its own in-memory queue; GET /api/chat/jobs/{id}
+        # only finds the job if it lands on the worker that queued it.
+        if value > 1 and values.get("generation_queue_backend") == "memory":
+            raise ValueError("WEB_CONCURRENCY > 1 needs GENERATION_QUEUE_BACKEND=sqlite")
+        return value
 
     @validator("cors_origins")
     def split_origins(cls, value: str) -> List[str]:
         return [origin.strip() for origin in value.split(",") if origin.strip()]
 
+    @validator("trusted_proxies")
+    def split_proxies(cls, value: str) -> List[str]:
+        return [proxy.strip() for proxy in value.split(",") if proxy.strip()]
+
+    @validator("practice_api_keys")
+    def split_practice_api_keys(cls, value: str) -> Dict[str, str]:
+        return _split_key_mapping(value, "PRACTICE_API_KEYS")
+
+    @validator("staff_api_keys")
+    def split_staff_api_keys(cls, value: str, values: dict) -> Dict[str, str]:
+        mapping = _split_key_mapping(value, "STAFF_API_KEYS")
+        # Practice keys ship in the public frontend bundle; a staff key must never be one of them.
+        public_keys = {values.get("api_key"), *values.get("practice_api_keys", {})}
+        if public_keys.intersection(mapping):
+            raise ValueError("STAFF_API_KEYS must not reuse API_KEY or a key from PRACTICE_API_KEYS")
+        return mapping
+
+    @validator("message_durability")
+    def check_message_durability(cls, value: str) -> str:
+        if value not in DURABILITY_MODES:
+            raise ValueError(f"MESSAGE_DURABILITY must be one of {', '.join(DURABILITY_MODES)}")
+        return value
+
+    @validator("message_durability_endpoints")
+    def split_message_durability_endpoints(cls, value: str) -> Dict[str, str]:
+        mapping = {}
+        for entry in value.split(","):
+            if not entry.strip():
+                continue
+            endpoint, separator, mode = entry.strip().partition("=")
+            if not separator or endpoint.strip() not in DURABILITY_ENDPOINTS or mode.strip() not in DURABILITY_MODES:
+                raise ValueError(
+                    "MESSAGE_DURABILITY_ENDPOINTS expects entries like 'websocket=buffered' with endpoints "
+                    f"{', '.join(DURABILITY_ENDPOINTS)} and modes {', '.join(DURABILITY_MODES)}"
+                )
+            mapping[endpoint.strip()] = mode.strip()
+        return mapping
+
+    @validator("tracing_sample_ratio")
+    def check_tracing_sample_ratio(cls, value: float) -> float:
+        if not 0.0 <= value <= 1.0:
+            raise ValueError("TRACING_SAMPLE_RATIO must be between 0 and 1")
+        return value
+
+    @validator("tracing_exporter")
+    def check_tracing_exporter(cls, value: str) -> str:
+        if value not in TRACING_EXPORTERS:
+            raise ValueError(f"TRACING_EXPORTER must be one of {', '.join(TRACING_EXPORTERS)}")
+        return value
+
+    @validator("admission_max_in_flight")
+    def check_admission_max_in_flight(cls, value: int) -> int:
+        if value < 1:
+            raise ValueError("ADMISSION_MAX_IN_FLIGHT must be at least 1")
+        return value
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,340 @@
+import functools
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator, TypeVar
+
+from .serialization import dumps
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+SERVICE_NAME = "medical-chatbot"
+# W3C Trace Context: version-trace_id-parent_id-flags.
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    # Unsampled spans still carry ids for logs and frames, but record nothing.
+    sampled: bool
+    attributes: dict[str, Any] = field(default_factory=dict)
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int | None = None
+    error: str | None = None
+
+    def set(self, **attributes: Any) -> None:
+        if self.sampled:
+            self.attributes.update(attributes)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": SERVICE_NAME,
+            "pid": os.getpid(),
+            "start_ns": self.start_ns,
+            "duration_ms": round(((self.end_ns or self.start_ns) - self.start_ns) / 1e6, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+# Handed out while tracing is disabled; set() on it does nothing.
+NOOP_SPAN = Span("", "", "", None, sampled=False)
+
+_current: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class ConsoleExporter:
+    def export(self, span: Span) -> None:
+        attributes = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+        logger.info(
+            "span %s %.1f ms trace=%s span=%s parent=%s %s%s",
+            span.name,
+            ((span.end_ns or span.start_ns) - span.start_ns) / 1e6,
+            span.trace_id,
+            span.span_id,
+            span.parent_id or "-",
+            attributes,
+            f" error={span.error}" if span.error else "",
+        )
+
+    def shutdown(self) -> None:
+        return None
+
+
+class JsonlExporter:
+    # One JSON object per span and line, appended by a background thread so the
+    # event loop never waits on the disk. Each batch is a single write on an
+    # O_APPEND file, so worker processes can share the file.
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._queue: queue.SimpleQueue[bytes | None] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._pid = 0
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        # Started on first use in each process: a thread does not survive a fork.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+        self._queue.put(dumps(span.to_dict()) + b"\n")
+
+    def _run(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab", buffering=0) as output:
+            while True:
+                line = self._queue.get()
+                lines = [line]
+                while line is not None and not self._queue.empty():
+                    line = self._queue.get()
+                    lines.append(line)
+                output.write(b"".join(item for item in lines if item is not None))
+                if line is None:
+                    return
+
+    def shutdown(self) -> None:
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+            self._pid = 0
+
+
+class Tracer:
+    def __init__(self, enabled: bool, sample_ratio: float = 1.0, exporter: Any = None) -> None:
+        self.enabled = enabled
+        self.sample_ratio = sample_ratio
+        self.exporter = exporter
+
+    @staticmethod
+    def current() -> Span:
+        # Safe to call set() on, with or without an active span.
+        return _current.get() or NOOP_SPAN
+
+    def current_trace_id(self) -> str | None:
+        span = _current.get()
+        return span.trace_id if span is not None else None
+
+    def traceparent(self) -> str | None:
+        # For work that continues outside this task, e.g. a queued generation job.
+        span = _current.get()
+        return span.traceparent if span is not None else None
+
+    def start(self, name: str, parent: Span | str | None = None, **attributes: Any) -> Span:
+        # Starts a span without making it current; end it with end(). `parent`
+        # is a span or a traceparent header, by default the current span.
+        if not self.enabled:
+            return NOOP_SPAN
+        if isinstance(parent, str):
+            parent = _parse_traceparent(parent)
+        parent = parent or _current.get()
+        if parent is None:
+            trace_id = f"{random.getrandbits(128):032x}"
+            sampled = random.random() < self.sample_ratio
+        else:
+            trace_id, sampled = parent.trace_id, parent.sampled
+        return Span(
+            name,
+            trace_id,
+            f"{random.getrandbits(64):016x}",
+            parent.span_id if parent is not None else None,
+            sampled,
+            attributes if sampled else {},
+        )
+
+    def end(self, span: Span, error: BaseException | None = None) -> None:
+        if not span.sampled or span.end_ns is not None:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        try:
+            self.exporter.export(span)
+        except Exception:  # noqa: BLE001
+            logger.exception("Exporting span %s failed.", span.name)
+
+    @contextmanager
+    def span(self, name: str, parent: Span | str | None = None, **attributes: Any) -> Iterator[Span]:
+        # The span is current inside the block. Do not hold it across a `yield`
+        # of an async generator: those steps run in the consumer's context.
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        span = self.start(name, parent, **attributes)
+        token = _current.set(span)
+        error: BaseException | None = None
+        try:
+            yield span
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            _current.reset(token)
+            self.end(span, error)
+
+    def shutdown(self) -> None:
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+
+def _parse_traceparent(header: str) -> Span | None:
+    match = _TRACEPARENT.match(header.strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    trace_id, span_id, flags = match.groups()
+    return Span("", trace_id, span_id, None, sampled=bool(int(flags, 16) & 1))
+
+
+def traced(name: str, **attributes: Any) -> Callable[[F], F]:
+    # For coroutine functions; like metrics.timed, a no-op when tracing is off.
+    def decorator(func: F) -> F:
+        if not tracer.enabled:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with tracer.span(name, **attributes):
+                return await func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+class TraceLogFilter(logging.Filter):
+    # Adds `trace` to every record so log lines can be matched to their spans.
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = _current.get()
+        record.trace = f"trace={span.trace_id} span={span.span_id} " if span is not None else ""
+        return True
+
+
+class TracingMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware, so the span also covers
+    # streamed response bodies (SSE, NDJSON exports).
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1") or None
+        status_code = 500
+
+        with tracer.span(f"HTTP {scope['method']}", traceparent, method=scope["method"]) as span:
+
+            async def send_with_trace(message: dict[str, Any]) -> None:
+                nonlocal status_code
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+                    message["headers"] = [*message.get("headers", []), (b"x-trace-id", span.trace_id.encode("ascii"))]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                # The route template keeps span names bounded (no session ids).
+                route = getattr(scope.get("route"), "path", "unmatched")
+                span.name = f"HTTP {scope['method']} {route}"
+                span.set(route=route, status=status_code)
+
+
+def _create_exporter() -> Any:
+    if settings.tracing_exporter == "file":
+        return JsonlExporter(settings.tracing_file)
+    return ConsoleExporter()
+
+
+tracer = Tracer(
+    settings.tracing_enabled,
+    settings.tracing_sample_ratio,
+    _create_exporter() if settings.tracing_enabled else None,
+)
+
+
+def _print_trace(spans: list[dict[str, Any]]) -> None:
+    children: dict[str | None, list[dict[str, Any]]] = {}
+    ids = {span["span_id"] for span in spans}
+    for span in sorted(spans, key=lambda item: item["start_ns"]):
+        # Spans whose parent is in another service (or was not sampled) are roots here.
+        children.setdefault(span["parent_id"] if span["parent_id"] in ids else None, []).append(span)
+    origin = min(span["start_ns"] for span in spans)
+
+    def walk(parent: str | None, depth: int) -> None:
+        for span in children.get(parent, []):
+            attributes = " ".join(f"{key}={value}" for key, value in span["attributes"].items())
+            offset = (span["start_ns"] - origin) / 1e6
+            marker = " !" if span["status"] == "error" else ""
+            print(f"{offset:9.1f} {span['duration_ms']:9.1f}  {'  ' * depth}{span['name']}{marker}  {attributes}")
+            walk(span["span_id"], depth + 1)
+
+    print(f"trace {spans[0]['trace_id']}   (start ms, duration ms)")
+    walk(None, 0)
+
+
+def inspect_file(path: str, trace_id: str | None, slowest: int) -> int:
+    from .serialization import loads
+
+    traces: dict[str, list[dict[str, Any]]] = {}
+    with open(path, "rb") as source:
+        for line in source:
+            if line.strip():
+                span = loads(line)
+                traces.setdefault(span["trace_id"], []).append(span)
+    if trace_id is not None:
+        if trace_id not in traces:
+            print(f"Trace {trace_id} not found in {path}.")
+            return 1
+        _print_trace(traces[trace_id])
+        return 0
+
+    def duration(spans: list[dict[str, Any]]) -> float:
+        return max(span["start_ns"] / 1e6 + span["duration_ms"] for span in spans) - min(
+            span["start_ns"] / 1e6 for span in spans
+        )
+
+    for spans in sorted(traces.values(), key=duration, reverse=True)[:slowest]:
+        _print_trace(spans)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Show traces written with TRACING_EXPORTER=file.")
+    parser.add_argument("path", nargs="?", default=settings.tracing_file)
+    parser.add_argument("--trace", default=None, help="show this trace id only")
+    parser.add_argument("--slowest", type=int, default=5, help="show the N slowest traces")
+    args = parser.parse_args()
+    sys.exit(inspect_file(args.path, args.trace, args.slowest))
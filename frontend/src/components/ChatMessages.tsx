@@ -1,5 +1,5 @@
 import DOMPurify from 'dompurify';
-import { useEffect, useRef } from 'react';
+import { useLayoutEffect, useRef } from 'react';
 import type { ChatMessage } from '../types/chat';
 import { LinkCard } from './LinkCard';
 
@@ -7,22 +7,62 @@ interface ChatMessagesProps {
   messages: ChatMessage[];
   isTyping: boolean;
   onLinkSelect?: (payload: { action?: string; title: string }) => void;
+  hasMoreHistory?: boolean;
+  isLoadingHistory?: boolean;
+  onLoadOlder?: () => void;
 }
 
+const LOAD_OLDER_THRESHOLD_PX = 48;
+
 const sanitize = (html: string) => ({
   __html: DOMPurify.sanitize(html, { ALLOWED_TAGS: ['strong', 'em', 'br', 'ul', 'ol', 'li', 'p', 'a'] })
 });
 
-export const ChatMessages = ({ messages, isTyping, onLinkSelect }: ChatMessagesProps) => {
+export const ChatMessages = ({
+  messages,
+  isTyping,
+  onLinkSelect,
+  hasMoreHistory = false,
+  isLoadingHistory = false,
+  onLoadOlder
+}: ChatMessagesProps) => {
   const containerRef = useRef<HTMLDivElement | null>(null);
+  const firstMessageIdRef = useRef<string | undefined>(undefined);
+  const scrollHeightRef = useRef(0);
 
-  useEffect(() => {
-    if (!containerRef.current) return;
-    containerRef.current.scrollTop = containerRef.current.scrollHeight;
+  useLayoutEffect(() => {
+    const container = containerRef.current;
+    if (!container) return;
+    const firstMessageId = messages[0]?.id;
+    const prepended =
+      firstMessageIdRef.current !== undefined &&
+      firstMessageId !== firstMessageIdRef.current &&
+      messages.some((message) => message.id === firstMessageIdRef.current);
+    if (prepended) {
+      // Keep the message the user was looking at in place after older ones were inserted above it.
+      container.scrollTop += container.scrollHeight - scrollHeightRef.current;
+    } else {
+      container.scrollTop = container.scrollHeight;
+    }
+    firstMessageIdRef.current = firstMessageId;
+    scrollHeightRef.current = container.scrollHeight;
   }, [messages, isTyping]);
 
+  const handleScroll = () => {
+    const container = containerRef.current;
+    if (!container) return;
+    scrollHeightRef.current = container.scrollHeight;
+    if (container.scrollTop < LOAD_OLDER_THRESHOLD_PX && hasMoreHistory && !isLoadingHistory) {
+      onLoadOlder?.();
+    }
+  };
+
   return (
-    <div ref={containerRef} className="flex-1 overflow-y-auto bg-slate-50 px-5 py-6">
+    <div ref={containerRef} onScroll={handleScroll} className="flex-1 overflow-y-auto bg-slate-50 px-5 py-6">
+      {isLoadingHistory ? (
+        <div className="mb-4 text-center text-xs text-slate-400">Ältere Nachrichten werden geladen …</div>
+      ) : null}
+
       {messages.map((message) => {
         const isAssistant = message.role === 'assistant';
         return (
@@ -17,7 +17,10 @@ export const ChatWidget = () => {
     quickReplies,
     socketStatus,
     handleLinkAction,
-    resetChat
+    resetChat,
+    hasMoreHistory,
+    isLoadingHistory,
+    loadOlderMessages
   } = useChat();
   const [inputValue, setInputValue] = useState('');
   const inputRef = useRef<HTMLInputElement | null>(null);
@@ -93,7 +96,14 @@ export const ChatWidget = () => {
           </div>
         </header>
 
-        <ChatMessages messages={messages} isTyping={isTyping || isLoading} onLinkSelect={handleLinkAction} />
+        <ChatMessages
+          messages={messages}
+          isTyping={isTyping || isLoading}
+          onLinkSelect={handleLinkAction}
+          hasMoreHistory={hasMoreHistory}
+          isLoadingHistory={isLoadingHistory}
+          onLoadOlder={loadOlderMessages}
+        />
 
         {error ? (
           <div className="bg-red-50 px-5 py-2 text-xs text-red-600">{error}</div>
@@ -7,6 +7,9 @@ export interface ResponseTemplate {
   quickReplies?: string[];
 }
 
+// The backend's intent router answers typed questions with the same texts from
+// backend/data/intents.json. Change both; `python -m backend.services.intent_router`
+// reports entries that differ.
 export const responses: Record<string, ResponseTemplate> = {
   'termin vereinbaren': {
     text: 'Gerne unterstützen wir Sie bei der Terminvereinbarung in der Hausarztpraxis Orchideenkamp.',
@@ -1,4 +1,5 @@
 import { useCallback, useEffect, useMemo, useRef, useState } from 'react';
+import { isAxiosError } from 'axios';
 import type { ChatMessage, QuickReplyOption } from '../types/chat';
 import { API_KEY, BACKEND_BASE_URL, createSession, fetchHistory, sendMessage as sendMessageApi } from '../services/api';
 import { DEFAULT_QUICK_REPLY_LABELS, responses } from '../data/responses';
@@ -32,6 +33,9 @@ const mapQuickReplies = (labels?: string[]): QuickReplyOption[] => {
 
 type WebSocketStatus = 'idle' | 'connecting' | 'open' | 'closed';
 
+// Version 2 of the socket protocol: hello/ping/pong frames and resumption via last_message_id.
+const WS_SUBPROTOCOL = 'chat.v2.json';
+
 const parseAssistantMessage = (message: ChatMessage): ChatMessage => {
   const containsHtml = /<[^>]+>/.test(message.content);
   return {
@@ -65,10 +69,16 @@ export const useChat = () => {
   const [isLoading, setIsLoading] = useState(true);
   const [socketStatus, setSocketStatus] = useState<WebSocketStatus>('idle');
   const [quickRepliesState, setQuickRepliesState] = useState<QuickReplyOption[]>(mapQuickReplies());
+  const [hasMoreHistory, setHasMoreHistory] = useState(false);
+  const [isLoadingHistory, setIsLoadingHistory] = useState(false);
 
   const wsRef = useRef<WebSocket | null>(null);
   const reconnectTimeoutRef = useRef<number | null>(null);
   const messageIdsRef = useRef<Set<string>>(new Set());
+  const historyCursorRef = useRef<string | null>(null);
+  // Last message known to the server; a reconnect asks only for what came after it.
+  const lastServerMessageIdRef = useRef<string | null>(null);
+  const idleTimeoutRef = useRef<number | null>(null);
 
   const addMessage = useCallback((message: ChatMessage) => {
     setMessages((prev) => {
@@ -84,6 +94,63 @@ export const useChat = () => {
     });
   }, []);
 
+  const upsertMessage = useCallback((message: ChatMessage) => {
+    setMessages((prev) => {
+      const index = prev.findIndex((existing) => existing.id === message.id);
+      if (index === -1) {
+        messageIdsRef.current.add(message.id);
+        const nextMessages = [...prev, message];
+        if (nextMessages.length > 200) {
+          nextMessages.shift();
+        }
+        return nextMessages;
+      }
+      const nextMessages = [...prev];
+      nextMessages[index] = message;
+      return nextMessages;
+    });
+  }, []);
+
+  const prependMessages = useCallback((older: ChatMessage[]) => {
+    setMessages((prev) => {
+      // Older pages are only loaded on request, so they are not subject to the 200-message cap.
+      const fresh = older.filter((message) => !messageIdsRef.current.has(message.id));
+      fresh.forEach((message) => messageIdsRef.current.add(message.id));
+      return fresh.length ? [...fresh, ...prev] : prev;
+    });
+  }, []);
+
+  const appendDelta = useCallback((id: string, delta: string) => {
+    setMessages((prev) => {
+      const index = prev.findIndex((existing) => existing.id === id);
+      if (index === -1) {
+        messageIdsRef.current.add(id);
+        return [...prev, { id, role: 'assistant', content: delta, timestamp: new Date().toISOString() }];
+      }
+      const nextMessages = [...prev];
+      nextMessages[index] = { ...nextMessages[index], content: nextMessages[index].content + delta };
+      return nextMessages;
+    });
+  }, []);
+
+  const resyncHistory = useCallback(
+    async (id: string) => {
+      // The gap since the last known message could not be replayed; the latest
+      // page fills it, messages already shown are skipped by their id.
+      try {
+        const page = await fetchHistory(id);
+        page.messages.forEach((message) => addMessage(parseAssistantMessage(message)));
+        const last = page.messages[page.messages.length - 1];
+        if (last) {
+          lastServerMessageIdRef.current = last.id;
+        }
+      } catch (err) {
+        console.error('Fehler beim Nachladen der Historie', err);
+      }
+    },
+    [addMessage]
+  );
+
   const setupWebSocket = useCallback(
     (id: string) => {
       if (wsRef.current?.readyState === WebSocket.OPEN) {
@@ -95,10 +162,24 @@ export const useChat = () => {
         const wsUrl = new URL(`/api/chat/ws/${id}`, BACKEND_BASE_URL);
         wsUrl.protocol = wsUrl.protocol.replace('http', 'ws');
         wsUrl.searchParams.set('api_key', API_KEY);
+        if (lastServerMessageIdRef.current) {
+          wsUrl.searchParams.set('last_message_id', lastServerMessageIdRef.current);
+        }
 
-        const socket = new WebSocket(wsUrl.toString());
+        const socket = new WebSocket(wsUrl.toString(), [WS_SUBPROTOCOL]);
         wsRef.current = socket;
 
+        let idleTimeoutMs: number | null = null;
+        const resetIdleTimer = () => {
+          if (idleTimeoutRef.current) {
+            window.clearTimeout(idleTimeoutRef.current);
+          }
+          if (idleTimeoutMs !== null) {
+            // The server pings regularly; silence means the connection is dead.
+            idleTimeoutRef.current = window.setTimeout(() => socket.close(), idleTimeoutMs);
+          }
+        };
+
         socket.onopen = () => {
           setSocketStatus('open');
           setError(null);
@@ -106,6 +187,9 @@ export const useChat = () => {
 
         socket.onclose = () => {
           setSocketStatus('closed');
+          if (idleTimeoutRef.current) {
+            window.clearTimeout(idleTimeoutRef.current);
+          }
           if (reconnectTimeoutRef.current) {
             window.clearTimeout(reconnectTimeoutRef.current);
           }
@@ -120,16 +204,28 @@ export const useChat = () => {
         };
 
         socket.onmessage = (event) => {
+          resetIdleTimer();
           try {
             const payload = JSON.parse(event.data);
-            if (payload.type === 'assistant_message' && payload.message) {
+            if (payload.type === 'ping') {
+              socket.send(JSON.stringify({ type: 'pong' }));
+            } else if (payload.type === 'hello') {
+              idleTimeoutMs = payload.idle_timeout * 1000;
+              resetIdleTimer();
+            } else if (payload.type === 'resync') {
+              void resyncHistory(id);
+            } else if (payload.type === 'assistant_delta' && payload.message_id) {
+              appendDelta(payload.message_id, payload.delta ?? '');
+              setIsTyping(false);
+            } else if (payload.type === 'assistant_message' && payload.message) {
               const message: ChatMessage = parseAssistantMessage({
                 id: payload.message.message_id,
                 role: payload.message.role,
                 content: payload.message.content,
                 timestamp: payload.message.timestamp
               });
-              addMessage(message);
+              upsertMessage(message);
+              lastServerMessageIdRef.current = message.id;
               setIsTyping(false);
               setQuickRepliesState(mapQuickReplies());
             } else if (payload.type === 'user_message' && payload.message) {
@@ -140,6 +236,7 @@ export const useChat = () => {
                 timestamp: payload.message.timestamp
               };
               addMessage(message);
+              lastServerMessageIdRef.current = message.id;
             } else if (payload.type === 'error') {
               setError(payload.message ?? 'Unbekannter Fehler');
               setIsTyping(false);
@@ -153,7 +250,7 @@ export const useChat = () => {
         setSocketStatus('closed');
       }
     },
-    [addMessage]
+    [addMessage, appendDelta, resyncHistory, upsertMessage]
   );
 
   const initialise = useCallback(async () => {
@@ -163,7 +260,9 @@ export const useChat = () => {
       setSessionId(session.session_id);
 
       const history = await fetchHistory(session.session_id);
-      if (history.length === 0) {
+      historyCursorRef.current = history.beforeCursor;
+      setHasMoreHistory(history.hasMore);
+      if (history.messages.length === 0) {
         addMessage({
           id: getRandomId(),
           role: 'assistant',
@@ -171,7 +270,8 @@ export const useChat = () => {
           timestamp: new Date().toISOString()
         });
       } else {
-        history.forEach((message) => addMessage(parseAssistantMessage(message)));
+        history.messages.forEach((message) => addMessage(parseAssistantMessage(message)));
+        lastServerMessageIdRef.current = history.messages[history.messages.length - 1].id;
       }
 
       setupWebSocket(session.session_id);
@@ -184,6 +284,22 @@ export const useChat = () => {
     }
   }, [addMessage, setupWebSocket]);
 
+  const loadOlderMessages = useCallback(async () => {
+    if (!sessionId || !hasMoreHistory || isLoadingHistory) return;
+    try {
+      setIsLoadingHistory(true);
+      const page = await fetchHistory(sessionId, { before: historyCursorRef.current });
+      historyCursorRef.current = page.beforeCursor ?? historyCursorRef.current;
+      setHasMoreHistory(page.hasMore);
+      prependMessages(page.messages.map(parseAssistantMessage));
+    } catch (err) {
+      console.error('Fehler beim Laden älterer Nachrichten', err);
+      setError('Ältere Nachrichten konnten nicht geladen werden.');
+    } finally {
+      setIsLoadingHistory(false);
+    }
+  }, [hasMoreHistory, isLoadingHistory, prependMessages, sessionId]);
+
   useEffect(() => {
     initialise();
 
@@ -194,6 +310,9 @@ export const useChat = () => {
       if (reconnectTimeoutRef.current) {
         window.clearTimeout(reconnectTimeoutRef.current);
       }
+      if (idleTimeoutRef.current) {
+        window.clearTimeout(idleTimeoutRef.current);
+      }
     };
   }, [initialise]);
 
@@ -244,7 +363,7 @@ export const useChat = () => {
       const activeSocket = wsRef.current && wsRef.current.readyState === WebSocket.OPEN;
 
       if (activeSocket) {
-        wsRef.current?.send(JSON.stringify({ content: trimmed }));
+        wsRef.current?.send(JSON.stringify({ type: 'message', content: trimmed, stream: true }));
         return;
       }
 
@@ -266,10 +385,16 @@ export const useChat = () => {
           timestamp: response.timestamp
         });
         addMessage(assistantMessage);
+        lastServerMessageIdRef.current = assistantMessage.id;
         setQuickRepliesState(mapQuickReplies());
       } catch (err) {
         console.error('Fehler beim Senden der Nachricht', err);
-        setError('Nachricht konnte nicht gesendet werden. Bitte versuchen Sie es erneut.');
+        // 503: the backend sheds load and names the reason in `detail`.
+        setError(
+          isAxiosError(err) && err.response?.status === 503 && err.response.data?.detail
+            ? err.response.data.detail
+            : 'Nachricht konnte nicht gesendet werden. Bitte versuchen Sie es erneut.'
+        );
       } finally {
         setIsTyping(false);
       }
@@ -304,6 +429,8 @@ export const useChat = () => {
   const resetChat = useCallback(() => {
     setMessages([]);
     messageIdsRef.current.clear();
+    historyCursorRef.current = null;
+    setHasMoreHistory(false);
     setQuickRepliesState(mapQuickReplies());
     setError(null);
     setIsTyping(false);
@@ -327,7 +454,10 @@ export const useChat = () => {
     sessionId,
     socketStatus,
     handleLinkAction,
-    resetChat
+    resetChat,
+    hasMoreHistory,
+    isLoadingHistory,
+    loadOlderMessages
   };
 };
 
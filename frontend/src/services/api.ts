@@ -42,15 +42,41 @@ export const sendMessage = async (
   return data;
 };
 
-export const fetchHistory = async (sessionId: string): Promise<ChatMessage[]> => {
-  const { data } = await apiClient.get<{ session_id: string; messages: MessageResponse[] }>(
-    `/api/chat/history/${sessionId}`
-  );
-
-  return data.messages.map((message) => ({
-    id: message.message_id,
-    role: message.role,
-    content: message.content,
-    timestamp: message.timestamp
-  }));
+export interface HistoryResponse {
+  session_id: string;
+  messages: MessageResponse[];
+  has_more: boolean;
+  before_cursor: string | null;
+  after_cursor: string | null;
+}
+
+export interface HistoryPage {
+  messages: ChatMessage[];
+  hasMore: boolean;
+  beforeCursor: string | null;
+}
+
+export const HISTORY_PAGE_SIZE = 50;
+
+export const fetchHistory = async (
+  sessionId: string,
+  options: { before?: string | null; limit?: number } = {}
+): Promise<HistoryPage> => {
+  const { data } = await apiClient.get<HistoryResponse>(`/api/chat/history/${sessionId}`, {
+    params: {
+      limit: options.limit ?? HISTORY_PAGE_SIZE,
+      ...(options.before ? { before: options.before } : {})
+    }
+  });
+
+  return {
+    messages: data.messages.map((message) => ({
+      id: message.message_id,
+      role: message.role,
+      content: message.content,
+      timestamp: message.timestamp
+    })),
+    hasMore: data.has_more,
+    beforeCursor: data.before_cursor
+  };
 };